@@ -0,0 +1,248 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Helpers to run computations in multiple processes.
+
+Worker processes are forked after the function to compute (and
+everything it refers to, e.g. a dataset and a measure) has been
+registered, so only the per-job arguments and results need to be
+pickled.  Memory of the parent process (e.g. the samples of a dataset)
+is shared with the workers copy-on-write, so arrays which are only
+read by the workers are neither pickled nor duplicated.  Arrays the
+workers should write into (e.g. to store their results) have to be
+allocated in memory which is shared across processes (see
+:func:`shared_empty` and :func:`shared_array`).
+
+The backend used to spawn processes is chosen by the `backend`
+argument of :func:`parallel_map`, and defaults to the value of the
+'parallel.backend' configuration setting ('multiprocessing' unless
+configured otherwise).
+"""
+
+__docformat__ = 'restructuredtext'
+
+import ctypes
+import numpy as np
+
+from mvpa import cfg
+from mvpa.base import externals, warning
+
+if __debug__:
+    from mvpa.base import debug
+
+__all__ = ['get_nproc', 'shared_empty', 'shared_array', 'parallel_map']
+
+_VALID_BACKENDS = ('multiprocessing', 'pprocess')
+
+# Registry of the functions which are being mapped.  Workers get
+# forked after registration, thus they can look up the function (and
+# its closure) by the key without any pickling involved.
+_registry = {}
+
+
+def get_nproc(nproc=None):
+    """Figure out the number of processes to use.
+
+    Parameters
+    ----------
+    nproc : None or int
+      If None -- number of all available cores is returned, otherwise
+      `nproc` itself.
+    """
+    if nproc is not None:
+        return nproc
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        pass
+    if externals.exists('pprocess'):
+        import pprocess
+        try:
+            return pprocess.get_number_of_cores() or 1
+        except AttributeError:
+            warning("pprocess version %s has no API to figure out maximal "
+                    "number of cores. Using 1"
+                    % externals.versions['pprocess'])
+    return 1
+
+
+def shared_empty(shape, dtype=float):
+    """Allocate an uninitialized array in memory shared across processes.
+
+    Parameters
+    ----------
+    shape : int or tuple of int
+      Shape of the array.
+    dtype : data-type
+      Data type of the array. Object dtypes are not supported.
+
+    Returns
+    -------
+    ndarray
+      Modifications done by forked processes are visible to the parent.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.hasobject:
+        raise ValueError("Arrays of object dtype cannot be shared")
+    from multiprocessing.sharedctypes import RawArray
+    shape = np.atleast_1d(shape)
+    # RawArray refuses to allocate empty buffers
+    buf = RawArray(ctypes.c_char, max(int(np.prod(shape)) * dtype.itemsize,
+                                      1))
+    return np.frombuffer(buf, dtype=dtype,
+                         count=int(np.prod(shape))).reshape(tuple(shape))
+
+
+def shared_array(a):
+    """Place a copy of an array into memory shared across processes.
+
+    Arrays which could not be shared (e.g. of object dtype or not
+    ndarrays at all) are returned as is.
+
+    Parameters
+    ----------
+    a : ndarray
+      Array to be shared.
+
+    Returns
+    -------
+    ndarray
+      Array of the same shape, dtype and content as `a`, but with its
+      data residing in a shared memory buffer.  Modifications done by
+      forked processes are visible to the parent.
+    """
+    if not isinstance(a, np.ndarray) or a.dtype.hasobject:
+        return a
+    out = shared_empty(a.shape, a.dtype)
+    out[...] = a
+    return out
+
+
+def _in_daemon():
+    """Whether we are running within a daemonic (e.g. worker) process"""
+    try:
+        import multiprocessing
+    except ImportError:
+        return False
+    return multiprocessing.current_process().daemon
+
+
+def _run_job(args):
+    """Helper to be executed within worker processes"""
+    key, ijob, job = args
+    return ijob, _registry[key](*job)
+
+
+def _map_multiprocessing(key, jobs, nproc):
+    import multiprocessing
+    pool = multiprocessing.Pool(nproc)
+    try:
+        # jobs are handed out one at a time to whichever worker is idle
+        for r in pool.imap_unordered(
+                _run_job, [(key, i, job) for i, job in enumerate(jobs)],
+                chunksize=1):
+            yield r
+    finally:
+        pool.terminate()
+
+
+def _map_pprocess(key, jobs, nproc):
+    import pprocess
+    queue = pprocess.Queue(limit=nproc)
+    compute = queue.manage(pprocess.MakeParallel(_run_job))
+    for i, job in enumerate(jobs):
+        compute((key, i, job))
+    # Queue yields results as soon as they are available
+    for r in queue:
+        yield r
+
+
+def parallel_map(func, jobs, nproc=None, backend=None, callback=None):
+    """Apply a function to each job in parallel processes.
+
+    Jobs are scheduled dynamically: each worker process takes the next
+    pending job as soon as it is done with the previous one.  So jobs of
+    varying duration are balanced across processes as long as there are
+    more jobs than processes.
+
+    Parameters
+    ----------
+    func : callable
+      Function to be called as ``func(*job)`` for each job.  It does not
+      have to be picklable (it could be a bound method or a closure),
+      since worker processes inherit it.  Its return value must be
+      picklable though.
+    jobs : list of tuple
+      Arguments for each call of `func`.
+    nproc : None or int
+      Maximal number of processes to use.  If None -- all available cores
+      will be used.  Within worker processes of another parallel_map
+      (e.g. a parallel searchlight inside of a parallel permutation test)
+      jobs are always run serially.
+    backend : None or {'multiprocessing', 'pprocess'}
+      How to spawn worker processes.  If None -- configuration setting
+      'parallel.backend' is consulted.
+    callback : None or callable
+      If provided, it gets called in the parent process as
+      ``callback(ijob, result)`` whenever a job is done.  Jobs complete in
+      arbitrary order.
+
+    Returns
+    -------
+    list
+      Results of `func` for every job in the order of `jobs`.
+    """
+    jobs = list(jobs)
+    nproc = min(get_nproc(nproc), len(jobs))
+    if nproc > 1 and _in_daemon():
+        # workers of an outer parallel_map are not allowed to have
+        # children, thus nested parallel calls are done serially
+        if __debug__:
+            debug('PAR', "Running %s serially within a worker process"
+                  % (func,))
+        nproc = 1
+    if nproc <= 1:
+        results = []
+        for ijob, job in enumerate(jobs):
+            results.append(func(*job))
+            if callback is not None:
+                callback(ijob, results[-1])
+        return results
+
+    if backend is None:
+        backend = cfg.get('parallel', 'backend', default='multiprocessing')
+    backend = backend.lower()
+    if not backend in _VALID_BACKENDS:
+        raise ValueError("Unknown parallel backend %r. Valid choices are %s"
+                         % (backend, _VALID_BACKENDS))
+    if backend == 'pprocess' and not externals.exists('pprocess'):
+        raise RuntimeError("The 'pprocess' module is required for the "
+                           "'pprocess' parallel backend. Please either "
+                           "install python-pprocess, or use "
+                           "'multiprocessing' backend")
+
+    if __debug__:
+        debug('PAR', "Mapping %s over %i jobs using %i %s processes"
+              % (func, len(jobs), nproc, backend))
+
+    key = id(func)
+    _registry[key] = func
+    results = [None] * len(jobs)
+    try:
+        if backend == 'pprocess':
+            mapped = _map_pprocess(key, jobs, nproc)
+        else:
+            mapped = _map_multiprocessing(key, jobs, nproc)
+        for ijob, result in mapped:
+            results[ijob] = result
+            if callback is not None:
+                callback(ijob, result)
+    finally:
+        del _registry[key]
+    return results
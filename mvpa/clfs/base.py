@@ -25,6 +25,7 @@ from mvpa.misc.support import idhash
 from mvpa.base.state import ConditionalAttribute
 from mvpa.base.param import Parameter
 from mvpa.misc.attrmap import AttributeMap
+from mvpa.misc.sampleslookup import SamplesLookup
 from mvpa.base.dochelpers import _str
 
 from mvpa.clfs.transerror import ConfusionMatrix, RegressionStatistics
@@ -158,6 +159,9 @@ class Classifier(Learner):
 
         self._set_retrainable(self.params.retrainable, force=True)
 
+        self.__suffstats = None
+        """Sufficient statistics of a full dataset, if cached"""
+
         # deprecate
         #self.__trainedidhash = None
         #"""Stores id of the dataset on which it was trained to signal
@@ -332,6 +336,101 @@ class Classifier(Learner):
         raise NotImplementedError
 
 
+    #
+    # Methods which are needed for classifiers trained from
+    # sufficient statistics
+    #
+    def cache_suffstats(self, dataset):
+        """Precompute sufficient statistics of a full dataset
+
+        Only classifiers tagged 'suffstats' make use of it.  Training
+        on a subset of `dataset` (e.g. in a cross-validation fold) then
+        subtracts contribution of the left out samples from the cached
+        statistics instead of accumulating them from scratch.
+
+        Parameters
+        ----------
+        dataset : Dataset or None
+          Dataset to cache statistics for.  None drops the cache.
+        """
+        tags = self.__tags__
+        if dataset is None or not 'suffstats' in tags or 'meta' in tags:
+            self.__suffstats = None
+            return
+        targets = dataset.sa[self.get_space()].value
+        ulabels = dataset.sa[self.get_space()].unique
+        center = np.mean(dataset.samples, axis=0)
+        lookup = SamplesLookup(dataset)
+        if __debug__:
+            debug("CLF", "Caching sufficient statistics of %s for %s"
+                  % (dataset, self))
+        self.__suffstats = (lookup, dataset, targets, ulabels, center,
+                            self._compute_suffstats(dataset.samples, targets,
+                                                    ulabels, center))
+
+
+    def _compute_suffstats(self, samples, targets, ulabels, center):
+        """Compute sufficient statistics (to be overridden)
+
+        Returned statistics must be a tuple of arrays additive across
+        samples, so statistics of any subset of samples could be
+        obtained by subtracting those of the rest.  `center` is the
+        mean sample of the full dataset, which might be subtracted from
+        the samples to keep the sums well conditioned.
+        """
+        raise NotImplementedError
+
+
+    def _get_suffstats(self, dataset):
+        """Sufficient statistics for training on `dataset`
+
+        Statistics are derived from the cached ones whenever `dataset`
+        is a subset of the cached dataset.
+
+        Returns
+        -------
+        tuple
+          (ulabels, center, stats), where ulabels might contain labels
+          which have no samples in `dataset`.
+        """
+        space = self.get_space()
+        targets = dataset.sa[space].value
+        cache = self.__suffstats
+        if cache is not None:
+            lookup, full, full_targets, ulabels, center, stats = cache
+            try:
+                ids = lookup(dataset)
+            except (KeyError, AttributeError):
+                ids = None
+            # samples and targets must not have been altered (e.g. by
+            # generators), which is still cheaper to check than computing
+            # the statistics anew
+            if ids is not None and len(ids) \
+                   and dataset.nfeatures == full.nfeatures \
+                   and np.all(full_targets[ids] == targets) \
+                   and np.all(full.samples[ids] == dataset.samples):
+                left = np.ones(len(full), dtype=bool)
+                left[ids] = False
+                nleft = np.sum(left)
+                # each sample must be present once
+                if nleft < len(ids) and nleft + len(ids) == len(full):
+                    if __debug__:
+                        debug("CLF_", "Deriving sufficient statistics of %s "
+                              "by leaving out %d samples" % (dataset, nleft))
+                    if nleft:
+                        stats = [s - l for s, l in
+                                 zip(stats, self._compute_suffstats(
+                                     full.samples[left], full_targets[left],
+                                     ulabels, center))]
+                    return ulabels, center, stats
+
+        ulabels = dataset.sa[space].unique
+        center = np.mean(dataset.samples, axis=0)
+        return ulabels, center, \
+               self._compute_suffstats(dataset.samples, targets,
+                                       ulabels, center)
+
+
     def _prepredict(self, dataset):
         """Functionality prior prediction
         """
@@ -33,7 +33,7 @@ class BLR(Classifier):
         doc="Log Marginal Likelihood")
 
 
-    __tags__ = [ 'blr', 'regression', 'linear' ]
+    __tags__ = [ 'blr', 'regression', 'linear', 'suffstats' ]
 
     def __init__(self, sigma_p = None, sigma_noise=1.0, **kwargs):
         """Initialize a BLR regression analysis.
@@ -85,11 +85,16 @@ class BLR(Classifier):
         raise NotImplementedError
 
 
+    def _compute_suffstats(self, samples, targets, ulabels, center):
+        """Cross-products of the samples (with intercept) and targets"""
+        # add one fake column of '1.0' to model the intercept:
+        samples = np.hstack([samples, np.ones((samples.shape[0], 1))])
+        return np.dot(samples.T, samples), np.dot(samples.T, targets)
+
+
     def _train(self, data):
         """Train regression using `data` (`Dataset`).
         """
-        # BLR relies on numerical labels
-        train_labels = self._attrmap.to_numeric(data.sa[self.get_space()].value)
         # provide a basic (i.e. identity matrix) and correct prior
         # sigma_p, if not provided before or not compliant to 'data':
         if self.sigma_p == None: # case: not provided
@@ -100,19 +105,22 @@ class BLR(Classifier):
             # ...then everything is OK :)
             pass
 
-        # add one fake column of '1.0' to model the intercept:
-        self.samples_train = np.hstack([data.samples,np.ones((data.samples.shape[0],1))])
-        if type(self.sigma_p)!=type(self.samples_train): # if sigma_p is a number...
-            self.sigma_p = np.eye(self.samples_train.shape[1])*self.sigma_p # convert in matrix
+        if type(self.sigma_p)!=np.ndarray: # if sigma_p is a number...
+            self.sigma_p = np.eye(data.samples.shape[1]+1)*self.sigma_p # convert in matrix
             pass
 
-        self.A_inv = np.linalg.inv(1.0/(self.sigma_noise**2) *
-                                  np.dot(self.samples_train.T,
-                                        self.samples_train) +
+        targets = data.sa[self.get_space()].value
+        if np.issubdtype(targets.dtype, 'c'):
+            # BLR relies on numerical labels
+            train_labels = self._attrmap.to_numeric(targets)
+            xx, xy = self._compute_suffstats(data.samples, train_labels,
+                                             None, None)
+        else:
+            ulabels, center, (xx, xy) = self._get_suffstats(data)
+
+        self.A_inv = np.linalg.inv(1.0/(self.sigma_noise**2) * xx +
                                   np.linalg.inv(self.sigma_p))
-        self.w = 1.0/(self.sigma_noise**2) * np.dot(self.A_inv,
-                                                   np.dot(self.samples_train.T,
-                                                         train_labels))
+        self.w = 1.0/(self.sigma_noise**2) * np.dot(self.A_inv, xy)
         pass
 
 
@@ -14,10 +14,11 @@ __docformat__ = 'restructuredtext'
 # TODO: Make all distance functions accept 2D matrices samples x features
 #       and compute the distance matrix between all samples. They would
 #       need to be capable of dealing with unequal number of rows!
-#       If we would have that, we could make use of them in kNN.
+#       Those which do can be computed in memory-bounded tiles with
+#       distance_blocks() and tiled_distance().
 
 import numpy as np
-from mvpa.base import externals
+from mvpa.base import externals, cfg
 
 if __debug__:
     from mvpa.base import debug, warning
@@ -191,10 +192,11 @@ def squared_euclidean_distance(data1, data2=None, weight=None):
         else:
             data2w = data2 * weight
 
-    squared_euclidean_distance_matrix = \
-        (data1w * data1).sum(1)[:, None] \
-        -2 * np.dot(data1w, data2.T) \
-        + (data2 * data2w).sum(1)
+    # accumulate in place to avoid temporaries of the size of the result
+    squared_euclidean_distance_matrix = np.dot(data1w, data2.T)
+    squared_euclidean_distance_matrix *= -2
+    squared_euclidean_distance_matrix += (data1w * data1).sum(1)[:, None]
+    squared_euclidean_distance_matrix += (data2 * data2w).sum(1)
 
     # correction to some possible numerical instabilities:
     less0 = squared_euclidean_distance_matrix < 0
@@ -252,12 +254,183 @@ def one_minus_correlation(X, Y):
     Zy = Y - np.c_[Y.mean(axis=1)]
     Zy /= np.c_[Y.std(axis=1)]
 
-    C = ((np.matrix(Zx) * np.matrix(Zy).T) / Zx.shape[1]).A
+    C = np.dot(Zx, Zy.T)
+    C /= Zx.shape[1]
 
     # let it behave like a distance, i.e. smaller is closer
     C -= 1.0
 
-    return np.abs(C)
+    return np.abs(C, C)
+
+
+def _get_max_memory(max_memory):
+    """Memory budget (in MB) of a tiled distance computation"""
+    if max_memory is None:
+        max_memory = cfg.get_as_dtype('distance', 'max memory', float,
+                                      default=256.0)
+    return max_memory
+
+
+def _prepare_tiles(data1, data2, dtype, kwargs):
+    """Cast input arrays (and floating point array arguments) to `dtype`"""
+    data1 = np.asarray(data1)
+    if data2 is not None:
+        data2 = np.asarray(data2)
+    if dtype is None:
+        dtypes = [d.dtype for d in (data1, data2) if d is not None]
+        dtype = np.find_common_type(dtypes, [])
+        if not np.issubdtype(dtype, 'f'):
+            dtype = np.dtype('float64')
+    dtype = np.dtype(dtype)
+    data1 = data1.astype(dtype)
+    if data2 is None:
+        data2 = data1
+    else:
+        data2 = data2.astype(dtype)
+    kwargs = kwargs.copy()
+    for k, v in kwargs.iteritems():
+        if isinstance(v, np.ndarray) and np.issubdtype(v.dtype, 'f'):
+            kwargs[k] = v.astype(dtype)
+    return data1, data2, dtype, kwargs
+
+
+def _get_tile_rows(nsamples2, nfeatures, itemsize, max_memory):
+    """Number of rows of a tile fitting into `max_memory` MB.
+
+    Besides the tile itself, distance functions typically allocate a few
+    temporaries of the same size (or of a size of the rows of data1), so
+    a tile is accounted for 4 times.
+    """
+    rowbytes = 4 * (nsamples2 + nfeatures) * itemsize
+    return max(1, int(max_memory * 2**20 / max(rowbytes, 1)))
+
+
+def distance_blocks(data1, data2=None, dfx=squared_euclidean_distance,
+                    max_memory=None, blocksize=None, dtype=None, **kwargs):
+    """Generate the distance matrix between two datasets in blocks of rows.
+
+    Only a single block of the (N x M) distance matrix is held in memory at
+    a time, so callers that need just a reduction of each row (e.g. the
+    k smallest distances, or a sum) never have to hold the full matrix.
+
+    Parameters
+    ----------
+    data1 : np.ndarray
+      First dataset (N x F). Blocks are taken along its rows.
+    data2 : np.ndarray or None
+      Second dataset (M x F). If None, distances among the samples of
+      `data1` are computed.
+    dfx : functor
+      Distance function, called as `dfx(block_of_data1, data2, **kwargs)`.
+    max_memory : float or None
+      Memory budget (in MB) for a single block. If None, the value of the
+      'max memory' option in the 'distance' section of the configuration
+      is used (default: 256).
+    blocksize : int or None
+      Explicit number of rows per block, overrides `max_memory`.
+    dtype : dtype or None
+      Floating point type of the computation (e.g. 'float32' halves the
+      memory demand). Floating point array arguments in `kwargs` (e.g.
+      `weight`) are cast as well. If None, the type of the input is kept
+      (integer input is converted to float64).
+    **kwargs
+      Additional arguments passed to `dfx`.
+
+    Returns
+    -------
+    generator
+      Yields `(slice, block)` tuples, where `block` contains the distances
+      between `data1[slice]` and all samples in `data2`.
+
+    Examples
+    --------
+
+    >>> import numpy as np
+    >>> from mvpa.clfs.distance import distance_blocks
+    >>> X = np.random.rand(20,80)
+    >>> Y = np.random.rand(5,80)
+    >>> mins = np.hstack([b.min(axis=1) for s, b in
+    ...                   distance_blocks(X, Y, blocksize=3)])
+    >>> print mins.shape
+    (20,)
+
+    """
+    data1, data2, dtype, kwargs = _prepare_tiles(data1, data2, dtype, kwargs)
+    if blocksize is None:
+        blocksize = _get_tile_rows(len(data2), data1.shape[1],
+                                   dtype.itemsize,
+                                   _get_max_memory(max_memory))
+    for start in xrange(0, len(data1), blocksize):
+        sl = slice(start, min(start + blocksize, len(data1)))
+        yield sl, dfx(data1[sl], data2, **kwargs)
+
+
+def tiled_distance(data1, data2=None, dfx=squared_euclidean_distance,
+                   max_memory=None, blocksize=None, dtype=None, out=None,
+                   nproc=1, **kwargs):
+    """Compute the distance matrix between two datasets tile by tile.
+
+    The result is filled block-wise into a single output array, so none of
+    the temporaries of `dfx` grows beyond the size of a block. Blocks can
+    be computed in parallel threads (NumPy releases the GIL in the matrix
+    products dominating distance computations).
+
+    Parameters
+    ----------
+    data1, data2, dfx, max_memory, blocksize, dtype, **kwargs
+      See :func:`distance_blocks`. `max_memory` is the budget for the
+      temporaries of all simultaneously computed blocks, not counting the
+      output array.
+    out : np.ndarray or None
+      Array (N x M) to store the result in. If None, a new array of
+      `dtype` is allocated.
+    nproc : int
+      Number of threads to compute blocks concurrently.
+
+    Returns
+    -------
+    np.ndarray
+      The (N x M) distance matrix (`out` if it was provided).
+    """
+    data1, data2, dtype, kwargs = _prepare_tiles(data1, data2, dtype, kwargs)
+    shape = (len(data1), len(data2))
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError, "Output array must be of shape %s (got %s)" \
+              % (shape, out.shape)
+    if blocksize is None:
+        blocksize = _get_tile_rows(len(data2), data1.shape[1],
+                                   dtype.itemsize,
+                                   _get_max_memory(max_memory) / max(nproc, 1))
+    starts = range(0, len(data1), blocksize)
+
+    def _fill(starts):
+        for start in starts:
+            sl = slice(start, min(start + blocksize, len(data1)))
+            out[sl] = dfx(data1[sl], data2, **kwargs)
+
+    if nproc <= 1 or len(starts) < 2:
+        _fill(starts)
+        return out
+
+    import threading
+    errors = []
+    def _worker(starts):
+        try:
+            _fill(starts)
+        except Exception, e:
+            errors.append(e)
+    # distribute blocks round-robin across the threads
+    threads = [threading.Thread(target=_worker, args=(starts[i::nproc],))
+               for i in xrange(min(nproc, len(starts)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if len(errors):
+        raise errors[0]
+    return out
 
 
 def pnorm_w_python(data1, data2=None, weight=None, p=2,
@@ -46,7 +46,7 @@ class GDA(Classifier):
 
     """
 
-    __tags__ = ['binary', 'multiclass']
+    __tags__ = ['binary', 'multiclass', 'suffstats']
 
 
     prior = Parameter('laplacian_smoothing',
@@ -95,46 +95,56 @@ class GDA(Classifier):
         return priors
 
 
+    def _compute_suffstats(self, samples, targets, ulabels, center):
+        """Number of samples, sums and scatter matrices per class"""
+        X = samples - center
+        nfeatures = X.shape[1]
+        nlabels = len(ulabels)
+        counts = np.zeros(nlabels)
+        sums = np.zeros((nlabels, nfeatures))
+        scatters = np.zeros((nlabels, nfeatures, nfeatures))
+        for il, l in enumerate(ulabels):
+            Xl = X[targets == l]
+            counts[il] = len(Xl)
+            sums[il] = np.sum(Xl, axis=0)
+            scatters[il] = np.dot(Xl.T, Xl)
+        return counts, sums, scatters
+
+
     def _train(self, dataset):
         """Train the classifier using `dataset` (`Dataset`).
         """
         params = self.params
-        targets_sa_name = self.get_space()
-        targets_sa = dataset.sa[targets_sa_name]
 
         # get the dataset information into easy vars
         X = dataset.samples
-        labels = targets_sa.value
-        self.ulabels = ulabels = targets_sa.unique
+        ulabels, center, (counts, sums, scatters) = \
+                 self._get_suffstats(dataset)
+        # statistics could be derived for a subset lacking some labels
+        # TODO: degenerate case... no samples for known label for
+        #       some reason?
+        non0labels = counts > 0
+        if not np.all(non0labels):
+            ulabels = ulabels[non0labels]
+            counts = counts[non0labels]
+            sums, scatters = sums[non0labels], scatters[non0labels]
+        self.ulabels = ulabels
         nlabels = len(ulabels)
-        label2index = dict((l, il) for il, l in enumerate(ulabels))
 
         # set the feature dimensions
         nsamples = len(X)
-        nfeatures = dataset.nfeatures
 
-        self.means = means = \
-                     np.zeros((nlabels, nfeatures))
         # degenerate dimension are added for easy broadcasting later on
         # XXX might want to remove -- for now taken from GNB as is
-        self.nsamples_per_class = nsamples_per_class \
-                                  = np.zeros((nlabels, 1))
-        self.cov = cov = \
-                     np.zeros((nlabels, nfeatures, nfeatures))
-
-
-        # Estimate cov
-        # better loop than repmat! ;)
-        for l, il in label2index.iteritems():
-            Xl = X[labels == l]
-            nsamples_per_class[il] = len(Xl)
-            # TODO: degenerate case... no samples for known label for
-            #       some reason?
-            means[il] = np.mean(Xl, axis=0)
-            # since we have means already lets do manually cov here
-            Xldm = Xl - means[il]
-            cov[il] = np.dot(Xldm.T, Xldm)
-            # scaling will be done correspondingly in LDA or QDA
+        self.nsamples_per_class = nsamples_per_class = counts[:, np.newaxis]
+        # means of the centered data
+        means = sums / nsamples_per_class
+        # cov around the class means, i.e. scatter less the
+        # contribution of the mean.
+        # scaling will be done correspondingly in LDA or QDA
+        self.cov = scatters \
+                   - means[:, :, np.newaxis] * sums[:, np.newaxis, :]
+        self.means = means + center
 
         # Store prior probabilities
         self.priors = self._get_priors(nlabels, nsamples, nsamples_per_class)
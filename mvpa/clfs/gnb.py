@@ -35,6 +35,10 @@ if __debug__:
 
 __all__ = [ "GNB" ]
 
+# number of sample values reduced at once in double precision while
+# computing sufficient statistics (bounds the temporaries to 8MB each)
+_SUFFSTATS_BLOCK_SIZE = 2**20
+
 class GNB(Classifier):
     """Gaussian Naive Bayes `Classifier`.
 
@@ -56,6 +60,7 @@ class GNB(Classifier):
     - makes use of NumPy broadcasting mechanism, so should be
       relatively efficient
     - should work for any dimensionality of samples
+    - could be trained incrementally (see `partial_fit`)
 
     `GNB` is listed both as linear and non-linear classifier, since
     specifics of separating boundary depends on the data and/or
@@ -77,7 +82,7 @@ class GNB(Classifier):
     #     since it depends actually on the data -- no clear way,
     #     so set both linear and non-linear
     __tags__ = [ 'gnb', 'linear', 'non-linear',
-                       'binary', 'multiclass' ]
+                       'binary', 'multiclass', 'suffstats' ]
 
     common_variance = Parameter(False, allowedtype='bool',
              doc="""Use the same variance across all classes.""")
@@ -92,6 +97,15 @@ class GNB(Classifier):
              exponentiation and loose precision.
              If set, logprobs are stored in `values`""")
 
+    dtype = Parameter('float64', allowedtype='basestring',
+             choices=["float64", "float32"],
+             doc="""Precision of the estimated means and variances, and of
+             computations on the samples during prediction.  'float32'
+             halves memory demands for large number of features.
+             Sufficient statistics are accumulated in 'float64' over
+             blocks of samples, so training does not need a double
+             precision copy of all the samples either.""")
+
     normalize = Parameter(False, allowedtype='bool',
              doc="""Normalize (log)prob by P(data).  Requires probabilities thus
              for `logprob` case would require exponentiation of 'logprob's, thus
@@ -117,6 +131,8 @@ class GNB(Classifier):
 
         # Define internal state of classifier
         self._norm_weight = None
+        self._suffstats = None
+        """Statistics the model was derived from, for `partial_fit`"""
 
     def _get_priors(self, nlabels, nsamples, nsamples_per_class):
         """Return prior probabilities given data
@@ -138,60 +154,138 @@ class GNB(Classifier):
                 % self.params.prior)
         return priors
 
-    def _train(self, dataset):
-        """Train the classifier using `dataset` (`Dataset`).
-        """
-        params = self.params
-        targets_sa_name = self.get_space()
-        targets_sa = dataset.sa[targets_sa_name]
+    def _compute_suffstats(self, samples, targets, ulabels, center):
+        """Number of samples, sums and sums of squares per class
 
-        # get the dataset information into easy vars
-        X = dataset.samples
-        labels = targets_sa.value
-        self.ulabels = ulabels = targets_sa.unique
+        Statistics are accumulated in double precision regardless of
+        `dtype`, since variances are derived from differences of sums of
+        squares which lose all precision in float32 whenever classes are
+        far apart relative to their spread.  Samples are reduced in blocks
+        of rows, so double precision temporaries do not grow with the
+        number of samples.
+        """
+        samples = np.asanyarray(samples)
+        nsamples = len(samples)
+        samples = samples.reshape((nsamples, -1))
+        center = np.ravel(center).astype(np.float64)
+        ulabels = np.asanyarray(ulabels)
         nlabels = len(ulabels)
-        label2index = dict((l, il) for il, l in enumerate(ulabels))
 
-        # set the feature dimensions
-        nsamples = len(X)
-        s_shape = X.shape[1:]           # shape of a single sample
+        nsamples_per_class = np.zeros(nlabels)
+        sums = np.zeros((nlabels, samples.shape[1]))
+        sqsums = np.zeros((nlabels, samples.shape[1]))
+        step = max(1, _SUFFSTATS_BLOCK_SIZE // max(samples.shape[1], 1))
+        for start in xrange(0, nsamples, step):
+            X = samples[start:start + step].astype(np.float64)
+            X -= center
+            # indicator of the class per each sample
+            members = (ulabels[:, np.newaxis]
+                       == targets[np.newaxis, start:start + step]
+                       ).astype(np.float64)
+            nsamples_per_class += members.sum(axis=1)
+            sums += np.dot(members, X)
+            X **= 2
+            sqsums += np.dot(members, X)
+        return nsamples_per_class, sums, sqsums
 
-        self.means = means = \
-                     np.zeros((nlabels, ) + s_shape)
-        self.variances = variances = \
-                     np.zeros((nlabels, ) + s_shape)
-        # degenerate dimension are added for easy broadcasting later on
-        nsamples_per_class = np.zeros((nlabels,) + (1,)*len(s_shape))
 
-        # Estimate means and number of samples per each label
-        for s, l in zip(X, labels):
-            il = label2index[l]         # index of the label
-            nsamples_per_class[il] += 1
-            means[il] += s
+    def _train(self, dataset):
+        """Train the classifier using `dataset` (`Dataset`).
+        """
+        ulabels, center, stats = self._get_suffstats(dataset)
+        self._set_model(ulabels, center, stats, dataset.samples.shape[1:])
 
-        # helper function - squash all dimensions but 1
-        squash = lambda x: np.atleast_1d(x.squeeze())
-        ## Actually compute the means
-        non0labels = (squash(nsamples_per_class) != 0)
-        means[non0labels] /= nsamples_per_class[non0labels]
+        if __debug__ and 'GNB' in debug.active:
+            X = dataset.samples
+            debug('GNB', "training finished on data.shape=%s " % (X.shape, )
+                  + "min:max(data)=%f:%f" % (np.min(X), np.max(X)))
 
-        # Store prior probabilities
-        self.priors = self._get_priors(nlabels, nsamples, nsamples_per_class)
 
-        # Estimate variances
-        # better loop than repmat! ;)
-        for s, l in zip(X, labels):
-            il = label2index[l]         # index of the label
-            variances[il] += (s - means[il])**2
+    def partial_fit(self, dataset):
+        """Update the classifier with additional training samples
+
+        Statistics of the new samples get added to the ones the
+        classifier was trained on, so the result is the same as of
+        training on all the samples at once (up to round-off errors),
+        without revisiting previous samples.  New labels are allowed.
+        Untrained classifier simply gets trained on `dataset`.
+
+        Parameters
+        ----------
+        dataset : Dataset
+          Additional training samples.
+        """
+        if not self.trained or self._suffstats is None:
+            self.train(dataset)
+            return
+        ulabels, center, stats, s_shape = self._suffstats
+        if dataset.samples.shape[1:] != s_shape:
+            raise ValueError, \
+                  "%s was trained on samples of shape %s, got %s" \
+                  % (self, s_shape, dataset.samples.shape[1:])
+        targets_sa = dataset.sa[self.get_space()]
+        new_ulabels = np.union1d(ulabels, targets_sa.unique)
+        if len(new_ulabels) != len(ulabels):
+            # extend statistics with empty entries for new labels
+            ids = np.searchsorted(new_ulabels, ulabels)
+            for i, s in enumerate(stats):
+                stats[i] = np.zeros((len(new_ulabels),) + s.shape[1:],
+                                    dtype=s.dtype)
+                stats[i][ids] = s
+            ulabels = new_ulabels
+        stats = [s + n for s, n in
+                 zip(stats, self._compute_suffstats(dataset.samples,
+                                                    targets_sa.value,
+                                                    ulabels, center))]
+        self._set_model(ulabels, center, stats, s_shape)
+
+        ca = self.ca
+        if ca.is_enabled('trained_targets'):
+            ca.trained_targets = ulabels
+        ca.trained_nsamples = int(np.sum(stats[0]))
+
+
+    def _set_model(self, ulabels, center, stats, s_shape):
+        """Derive model parameters from the sufficient statistics
+        """
+        params = self.params
+        nsamples_per_class, sums, sqsums = stats
+        # statistics could be derived for a subset lacking some labels
+        non0labels = nsamples_per_class > 0
+        if not np.all(non0labels):
+            ulabels = ulabels[non0labels]
+            nsamples_per_class = nsamples_per_class[non0labels]
+            sums, sqsums = sums[non0labels], sqsums[non0labels]
+        self._suffstats = (ulabels, center,
+                           [nsamples_per_class, sums, sqsums], s_shape)
+        self.ulabels = ulabels
+        nlabels = len(ulabels)
+        nsamples = np.sum(nsamples_per_class)
 
-        ## Actually compute the variances
+        # Actually compute the means and variances out of the sums
+        ns = nsamples_per_class[:, np.newaxis]
+        means = sums / ns
+        # guard against negative round-off errors
+        variances = np.maximum(sqsums - sums * means, 0)
         if params.common_variance:
             # we need to get global std
             cvar = np.sum(variances, axis=0)/nsamples # sum across labels
             # broadcast the same variance across labels
             variances[:] = cvar
         else:
-            variances[non0labels] /= nsamples_per_class[non0labels]
+            variances /= ns
+
+        means += np.ravel(center)
+        # only the model is kept in the requested precision
+        self.means = means.astype(params.dtype).reshape((nlabels, ) + s_shape)
+        self.variances = variances = \
+            variances.astype(params.dtype).reshape((nlabels, ) + s_shape)
+
+        # Store prior probabilities
+        # degenerate dimension are added for easy broadcasting later on
+        self.priors = self._get_priors(
+            nlabels, nsamples,
+            nsamples_per_class.reshape((nlabels,) + (1,)*len(s_shape)))
 
         # Precompute and store weighting coefficient for Gaussian
         if params.logprob:
@@ -200,10 +294,6 @@ class GNB(Classifier):
         else:
             self._norm_weight = 1.0/np.sqrt(2*np.pi*variances)
 
-        if __debug__ and 'GNB' in debug.active:
-            debug('GNB', "training finished on data.shape=%s " % (X.shape, )
-                  + "min:max(data)=%f:%f" % (np.min(X), np.max(X)))
-
 
     def _untrain(self):
         """Untrain classifier and reset all learnt params
@@ -212,6 +302,7 @@ class GNB(Classifier):
         self.variances = None
         self.ulabels = None
         self.priors = None
+        self._suffstats = None
         super(GNB, self)._untrain()
 
 
@@ -220,6 +311,8 @@ class GNB(Classifier):
         """Predict the output for the provided data.
         """
         params = self.params
+        # no upcasting of temporary arrays in float32 mode
+        data = np.asarray(data, dtype=self.means.dtype)
         # argument of exponentiation
         scaled_distances = \
             -0.5 * (((data - self.means[:, np.newaxis, ...])**2) \
@@ -10,10 +10,6 @@
 
 __docformat__ = 'restructuredtext'
 
-import sys
-# not worthy of externals checking
-_dict_has_key = sys.version_info >= (2, 5)
-
 import numpy as np
 
 from mvpa.base import warning
@@ -26,6 +22,9 @@ from mvpa.clfs.distance import squared_euclidean_distance
 
 __all__ = [ 'kNN' ]
 
+# np.argpartition is available only since numpy 1.8
+_has_argpartition = hasattr(np, 'argpartition')
+
 if __debug__:
     from mvpa.base import debug
 
@@ -60,7 +59,7 @@ class kNN(Classifier):
                       'notrain2predict' ]
 
     def __init__(self, k=2, dfx=squared_euclidean_distance,
-                 voting='weighted', **kwargs):
+                 voting='weighted', blocksize=None, **kwargs):
         """
         Parameters
         ----------
@@ -74,6 +73,11 @@ class kNN(Classifier):
           Possible values are 'majority' (simple majority of classes
           determines vote) and 'weighted' (votes are weighted according to the
           relative frequencies of each class in the training data).
+        blocksize : int or None
+          Number of test samples for which distances to the training samples
+          are computed at once.  Limits memory use to a blocksize x ntrain
+          distance matrix (unless the `distances` conditional attribute is
+          enabled).  None processes all test samples in a single block.
         **kwargs
           Additonal arguments are passed to the base class.
         """
@@ -84,7 +88,11 @@ class kNN(Classifier):
         self.__k = k
         self.__dfx = dfx
         self.__voting = voting
+        self.__blocksize = blocksize
         self.__data = None
+        self.__ulabels = None
+        self.__codes = None
+        self.__weights = None
 
 
     def __repr__(self, prefixes=[]):
@@ -92,7 +100,8 @@ class kNN(Classifier):
         """
         return super(kNN, self).__repr__(
             ["k=%d" % self.__k, "dfx=%s" % self.__dfx,
-             "voting=%s" % repr(self.__voting)]
+             "voting=%s" % repr(self.__voting),
+             "blocksize=%s" % repr(self.__blocksize)]
             + prefixes)
 
 
@@ -104,7 +113,8 @@ class kNN(Classifier):
     def _train(self, data):
         """Train the classifier.
 
-        For kNN it is degenerate -- just stores the data.
+        For kNN it is degenerate -- just stores the data (and integer codes
+        of its labels for fast voting).
         """
         self.__data = data
         if __debug__:
@@ -114,12 +124,49 @@ class kNN(Classifier):
                         "Overflow on arithmetic operations might result in"+\
                         " errors. Please convert dataset's samples into" +\
                         " floating datatype if any error is reported.")
-        self.__weights = None
 
-        # create dictionary with an item for each condition
-        uniquelabels = data.sa[self.get_space()].unique
-        self.__votes_init = dict(zip(uniquelabels,
-                                     [0] * len(uniquelabels)))
+        targets_sa = data.sa[self.get_space()]
+        uniquelabels = targets_sa.unique
+        # integer code of each training sample's label, i.e. its index
+        # within uniquelabels (which are sorted)
+        self.__ulabels = uniquelabels
+        self.__codes = np.searchsorted(uniquelabels, targets_sa.value)
+
+        # relative proportion of samples belonging to each class
+        Nlabels = len(self.__codes)
+        counts = np.bincount(self.__codes, minlength=len(uniquelabels))
+        self.__weights = 1.0 - (counts / float(Nlabels))
+
+
+    def _get_knns(self, dists):
+        """Indices of the `k` smallest distances in each row of `dists`.
+
+        Neighbors are not ordered by distance, since voting does not
+        care.
+        """
+        k = self.__k
+        if k >= dists.shape[1]:
+            return np.argsort(dists, axis=1)
+        if _has_argpartition:
+            return np.argpartition(dists, k - 1, axis=1)[:, :k]
+        return dists.argsort(axis=1)[:, :k]
+
+
+    def _get_votes(self, knns):
+        """Number of votes per class for each row of neighbor indices.
+
+        Returns an (nsamples x nclasses) integer array with columns in the
+        order of the unique training labels.
+        """
+        knns = np.atleast_2d(knns)
+        nsamples = len(knns)
+        nlabels = len(self.__ulabels)
+        # offset codes of each row into its own block of nlabels bins, so
+        # a single bincount counts all rows at once
+        bins = (self.__codes[knns]
+                + (np.arange(nsamples) * nlabels)[:, None]).ravel()
+        return np.bincount(bins, minlength=nsamples * nlabels).reshape(
+                    nsamples, nlabels)
 
 
     @accepts_dataset_as_samples
@@ -140,38 +187,50 @@ class kNN(Classifier):
                 raise ValueError, "Length of data samples (features) does " \
                                   "not match the classifier."
 
+        if not self.__voting in ('majority', 'weighted'):
+            raise ValueError, "kNN told to perform unknown voting '%s'." \
+                  % self.__voting
+
+        store_dists = self.ca.is_enabled('distances')
+        blocksize = self.__blocksize
+        if blocksize is None or blocksize <= 0:
+            blocksize = max(len(data), 1)
+
         # compute the distance matrix between training and test data with
         # distances stored row-wise, ie. distances between test sample [0]
-        # and all training samples will end up in row 0
-        dists = self.__dfx(self.__data.samples, data).T
-        if self.ca.is_enabled('distances'):
+        # and all training samples will end up in row 0.  It is done in
+        # blocks of test samples, so only a blocksize x ntrain matrix has
+        # to be kept in memory unless distances are requested
+        train = self.__data.samples
+        votes, dists_all = [], []
+        for start in xrange(0, len(data), blocksize):
+            dists = self.__dfx(train, data[start:start + blocksize]).T
+            if store_dists:
+                dists_all.append(dists)
+            votes.append(self._get_votes(self._get_knns(dists)))
+        if len(votes):
+            votes = np.vstack(votes)
+        else:
+            votes = np.zeros((0, len(self.__ulabels)), dtype=int)
+
+        if store_dists:
+            if len(dists_all):
+                dists = np.vstack(dists_all)
+            else:
+                dists = np.zeros((0, len(train)))
             # .sa.copy() now does deepcopying by default
             self.ca.distances = Dataset(dists, fa=self.__data.sa.copy())
 
-        # determine the k nearest neighbors per test sample
-        knns = dists.argsort(axis=1)[:, :self.__k]
-
-        # predicted class labels will go here
-        predicted = []
+        if self.__voting == 'weighted':
+            votes = votes * self.__weights
 
-        if self.__voting == 'majority':
-            vfx = self.get_majority_vote
-        elif self.__voting == 'weighted':
-            vfx = self.get_weighted_vote
-        else:
-            raise ValueError, "kNN told to perform unknown voting '%s'." \
-                  % self.__voting
-
-        # perform voting
-        results = [vfx(knn) for knn in knns]
-
-        # extract predictions
-        predicted = [r[0] for r in results]
+        # find the class with most votes
+        predicted = list(self.__ulabels[votes.argmax(axis=1)])
 
         # store the predictions in the state. Relies on State._setitem to do
         # nothing if the relevant state member is not enabled
         self.ca.predictions = predicted
-        self.ca.estimates = np.array([r[1] for r in results])
+        self.ca.estimates = votes
 
         return predicted
 
@@ -180,81 +239,24 @@ class kNN(Classifier):
     def get_majority_vote(self, knn_ids):
         """Simple voting by choosing the majority of class neighbors.
         """
-        # local bindings
-        _data = self.__data
-
-        targets_sa_name = self.get_space()
-        targets_sa = _data.sa[targets_sa_name]
-
-        labels = targets_sa.value
-        uniquelabels = targets_sa.unique
-
-        # number of occerences for each unique class in kNNs
-        votes = self.__votes_init.copy()
-        for nn in knn_ids:
-            votes[labels[nn]] += 1
-
-        # find the class with most votes
+        votes = self._get_votes(knn_ids)[0]
         # return votes as well to store them in the state
-        if _dict_has_key:
-            # approx 5% faster implementation than below
-            maxvotes = max(votes.iteritems(), key=lambda x:x[1])[0]
-        else:
-            # no key keyword for max in elderly versions
-            maxvotes = max([(v, k) for k, v in votes.iteritems()])[1]
-
-        return maxvotes, \
-                [votes[ul] for ul in uniquelabels] # transform into lists
+        return self.__ulabels[votes.argmax()], list(votes)
 
 
     ##REF: Name was automagically refactored
     def get_weighted_vote(self, knn_ids):
         """Vote with classes weighted by the number of samples per class.
         """
-        # local bindings
-        _data = self.__data
-        targets_sa_name = self.get_space()
-        targets_sa = _data.sa[targets_sa_name]
-
-        uniquelabels = targets_sa.unique
-
-        # Lazy evaluation
-        if self.__weights is None:
-            #
-            # It seemed to Yarik that this has to be evaluated just once per
-            # training dataset.
-            #
-            self.__labels = labels = targets_sa.value
-            Nlabels = len(labels)
-            Nuniquelabels = len(uniquelabels)
-
-            # TODO: To get proper speed up for the next line only,
-            #       histogram should be computed
-            #       via sorting + counting "same" elements while reducing.
-            #       Guaranteed complexity is NlogN whenever now it is N^2
-            # compute the relative proportion of samples belonging to each
-            # class (do it in one loop to improve speed and reduce readability
-            self.__weights = \
-                [ 1.0 - ((labels == label).sum() / Nlabels) \
-                    for label in uniquelabels ]
-            self.__weights = dict(zip(uniquelabels, self.__weights))
-
-        labels = self.__labels
-        # number of occerences for each unique class in kNNs
-        votes = self.__votes_init.copy()
-        for nn in knn_ids:
-            votes[labels[nn]] += 1
-
-        # weight votes
-        votes = [ self.__weights[ul] * votes[ul] for ul in uniquelabels]
-
-        # find the class with most votes
+        votes = self._get_votes(knn_ids)[0] * self.__weights
         # return votes as well to store them in the state
-        return uniquelabels[np.asarray(votes).argmax()], \
-               votes
+        return self.__ulabels[votes.argmax()], list(votes)
 
 
     def _untrain(self):
         """Reset trained state"""
         self.__data = None
+        self.__ulabels = None
+        self.__codes = None
+        self.__weights = None
         super(kNN, self)._untrain()
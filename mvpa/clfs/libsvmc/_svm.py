@@ -210,38 +210,94 @@ def seq_to_svm_node(x):
 
 
 
+svm_node_dtype = np.dtype([('index', np.intc), ('value', np.double)],
+                          align=True)
+"""Layout of libsvm's svm_node struct"""
+
+
+def dense_svm_nodes(x, out=None):
+    """Lay out a 2D array as svm_node records in a single pass
+
+    Each row gets terminated with index -1 as libsvm expects.  If `out`
+    of the matching shape is provided, it gets filled in-place.
+    """
+    nsamples, nfeatures = x.shape
+    if out is None:
+        out = np.empty((nsamples, nfeatures + 1), dtype=svm_node_dtype)
+        out['index'][:, :nfeatures] = np.arange(nfeatures)
+        out['index'][:, nfeatures] = -1
+        out['value'][:, nfeatures] = 0.0
+    out['value'][:, :nfeatures] = x
+    return out
+
+
+
 class SVMProblem:
     def __init__(self, y, x):
         assert len(y) == len(x)
         self.prob = prob = svmc.new_svm_problem()
         self.size = size = len(y)
 
-        self.y_array = y_array = svmc.new_double(size)
-        for i in xrange(size):
-            svmc.double_setitem(y_array, i, y[i])
-
-        self.x_matrix = x_matrix = svmc.svm_node_matrix(size)
-        data = [None for i in xrange(size)]
-        maxlen = 0
-        for i in xrange(size):
-            x_i = x[i]
-            lx_i = len(x_i)
-            data[i] = d = seq_to_svm_node(x_i)
-            svmc.svm_node_matrix_set(x_matrix, i, d)
-            if isinstance(x_i, dict):
-                if (lx_i > 0):
-                    maxlen = max(maxlen, max(x_i.keys()))
-            else:
-                maxlen = max(maxlen, lx_i)
+        # labels are kept in an array libsvm points to
+        self.y = np.array(y, dtype=float)
+        self.y_array = svmc.double_array_from_array(self.y)
+
+        if isinstance(x, np.ndarray) and len(x.shape) == 2:
+            # all samples get laid out in a single buffer
+            self.data = dense_svm_nodes(x)
+            self.x_matrix = x_matrix = \
+                            svmc.svm_node_matrix_from_array(self.data)
+            maxlen = x.shape[1]
+        else:
+            self.x_matrix = x_matrix = svmc.svm_node_matrix(size)
+            data = [None for i in xrange(size)]
+            maxlen = 0
+            for i in xrange(size):
+                x_i = x[i]
+                lx_i = len(x_i)
+                data[i] = d = seq_to_svm_node(x_i)
+                svmc.svm_node_matrix_set(x_matrix, i, d)
+                if isinstance(x_i, dict):
+                    if (lx_i > 0):
+                        maxlen = max(maxlen, max(x_i.keys()))
+                else:
+                    maxlen = max(maxlen, lx_i)
+            self.data = data
 
         # bind to instance
-        self.data = data
         self.maxlen = maxlen
         svmc.svm_problem_l_set(prob, size)
-        svmc.svm_problem_y_set(prob, y_array)
+        svmc.svm_problem_y_set(prob, self.y_array)
         svmc.svm_problem_x_set(prob, x_matrix)
 
 
+    def is_dense(self):
+        """Either samples are laid out in a single buffer"""
+        return isinstance(self.data, np.ndarray)
+
+
+    def set_labels(self, y):
+        """Assign new labels without touching the samples"""
+        if len(y) != self.size:
+            raise ValueError, "Got %d labels for %d samples" \
+                  % (len(y), self.size)
+        self.y[:] = y
+
+
+    def set_samples(self, x):
+        """Refill the (dense) samples buffer with data of the same shape"""
+        if not self.is_dense() or x.shape != (self.size, self.maxlen):
+            raise ValueError, "Cannot refill %s with samples of shape %s" \
+                  % (self, x.shape)
+        dense_svm_nodes(x, out=self.data)
+
+
+    def __deepcopy__(self, memo):
+        if not self.is_dense():
+            raise TypeError, "Only dense %s could be copied" % self
+        return SVMProblem(self.y, self.data['value'][:, :self.maxlen])
+
+
     def __repr__(self):
         return "<SVMProblem: size = %s>" % (self.size)
 
@@ -251,9 +307,9 @@ class SVMProblem:
             debug('CLF_', 'Destroying libsvm.SVMProblem %s' % `self`)
 
         svmc.delete_svm_problem(self.prob)
-        svmc.delete_double(self.y_array)
-        for i in range(self.size):
-            svmc.svm_node_array_destroy(self.data[i])
+        if not self.is_dense():
+            for i in range(self.size):
+                svmc.svm_node_array_destroy(self.data[i])
         svmc.svm_node_matrix_destroy(self.x_matrix)
 
 
@@ -343,7 +399,11 @@ class SVMModel:
 
     ##REF: Name was automagically refactored
     def predict_values(self, x):
-        v = self.predict_values_raw(x)
+        return self._values_to_dict(self.predict_values_raw(x))
+
+
+    def _values_to_dict(self, v):
+        """Convert raw decision values into a dict for pairs of labels"""
         if self.svm_type == NU_SVR \
            or self.svm_type == EPSILON_SVR \
            or self.svm_type == ONE_CLASS:
@@ -359,8 +419,7 @@ class SVMModel:
             return  d
 
 
-    ##REF: Name was automagically refactored
-    def predict_probability(self, x):
+    def _check_probability(self):
         #c code will do nothing on wrong type, so we have to check ourself
         if self.svm_type == NU_SVR or self.svm_type == EPSILON_SVR:
             raise TypeError, "call get_svr_probability or get_svr_pdf " \
@@ -372,6 +431,38 @@ class SVMModel:
         if not self.probability:
             raise TypeError, "model does not support probabiliy estimates"
 
+
+    def predict_batch(self, x, values=False, probabilities=False):
+        """Predict all samples at once
+
+        Parameters
+        ----------
+        x : array
+          2D array with a sample per row.
+        values : bool
+          Either to return raw decision values as well.
+        probabilities : bool
+          Either to return probability estimates as well.  Raises
+          TypeError if the model does not support them.
+
+        Returns
+        -------
+        tuple of arrays
+          (predictions, decision values, probability-based predictions,
+          probabilities), where the last 3 are None unless requested.
+          Predictions are the same as `predict` would provide for each
+          sample.
+        """
+        if probabilities:
+            self._check_probability()
+        return svmc.svm_predict_batch(self.model, x,
+                                      int(values), int(probabilities))
+
+
+    ##REF: Name was automagically refactored
+    def predict_probability(self, x):
+        self._check_probability()
+
         #convert x into SVMNode, alloc a double array to receive probabilities
         data = seq_to_svm_node(x)
         dblarr = svmc.new_double(self.nr_class)
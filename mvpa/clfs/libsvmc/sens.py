@@ -74,7 +74,7 @@ class LinearSVMWeights(Sensitivity):
         #            " classes. Make sure that it is what you intended to do" )
 
         svcoef = np.matrix(model.get_sv_coef())
-        svs = np.matrix(model.get_sv())
+        svs = np.matrix(clf._get_svs())
         rhos = np.asarray(model.get_rho())
 
         self.ca.biases = rhos
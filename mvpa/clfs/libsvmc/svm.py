@@ -23,6 +23,7 @@ from mvpa.clfs.base import accepts_dataset_as_samples, \
 from mvpa.clfs._svmbase import _SVM
 
 from mvpa.clfs.libsvmc import _svm
+from mvpa.kernels.base import NumpyKernel
 from mvpa.kernels.libsvm import LinearLSKernel
 from sens import LinearSVMWeights
 
@@ -37,12 +38,36 @@ from mvpa.clfs.libsvmc._svmc import \
      PRECOMPUTED, ONE_CLASS
 
 def _data2ls(data):
-    return np.asarray(data).astype(float)
+    return np.asarray(data, dtype=float)
+
+def _kernel2ls(k):
+    """Lay out kernel matrix rows as libsvm expects for PRECOMPUTED kernel
+
+    First column carries the (1-based) serial number of a sample, which
+    is what libsvm uses to index kernel values of the support vectors.
+    """
+    k = np.asarray(k)
+    out = np.empty((k.shape[0], k.shape[1] + 1))
+    out[:, 0] = np.arange(1, k.shape[0] + 1)
+    out[:, 1:] = k
+    return out
 
 class SVM(_SVM):
     """Support Vector Machine Classifier.
 
     This is a simple interface to the libSVM package.
+
+    Besides libsvm's own kernels (see `mvpa.kernels.libsvm`), any
+    `NumpyKernel` could be used.  Then kernel matrix gets computed by
+    PyMVPA and passed to libsvm as PRECOMPUTED.  In particular, a
+    `CachedKernel` computed once on the full dataset, e.g.::
+
+      ck = CachedKernel(LinearKernel())
+      ck.compute(ds)
+      cv = CrossValidation(SVM(kernel=ck), NFoldPartitioner())
+
+    serves all folds of a cross-validation from that single kernel
+    matrix.
     """
 
     # Since this is internal feature of LibSVM, this conditional attribute is present
@@ -119,6 +144,14 @@ class SVM(_SVM):
         self.__model = None
         """Holds the trained SVM."""
 
+        self.__problem = None
+        """SVMProblem of the last training, reused for the same samples."""
+        self.__problem_samples = None
+        """Samples the SVMProblem was created for."""
+
+        self.__traindataset = None
+        """Training dataset, if kernel matrix is computed by PyMVPA."""
+
 
 
     def _train(self, dataset):
@@ -127,13 +160,41 @@ class SVM(_SVM):
         targets_sa_name = self.get_space()    # name of targets sa
         targets_sa = dataset.sa[targets_sa_name] # actual targets sa
 
-        # libsvm needs doubles
-        src = _data2ls(dataset)
+        kernel = self.params.kernel
+        if isinstance(kernel, NumpyKernel):
+            # kernel matrix gets computed (or just looked up if it is
+            # a CachedKernel) by us, libsvm takes it as is
+            kernel.compute(dataset)
+            src = _kernel2ls(kernel.as_raw_np())
+            kernel.cleanup()
+            kernel_type = PRECOMPUTED
+            self.__traindataset = dataset
+        else:
+            # libsvm needs doubles
+            src = _data2ls(dataset)
+            kernel_type = kernel.as_raw_ls() # Just an integer ID
+            self.__traindataset = None
 
         # libsvm cannot handle literal labels
         labels = self._attrmap.to_numeric(targets_sa.value).tolist()
 
-        svmprob = _svm.SVMProblem(labels, src )
+        svmprob = self.__problem
+        samples = dataset.samples
+        if svmprob is not None and svmprob.is_dense() \
+               and svmprob.maxlen == src.shape[1] \
+               and self.__problem_samples.__array_interface__ \
+                   == samples.__array_interface__:
+            # training on the same samples again (e.g. with different
+            # parameters or targets) -- reuse the buffer
+            if __debug__:
+                debug("SVM_", "Reusing SVMProblem of the previous training")
+            # refilling is cheap and keeps in-place changes of samples
+            svmprob.set_samples(src)
+            svmprob.set_labels(labels)
+        else:
+            svmprob = _svm.SVMProblem(labels, src)
+            self.__problem = svmprob
+            self.__problem_samples = samples
 
         # Translate few params
         TRANSLATEDICT = {'epsilon': 'eps',
@@ -156,7 +217,7 @@ class SVM(_SVM):
         # **kwargs and create appropriate parameters within .params or
         # .kernel_params
         libsvm_param = _svm.SVMParameter(
-            kernel_type=self.params.kernel.as_raw_ls(),# Just an integer ID
+            kernel_type=kernel_type,
             svm_type=self._svm_type,
             **dict(args))
         
@@ -190,15 +251,37 @@ class SVM(_SVM):
     def _predict(self, data):
         """Predict values for the data
         """
-        # libsvm needs doubles
-        src = _data2ls(data)
+        if self.__traindataset is not None:
+            # kernel between testing and training samples
+            kernel = self.params.kernel
+            kernel.compute(data, self.__traindataset)
+            src = _kernel2ls(kernel.as_raw_np())
+            kernel.cleanup()
+        else:
+            # libsvm needs doubles
+            src = _data2ls(data)
         ca = self.ca
 
-        predictions = [ self.model.predict(p) for p in src ]
+        model = self.model
+        need_probabilities = ca.is_enabled("probabilities")
+        if need_probabilities:
+            try:
+                model._check_probability()
+            except TypeError:
+                warning("Current SVM %s doesn't support probability " %
+                        self + " estimation.")
+                need_probabilities = False
+
+        # all samples are passed to libsvm at once
+        predictions, values, prob_predictions, probabilities = \
+            model.predict_batch(src,
+                                values=ca.is_enabled('estimates'),
+                                probabilities=need_probabilities)
+        predictions = predictions.tolist()
 
         if ca.is_enabled('estimates'):
             if self.__is_regression__:
-                estimates = [ self.model.predict_values_raw(p)[0] for p in src ]
+                estimates = values[:, 0].tolist()
             else:
                 # if 'trained_targets' are literal they have to be mapped
                 if np.issubdtype(self.ca.trained_targets.dtype, 'c'):
@@ -207,42 +290,26 @@ class SVM(_SVM):
                 else:
                     trained_targets = self.ca.trained_targets
                 nlabels = len(trained_targets)
-                # XXX We do duplicate work. model.predict calls
-                # predict_values_raw internally and then does voting or
-                # thresholding. So if speed becomes a factor we might
-                # want to move out logic from libsvm over here to base
-                # predictions on obtined values, or adjust libsvm to
-                # spit out values from predict() as well
                 if nlabels == 2:
                     # Apperently libsvm reorders labels so we need to
                     # track (1,0) values instead of (0,1) thus just
                     # lets take negative reverse
-                    estimates = [ self.model.predict_values(p)[(trained_targets[1],
-                                                            trained_targets[0])]
-                               for p in src ]
-                    if len(estimates) > 0:
-                        if __debug__:
-                            debug("SVM",
-                                  "Forcing estimates to be ndarray and reshaping"
-                                  " them into 1D vector")
-                        estimates = np.asarray(estimates).reshape(len(estimates))
+                    if tuple(model.labels) == (trained_targets[1],
+                                               trained_targets[0]):
+                        estimates = values[:, 0].copy()
+                    else:
+                        estimates = -values[:, 0]
                 else:
                     # In multiclass we return dictionary for all pairs
                     # of labels, since libsvm does 1-vs-1 pairs
-                    estimates = [ self.model.predict_values(p) for p in src ]
+                    estimates = [ model._values_to_dict(v) for v in values ]
             ca.estimates = estimates
 
-        if ca.is_enabled("probabilities"):
-            # XXX Is this really necesssary? yoh don't think so since
-            # assignment to ca is doing the same
-            #self.probabilities = [ self.model.predict_probability(p)
-            #                       for p in src ]
-            try:
-                ca.probabilities = [ self.model.predict_probability(p)
-                                         for p in src ]
-            except TypeError:
-                warning("Current SVM %s doesn't support probability " %
-                        self + " estimation.")
+        if need_probabilities:
+            labels = model.labels
+            ca.probabilities = [ (pred, dict(zip(labels, p)))
+                                 for pred, p in zip(prob_predictions.tolist(),
+                                                    probabilities.tolist()) ]
         return predictions
 
 
@@ -275,6 +342,17 @@ class SVM(_SVM):
         super(SVM, self)._untrain()
         del self.__model
         self.__model = None
+        self.__traindataset = None
+
+
+    def _get_svs(self):
+        """Support vectors in the space of training samples"""
+        svs = self.__model.get_sv()
+        if self.__traindataset is not None:
+            # with PRECOMPUTED kernel libsvm knows only serial numbers
+            # of the samples
+            svs = self.__traindataset.samples[svs[:, 0].astype(int) - 1]
+        return svs
 
     model = property(fget=lambda self: self.__model)
     """Access to the SVM model."""
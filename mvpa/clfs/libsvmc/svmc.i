@@ -229,6 +229,16 @@ static PyObject* doubleppcarray2numpy_array(double** data, int rows, int cols);
 %array_functions(int,int)
 %array_functions(double,double)
 
+/* helpers pointing into numpy arrays report failures as exceptions */
+%exception svm_node_matrix_from_array {
+	$action
+	if (PyErr_Occurred()) SWIG_fail;
+}
+%exception double_array_from_array {
+	$action
+	if (PyErr_Occurred()) SWIG_fail;
+}
+
 %inline %{
 
 struct svm_node *svm_node_array(int size)
@@ -274,6 +284,192 @@ void svm_node_matrix_destroy(struct svm_node **matrix)
 	free(matrix);
 }
 
+/* Matrix of pointers to the rows of a C-contiguous 2D array of svm_node
+ * records (each row terminated by index -1).  Array must outlive the
+ * matrix, which has to be freed with svm_node_matrix_destroy.
+ */
+struct svm_node **svm_node_matrix_from_array(PyObject *nodes)
+{
+	if (!PyArray_Check(nodes)
+		|| PyArray_NDIM((PyArrayObject*) nodes) != 2
+		|| !PyArray_ISCARRAY((PyArrayObject*) nodes)
+		|| PyArray_ITEMSIZE((PyArrayObject*) nodes)
+		   != sizeof(struct svm_node))
+	{
+		PyErr_SetString(PyExc_ValueError,
+						"Need C-contiguous 2D array of svm_node records");
+		return NULL;
+	}
+	PyArrayObject *a = (PyArrayObject*) nodes;
+	npy_intp rows = PyArray_DIM(a, 0), cols = PyArray_DIM(a, 1), i;
+	struct svm_node **matrix = (struct svm_node **)malloc(
+		sizeof(struct svm_node *)*(rows > 0 ? rows : 1));
+	if (!matrix)
+	{
+		PyErr_NoMemory();
+		return NULL;
+	}
+	struct svm_node *data = (struct svm_node *)PyArray_DATA(a);
+	for (i = 0; i < rows; ++i)
+		matrix[i] = data + i*cols;
+	return matrix;
+}
+
+/* Pointer to the data of a C-contiguous 1D array of doubles, which must
+ * outlive any use of the pointer.
+ */
+double *double_array_from_array(PyObject *values)
+{
+	if (!PyArray_Check(values)
+		|| PyArray_NDIM((PyArrayObject*) values) != 1
+		|| !PyArray_ISCARRAY((PyArrayObject*) values)
+		|| PyArray_TYPE((PyArrayObject*) values) != NPY_DOUBLE)
+	{
+		PyErr_SetString(PyExc_ValueError,
+						"Need C-contiguous 1D array of doubles");
+		return NULL;
+	}
+	return (double *)PyArray_DATA((PyArrayObject*) values);
+}
+
+/* Predict all samples (rows of a 2D array) at once.
+ *
+ * A single svm_node buffer is reused for all the samples, so no
+ * per-sample allocations or Python objects are involved.  Returns a
+ * tuple (predictions, decision values, probability-based predictions,
+ * probabilities) of arrays, where the last 3 are None unless requested.
+ * Probabilities must be requested only for models which support them.
+ */
+PyObject *svm_predict_batch(struct svm_model *model, PyObject *samples,
+							int return_values, int return_probabilities)
+{
+	PyArrayObject *x = (PyArrayObject*) PyArray_ContiguousFromObject(
+		samples, NPY_DOUBLE, 2, 2);
+	if (!x)
+		return NULL;
+
+	int svm_type = model->param.svm_type;
+	int is_classification = !(svm_type == ONE_CLASS ||
+							  svm_type == EPSILON_SVR ||
+							  svm_type == NU_SVR);
+	int nr_class = model->nr_class;
+	int nvalues = is_classification ? nr_class*(nr_class-1)/2 : 1;
+	npy_intp nsamples = PyArray_DIM(x, 0);
+	npy_intp nfeatures = PyArray_DIM(x, 1);
+	npy_intp dims[2];
+
+	dims[0] = nsamples;
+	PyArrayObject *predictions = (PyArrayObject*) PyArray_SimpleNew(
+		1, dims, NPY_DOUBLE);
+	PyArrayObject *values = NULL, *prob_predictions = NULL,
+		*probabilities = NULL;
+	if (return_values)
+	{
+		dims[1] = nvalues;
+		values = (PyArrayObject*) PyArray_SimpleNew(2, dims, NPY_DOUBLE);
+	}
+	if (return_probabilities)
+	{
+		dims[1] = nr_class;
+		prob_predictions = (PyArrayObject*) PyArray_SimpleNew(
+			1, dims, NPY_DOUBLE);
+		probabilities = (PyArrayObject*) PyArray_SimpleNew(
+			2, dims, NPY_DOUBLE);
+	}
+
+	struct svm_node *nodes = (struct svm_node *)malloc(
+		sizeof(struct svm_node)*(nfeatures + 1));
+	double *dec_values = (double *)malloc(sizeof(double)*(nvalues + 1));
+	int *vote = (int *)malloc(sizeof(int)*(nr_class + 1));
+
+	if (!predictions || (return_values && !values)
+		|| (return_probabilities && !(prob_predictions && probabilities))
+		|| !nodes || !dec_values || !vote)
+	{
+		free(nodes);
+		free(dec_values);
+		free(vote);
+		Py_DECREF(x);
+		Py_XDECREF(predictions);
+		Py_XDECREF(values);
+		Py_XDECREF(prob_predictions);
+		Py_XDECREF(probabilities);
+		return PyErr_NoMemory();
+	}
+
+	npy_intp i, j;
+	int k, l;
+	for (j = 0; j < nfeatures; ++j)
+		nodes[j].index = (int)j;
+	nodes[nfeatures].index = -1;
+	nodes[nfeatures].value = 0.0;
+
+	double *data = (double *)PyArray_DATA(x);
+	double *pred = (double *)PyArray_DATA(predictions);
+
+	Py_BEGIN_ALLOW_THREADS
+	for (i = 0; i < nsamples; ++i)
+	{
+		for (j = 0; j < nfeatures; ++j)
+			nodes[j].value = data[i*nfeatures + j];
+
+		double *dec = values ? (double *)PyArray_DATA(values) + i*nvalues
+							 : dec_values;
+		svm_predict_values(model, nodes, dec);
+
+		/* same decision as svm_predict() makes */
+		if (!is_classification)
+			pred[i] = (svm_type == ONE_CLASS) ? ((dec[0] > 0) ? 1 : -1)
+											 : dec[0];
+		else
+		{
+			int pos = 0, vote_max_idx = 0;
+			for (k = 0; k < nr_class; ++k)
+				vote[k] = 0;
+			for (k = 0; k < nr_class; ++k)
+				for (l = k + 1; l < nr_class; ++l)
+				{
+					if (dec[pos++] > 0)
+						++vote[k];
+					else
+						++vote[l];
+				}
+			for (k = 1; k < nr_class; ++k)
+				if (vote[k] > vote[vote_max_idx])
+					vote_max_idx = k;
+			pred[i] = model->label[vote_max_idx];
+		}
+
+		if (return_probabilities)
+			((double *)PyArray_DATA(prob_predictions))[i] =
+				svm_predict_probability(
+					model, nodes,
+					(double *)PyArray_DATA(probabilities) + i*nr_class);
+	}
+	Py_END_ALLOW_THREADS
+
+	free(nodes);
+	free(dec_values);
+	free(vote);
+	Py_DECREF(x);
+
+	if (!values)
+	{
+		Py_INCREF(Py_None);
+		values = (PyArrayObject*) Py_None;
+	}
+	if (!return_probabilities)
+	{
+		Py_INCREF(Py_None);
+		prob_predictions = (PyArrayObject*) Py_None;
+		Py_INCREF(Py_None);
+		probabilities = (PyArrayObject*) Py_None;
+	}
+	/* "N" steals the references */
+	return Py_BuildValue("NNNN", predictions, values,
+						 prob_predictions, probabilities);
+}
+
 #if LIBSVM_VERSION >= 300
 void svm_destroy_model_helper(svm_model* model_ptr)
 {
@@ -26,7 +26,7 @@ class RidgeReg(Classifier):
     have to be zero-centered.
     """
 
-    __tags__ = ['ridge', 'regression', 'linear']
+    __tags__ = ['ridge', 'regression', 'linear', 'suffstats']
 
     def __init__(self, lm=None, **kwargs):
         """
@@ -66,29 +66,46 @@ class RidgeReg(Classifier):
                 (self.__lm, str(self.ca.enabled))
 
 
+    def _compute_suffstats(self, samples, targets, ulabels, center):
+        """Cross-products of the samples (with intercept) and targets"""
+        # centering has no effect on the solution besides the intercept
+        a = np.hstack((samples - center, np.ones((len(samples), 1))))
+        return np.dot(a.T, a), np.dot(a.T, targets)
+
+
     def _train(self, data):
         """Train the classifier using `data` (`Dataset`).
         """
 
         if self.__implementation == "direct":
-            # create matrices to solve with additional penalty term
-            # determine the lambda matrix
+            # determine the lambda
             if self.__lm is None:
                 # Not specified, so calculate based on .05*nfeatures
-                Lambda = .05*data.nfeatures*np.eye(data.nfeatures)
+                lm = .05*data.nfeatures
             else:
                 # use the provided penalty
-                Lambda = self.__lm*np.eye(data.nfeatures)
-
-            # add the penalty term
-            a = np.concatenate( \
-                (np.concatenate((data.samples, np.ones((data.nsamples, 1))), 1),
-                    np.concatenate((Lambda, np.zeros((data.nfeatures, 1))), 1)))
-            b = np.concatenate((data.sa[self.get_space()].value,
-                               np.zeros(data.nfeatures)))
+                lm = self.__lm
+
+            if lm == 0:
+                # plain least squares on the design matrix itself -- normal
+                # equations would square its condition number, and their
+                # minimum norm solution (e.g. for more features than
+                # samples) would depend on the centering
+                a = np.hstack((data.samples, np.ones((data.nsamples, 1))))
+                self.w = lstsq(a, data.sa[self.get_space()].value)[0]
+                return
+
+            # normal equations of the least sq regression with additional
+            # penalty term (it is not applied to the intercept)
+            ulabels, center, (a, b) = self._get_suffstats(data)
+            a = a.copy()
+            a[np.arange(data.nfeatures), np.arange(data.nfeatures)] += lm**2
 
             # perform the least sq regression and save the weights
-            self.w = lstsq(a, b)[0]
+            w = lstsq(a, b)[0]
+            # bring intercept back to the uncentered samples
+            w[-1] -= np.dot(w[:-1], center)
+            self.w = w
         else:
             raise ValueError, "Unknown implementation '%s'" \
                               % self.__implementation
@@ -10,9 +10,12 @@
 
 __docformat__ = 'restructuredtext'
 
+import os
 import numpy as np
 
 from mvpa.base import externals, warning
+from mvpa.base.dochelpers import _repr_attrs
+from mvpa.base.parallel import get_nproc, parallel_map
 from mvpa.base.state import ClassWithCollections, ConditionalAttribute
 from mvpa.generators.permutation import AttributePermutator
 from mvpa.base.types import is_datasetlike
@@ -74,6 +77,317 @@ class Nonparametric(object):
         return res
 
 
+
+class NonparametricArray(object):
+    """A set of non-parametric 1d distributions backed by a single array.
+
+    Equivalent to a list of `Nonparametric` distributions (one per column
+    of the stored values), but cdf values for all of them are computed at
+    once for whole blocks of distributions.
+    """
+
+    def __init__(self, dist_samples, correction='clip'):
+        """
+        Parameters
+        ----------
+        dist_samples : ndarray
+          Samples to be used to assess the distributions, with the
+          samples of each distribution in a column (i.e.
+          nsamples x ndistributions).
+        correction : {'clip'} or None, optional
+          See `Nonparametric`.
+        """
+        if not correction in ('clip', None):
+            raise ValueError, \
+                  '%r is incorrect value for correction parameter of %s' \
+                  % (correction, self.__class__.__name__)
+        self._dist_samples = np.asanyarray(dist_samples)
+        self._correction = correction
+
+    def __repr__(self):
+        return '%s(%r%s)' % (
+            self.__class__.__name__,
+            self._dist_samples,
+            ('', ', correction=%r' % self._correction)
+              [int(self._correction != 'clip')])
+
+    def __len__(self):
+        return self._dist_samples.shape[1]
+
+    def __getitem__(self, i):
+        return Nonparametric(self._dist_samples[:, i],
+                             correction=self._correction)
+
+
+    def cdf(self, x):
+        """Returns the cdf values of all distributions.
+
+        Parameters
+        ----------
+        x : ndarray
+          A single value per distribution.
+        """
+        dist_samples = self._dist_samples
+        nsamples, ndist = dist_samples.shape
+        x = np.asanyarray(x)
+        if x.shape != (ndist,):
+            raise ValueError, \
+                  '%s holds %d distributions, but was queried with %s values' \
+                  % (self.__class__.__name__, ndist, x.shape)
+        res = np.empty(ndist)
+        # process blocks of distributions to limit the size of temporary
+        # arrays
+        step = max(1, 2**19 // max(nsamples, 1))
+        for start in xrange(0, ndist, step):
+            block = slice(start, start + step)
+            res[block] = (dist_samples[:, block] <= x[block]).sum(axis=0)
+        res /= nsamples
+        if self._correction == 'clip':
+            np.clip(res, 1.0/(nsamples+2), (nsamples+1.0)/(nsamples+2), res)
+        return res
+
+
+class StreamingNormal(object):
+    """Normal distributions of many elements, estimated incrementally.
+
+    Running means and variances are updated with each new set of values
+    (Welford's algorithm), so memory demands do not depend on the number of
+    values.  Estimates are identical to those of ``scipy.stats.norm.fit()``.
+    """
+
+    def __init__(self):
+        """Initialize the estimator without any values seen so far.
+        """
+        self.reset()
+
+    def __repr__(self):
+        return '%s()' % self.__class__.__name__
+
+    def __len__(self):
+        if self.mean is None:
+            return 0
+        return len(self.mean)
+
+
+    def reset(self):
+        """Forget all values seen so far."""
+        self.n = 0
+        self.mean = None
+        self._m2 = None
+
+
+    def update(self, values):
+        """Account for a new value of each element.
+
+        Parameters
+        ----------
+        values : ndarray
+          A single value per element (gets flattened).
+        """
+        values = np.ravel(values)
+        if self.mean is None:
+            self.mean = np.zeros(len(values))
+            self._m2 = np.zeros(len(values))
+        self.n += 1
+        delta = values - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (values - self.mean)
+
+
+    def cdf(self, x):
+        """Returns the cdf values of all distributions.
+        """
+        externals.exists('scipy', raise_=True)
+        from scipy.stats import norm
+        return norm.cdf(x, loc=self.mean, scale=self.std)
+
+    std = property(fget=lambda self: np.sqrt(self._m2 / self.n),
+                   doc="Standard deviations of all elements (ddof=0)")
+
+
+
+class StreamingHistogram(object):
+    """Non-parametric distributions of many elements, estimated incrementally.
+
+    The distribution of each element is approximated by a histogram of
+    equally sized bins.  Values beyond the range of the bins are counted
+    separately, and are assumed to be uniformly distributed between the
+    range of the bins and the extreme values seen so far.  Within bins
+    cdf values are interpolated linearly.  So memory demands do not depend
+    on the number of values, while cdf values are accurate up to the bin
+    size.
+    """
+
+    def __init__(self, nbins=100, bin_range=None, nwarmup=50,
+                 correction='clip'):
+        """
+        Parameters
+        ----------
+        nbins : int
+          Number of bins per element.
+        bin_range : None or (float, float)
+          Range of the bins for all elements.  If None, it is determined
+          for each element from its first `nwarmup` values:  their range
+          widened by half of its size on each side.
+        nwarmup : int
+          Number of values to collect before the bin ranges are determined
+          (if `bin_range` is None).  Until then cdf values are exact.
+        correction : {'clip'} or None, optional
+          See `Nonparametric`.
+        """
+        if not correction in ('clip', None):
+            raise ValueError, \
+                  '%r is incorrect value for correction parameter of %s' \
+                  % (correction, self.__class__.__name__)
+        self._nbins = nbins
+        self._bin_range = bin_range
+        self._nwarmup = nwarmup
+        self._correction = correction
+        self.reset()
+
+    def __repr__(self):
+        return '%s(%s)' % (
+            self.__class__.__name__,
+            ', '.join(['%s=%r' % (k, getattr(self, '_' + k))
+                       for k, default in (('nbins', 100),
+                                          ('bin_range', None),
+                                          ('nwarmup', 50),
+                                          ('correction', 'clip'))
+                       if getattr(self, '_' + k) != default]))
+
+    def __len__(self):
+        if self._min is None:
+            return 0
+        return len(self._min)
+
+
+    def reset(self):
+        """Forget all values seen so far."""
+        self.n = 0
+        self._buffer = []
+        self._min = self._max = None
+        self._lo = self._width = None
+        self._counts = None
+
+
+    def update(self, values):
+        """Account for a new value of each element.
+
+        Parameters
+        ----------
+        values : ndarray
+          A single value per element (gets flattened).
+        """
+        values = np.ravel(values)
+        self.n += 1
+        if self._min is None:
+            self._min = values.copy()
+            self._max = values.copy()
+        else:
+            # NaNs are ignored
+            self._min = np.fmin(self._min, values)
+            self._max = np.fmax(self._max, values)
+        if self._counts is not None:
+            self._add(values)
+            return
+        self._buffer.append(values)
+        if self._bin_range is not None or len(self._buffer) >= self._nwarmup:
+            self._init_bins(np.array(self._buffer))
+            for v in self._buffer:
+                self._add(v)
+            self._buffer = None
+
+
+    def _init_bins(self, buffer):
+        nbins = self._nbins
+        if self._bin_range is None:
+            lo = np.nanmin(buffer, axis=0)
+            hi = np.nanmax(buffer, axis=0)
+            span = hi - lo
+            # some elements might have no spread (yet)
+            flat = ~(span > 0)
+            span[flat] = np.fmax(np.abs(lo[flat]), 1.0)
+            lo[flat] = np.nan_to_num(lo[flat])
+            lo -= span / 2
+            span *= 2
+        else:
+            lo = np.repeat(float(self._bin_range[0]), buffer.shape[1])
+            span = float(self._bin_range[1]) - lo
+        self._lo = lo
+        self._width = span / nbins
+        # bins along with underflow and overflow counts at both ends
+        self._counts = np.zeros((buffer.shape[1], nbins + 2), dtype=int)
+
+
+    def _add(self, values):
+        valid = ~np.isnan(values)
+        idx = np.floor((values[valid] - self._lo[valid])
+                       / self._width[valid]).astype(int) + 1
+        np.clip(idx, 0, self._nbins + 1, idx)
+        self._counts[valid.nonzero()[0], idx] += 1
+
+
+    def cdf(self, x):
+        """Returns the cdf values of all distributions.
+
+        Parameters
+        ----------
+        x : ndarray
+          A single value per distribution.
+        """
+        n = self.n
+        if self._counts is None:
+            # still warming up
+            return NonparametricArray(np.array(self._buffer),
+                                      correction=self._correction).cdf(x)
+        x = np.asanyarray(x, dtype=float)
+        if x.shape != (len(self),):
+            raise ValueError, \
+                  '%s holds %d distributions, but was queried with %s values' \
+                  % (self.__class__.__name__, len(self), x.shape)
+        counts = self._counts
+        nbins = self._nbins
+        lo, width = self._lo, self._width
+        hi = lo + width * nbins
+        elements = np.arange(len(x))
+
+        errs = np.seterr(divide='ignore', invalid='ignore')
+        try:
+            # within the bins: uniform within each bin, but never beyond
+            # the extreme values
+            pos = np.clip((x - lo) / width, 0, nbins)
+            pos[np.isnan(pos)] = 0
+            ibin = np.minimum(pos.astype(int), nbins - 1)
+            left = np.fmax(lo + ibin * width, self._min)
+            right = np.fmin(lo + (ibin + 1) * width, self._max)
+            frac = np.clip((x - left) / (right - left), 0, 1)
+            # single values are all either below or above
+            frac[right <= left] = (x >= left)[right <= left]
+            cumcounts = counts.cumsum(axis=1)
+            res = cumcounts[elements, ibin] \
+                  + np.nan_to_num(frac) * counts[elements, ibin + 1]
+
+            # beyond the bins: uniform between range of bins and extreme
+            # values
+            under = x < lo
+            frac = np.clip((x[under] - self._min[under])
+                           / (lo[under] - self._min[under]), 0, 1)
+            res[under] = counts[under, 0] * np.nan_to_num(frac)
+            over = x >= hi
+            frac = np.clip((self._max[over] - x[over])
+                           / (self._max[over] - hi[over]), 0, 1)
+            res[over] = cumcounts[over, -1] \
+                        - counts[over, -1] * np.nan_to_num(frac)
+        finally:
+            np.seterr(**errs)
+        res[np.isnan(x)] = 0
+
+        res /= n
+        if self._correction == 'clip':
+            np.clip(res, 1.0/(n+2), (n+1.0)/(n+2), res)
+        return res
+
+
 def _pvalue(x, cdf_func, tail, return_tails=False, name=None):
     """Helper function to return p-value(x) given cdf and tail
 
@@ -134,6 +448,23 @@ def _pvalue(x, cdf_func, tail, return_tails=False, name=None):
         return res
 
 
+def _measure_permuted(measure, ds, seed):
+    """Helper to compute a measure on a permuted dataset.
+
+    Returns
+    -------
+    (samples, None), or (None, error) if the measure has failed.
+    """
+    # TODO: place exceptions separately so we could avoid circular imports
+    from mvpa.base.learner import LearnerError
+    if seed is not None:
+        np.random.seed(seed)
+    try:
+        return measure(ds).samples, None
+    except LearnerError, e:
+        return None, str(e)
+
+
 class NullDist(ClassWithCollections):
     """Base class for null-hypothesis testing.
 
@@ -244,7 +575,8 @@ class MCNullDist(NullDist):
                       'measure has failed to evaluated at them')
 
     def __init__(self, permutator, dist_class=Nonparametric, measure=None,
-                 **kwargs):
+                 nproc=1, backend=None, seed=None, checkpoint=None,
+                 checkpoint_every=10, **kwargs):
         """Initialize Monte-Carlo Permutation Null-hypothesis testing
 
         Parameters
@@ -256,9 +588,37 @@ class MCNullDist(NullDist):
           using `fit()` method to initialize the instance, and
           provides `cdf(x)` method for estimating value of x in CDF.
           All distributions from SciPy's 'stats' module can be used.
+          Alternatively, an instance of a streaming estimator (e.g.
+          `StreamingNormal` or `StreamingHistogram`), which gets updated
+          with the results of each permutation as soon as they are
+          available.  Results of all permutations are then never kept at
+          once (hence `dist_samples` is not available).
         measure : Measure or None
           Optional measure that is used to compute results on permuted
           data. If None, a measure needs to be passed to ``fit()``.
+        nproc : None or int
+          How many processes to use to compute the measure on permuted
+          datasets.  If None -- all available cores will be used.
+        backend : None or {'multiprocessing', 'pprocess'}
+          How to spawn the processes if `nproc` > 1.  See
+          :func:`~mvpa.base.parallel.parallel_map`.
+        seed : None or int
+          If not None, the random number generator gets seeded, before
+          generating each permutation and before computing the measure on
+          it, with seeds derived from `seed` and the index of the
+          permutation.  Hence the results do not depend on `nproc`, or on
+          the fit being interrupted and resumed.  If None, but `nproc` > 1
+          or a `checkpoint` is used, `seed` is drawn from the random number
+          generator.
+        checkpoint : None or str
+          Name of a file to store the results of completed permutations in.
+          If this file exists when ``fit()`` is called, results are loaded
+          from it and only the remaining permutations get computed, e.g. to
+          resume an interrupted fit.  The file is removed as soon as all
+          permutations are done.
+        checkpoint_every : int
+          Number of completed permutations between updates of the
+          `checkpoint` file.
         """
         NullDist.__init__(self, **kwargs)
 
@@ -267,15 +627,77 @@ class MCNullDist(NullDist):
         self._measure = measure
 
         self.__permutator = permutator
+        self.nproc = nproc
+        self.backend = backend
+        self.seed = seed
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
 
     def __repr__(self, prefixes=[]):
         prefixes_ = ["%s" % self.__permutator]
         if self._dist_class != Nonparametric:
             prefixes_.insert(0, 'dist_class=%r' % (self._dist_class,))
+        prefixes_ += _repr_attrs(self, ['nproc'], default=1) \
+                     + _repr_attrs(self, ['backend', 'seed', 'checkpoint']) \
+                     + _repr_attrs(self, ['checkpoint_every'], default=10)
         return super(MCNullDist, self).__repr__(
             prefixes=prefixes_ + prefixes)
 
 
+    def _is_streaming(self):
+        return hasattr(self._dist_class, 'update') \
+               and not isinstance(self._dist_class, type)
+
+
+    def _generate(self, ds, rng):
+        """Yield permuted datasets along with the seeds for the measure.
+        """
+        gen = self.__permutator.generate(ds)
+        while True:
+            if rng is None:
+                mseed = None
+            else:
+                pseed, mseed = rng.randint(2**30, size=2)
+                np.random.seed(pseed)
+            try:
+                permuted_ds = gen.next()
+            except StopIteration:
+                return
+            yield permuted_ds, mseed
+
+
+    def _load_checkpoint(self):
+        """Load results of completed permutations and the seed used.
+        """
+        stored = np.load(self.checkpoint)
+        try:
+            done = dict(zip([int(p) for p in stored['indices']],
+                            stored['samples']))
+            done.update(dict.fromkeys([int(p) for p in stored['skipped']]))
+            seed = int(stored['seed'])
+        finally:
+            stored.close()
+        return done, seed
+
+
+    def _save_checkpoint(self, done, seed):
+        """Store results of all completed permutations (None if skipped)
+        """
+        indices = sorted(done)
+        valid = [p for p in indices if done[p] is not None]
+        # write into a temporary file first, so an interruption never
+        # leaves an incomplete checkpoint behind
+        tmpfilename = '%s.%i.tmp' % (self.checkpoint, os.getpid())
+        tmpfile = open(tmpfilename, 'wb')
+        try:
+            np.savez(tmpfile, seed=seed, indices=valid,
+                     samples=np.asanyarray([done[p] for p in valid]),
+                     skipped=[p for p in indices if done[p] is None])
+        finally:
+            tmpfile.close()
+        os.rename(tmpfilename, self.checkpoint)
+
+
     def fit(self, measure, ds):
         """Fit the distribution by performing multiple cycles which repeatedly
         permuted labels in the training dataset.
@@ -288,9 +710,6 @@ class MCNullDist(NullDist):
         ds: `Dataset` which gets permuted and used to compute the
           measure/transfer error multiple times.
         """
-        # TODO: place exceptions separately so we could avoid circular imports
-        from mvpa.base.learner import LearnerError
-
         # prefer the already assigned measure over anything the was passed to
         # the function.
         # XXX that is a bit awkward but is necessary to keep the code changes
@@ -299,8 +718,39 @@ class MCNullDist(NullDist):
             measure = self._measure
             measure.untrain()
 
-        dist_samples = []
-        """Holds the values for randomized labels."""
+        nproc = get_nproc(self.nproc)
+        checkpoint = self.checkpoint
+        seed = self.seed
+        streaming = self._is_streaming()
+        if streaming:
+            if checkpoint is not None:
+                raise ValueError("Checkpointing is not supported by "
+                                 "streaming estimation of distributions")
+            dist = self._dist_class
+            dist.reset()
+
+        # results of completed permutations by their index (None if skipped)
+        done = {}
+        if checkpoint is not None and os.path.exists(checkpoint):
+            done, stored_seed = self._load_checkpoint()
+            if seed is None:
+                seed = stored_seed
+            elif seed != stored_seed:
+                raise ValueError("Checkpoint %r was stored with seed %i, "
+                                 "but seed is %i"
+                                 % (checkpoint, stored_seed, seed))
+            if __debug__:
+                debug('STATMC', "Loaded results of %i permutations from %s"
+                      % (len(done), checkpoint))
+        if seed is None and (nproc > 1 or checkpoint is not None):
+            # draw a seed, so results are reproducible nevertheless
+            seed = np.random.randint(2**30)
+        if seed is None:
+            rng = None
+        else:
+            rng = np.random.RandomState(seed)
+            # to be restored after all the reseeding
+            rng_state = np.random.get_state()
 
         # estimate null-distribution
         # TODO this really needs to be more clever! If data samples are
@@ -308,34 +758,92 @@ class MCNullDist(NullDist):
         # classifier, hence the number of permutations to estimate the
         # null-distribution of transfer errors can be reduced dramatically
         # when the *right* permutations (the ones that matter) are done.
-        skipped = 0                     # # of skipped permutations
-        for p, permuted_ds in enumerate(self.__permutator.generate(ds)):
-            # new permutation all the time
-            # but only permute the training data and keep the testdata constant
-            #
-            if __debug__:
-                debug('STATMC', "Doing %i permutations: %i" \
-                      % (self.__permutator.nruns, p+1), cr=True)
-
-            # compute and store the measure of this permutation
-            # assume it has `TransferError` interface
-            try:
-                res = measure(permuted_ds)
-                dist_samples.append(res.samples)
-            except LearnerError, e:
+        progress = dict(nsaved=len(done), ndone=len(done), next=0, skipped=0)
+        def store(p, res):
+            samples, error = res
+            if error is not None:
                 if __debug__:
                     debug('STATMC', " skipped", cr=True)
                 warning('Failed to obtain value from %s due to %s.  Measurement'
                         ' was skipped, which could lead to unstable and/or'
-                        ' incorrect assessment of the null_dist' % (measure, e))
-                skipped += 1
-                continue
+                        ' incorrect assessment of the null_dist'
+                        % (measure, error))
+            done[p] = samples
+            progress['ndone'] += 1
+            if streaming:
+                # feed the estimator in the order of permutations, so it does
+                # not depend on the order of completion
+                while progress['next'] in done:
+                    samples = done.pop(progress['next'])
+                    if samples is None:
+                        progress['skipped'] += 1
+                    else:
+                        dist.update(samples)
+                    progress['next'] += 1
+            if checkpoint is not None \
+               and len(done) - progress['nsaved'] >= self.checkpoint_every:
+                self._save_checkpoint(done, seed)
+                progress['nsaved'] = len(done)
 
+        try:
+            if nproc > 1:
+                # child processes are forked, thus they share the samples
+                # with this process (copy-on-write) without any copying
+                # permuted datasets are cheap -- generate all in advance
+                todo = [(p, permuted_ds, mseed)
+                        for p, (permuted_ds, mseed)
+                            in enumerate(self._generate(ds, rng))
+                        if not p in done]
+                def report(i, res):
+                    if __debug__:
+                        debug('STATMC', "Doing %i permutations: %i" \
+                              % (self.__permutator.nruns,
+                                 progress['ndone'] + 1),
+                              cr=True)
+                    store(todo[i][0], res)
+                # child processes inherit the permuted datasets, so only
+                # their index needs to be passed
+                parallel_map(
+                    lambda i: _measure_permuted(measure, *todo[i][1:]),
+                    [(i,) for i in xrange(len(todo))],
+                    nproc=nproc, backend=self.backend, callback=report)
+            else:
+                for p, (permuted_ds, mseed) in \
+                        enumerate(self._generate(ds, rng)):
+                    if p in done:
+                        continue
+                    if __debug__:
+                        debug('STATMC', "Doing %i permutations: %i" \
+                              % (self.__permutator.nruns, p+1), cr=True)
+                    store(p, _measure_permuted(measure, permuted_ds, mseed))
+        except:
+            if checkpoint is not None and len(done) > progress['nsaved']:
+                # store whatever got completed to resume from there
+                self._save_checkpoint(done, seed)
+            raise
+        finally:
+            if rng is not None:
+                np.random.set_state(rng_state)
+
+        if checkpoint is not None and os.path.exists(checkpoint):
+            # all done -- no need to resume anything
+            os.remove(checkpoint)
+
+        if streaming:
+            skipped = progress['skipped']
+        else:
+            dist_samples = [done[p] for p in sorted(done)
+                            if not done[p] is None]
+            skipped = len(done) - len(dist_samples)
         self.ca.skipped = skipped
 
         if __debug__:
             debug('STATMC', ' Skipped: %d permutations' % skipped)
 
+        if streaming:
+            # already estimated -- nothing else to do
+            self._dist = dist
+            return
 
         # store samples as (npermutations x nsamples x nfeatures)
         dist_samples = np.asanyarray(dist_samples)
@@ -358,6 +866,10 @@ class MCNullDist(NullDist):
         # fit per each element.
         # XXX could be more elegant? may be use np.vectorize?
         dist_samples_rs = dist_samples.reshape((shape[0], -1))
+        if self._dist_class is Nonparametric:
+            # all elements at once
+            self._dist = NonparametricArray(dist_samples_rs)
+            return
         dist = []
         for samples in dist_samples_rs.T:
             params = self._dist_class.fit(samples)
@@ -392,7 +904,11 @@ class MCNullDist(NullDist):
                   % (len(self._dist), len(x))
 
         # extract cdf values per each element
-        cdfs = [ dist.cdf(v) for v, dist in zip(x, self._dist) ]
+        if hasattr(self._dist, 'cdf'):
+            # all elements at once
+            cdfs = self._dist.cdf(x)
+        else:
+            cdfs = [ dist.cdf(v) for v, dist in zip(x, self._dist) ]
         return np.array(cdfs).reshape(xshape)
 
 
@@ -56,6 +56,131 @@ def _p2(x, prec=2, formatting=''):
     return formatting + s
 
 
+def _label_indices(values, rev_map):
+    """Map a sequence of labels into their integer indices
+
+    Lookups into `rev_map` are done only once per unique value whenever
+    `values` is a non-object array.
+    """
+    if isinstance(values, np.ndarray) and values.dtype != np.object_ \
+           and len(values):
+        uvalues, inverse = np.unique(values, return_inverse=True)
+        return np.array([rev_map[v] for v in uvalues], dtype=int)[inverse]
+    return np.array([rev_map[v] for v in values], dtype=int)
+
+
+def _confusion_counts(targets, predictions, rev_map):
+    """Count hits with rows -- predictions, columns -- targets
+
+    Raises KeyError if some label is not known to `rev_map`.
+    """
+    nlabels = len(rev_map)
+    codes = _label_indices(predictions, rev_map) * nlabels \
+            + _label_indices(targets, rev_map)
+    return np.bincount(codes, minlength=nlabels * nlabels
+                       ).reshape(nlabels, nlabels)
+
+
+
+class _LazyStats(dict):
+    """Dictionary of statistics some of which are computed on first access
+
+    Computing some statistics (e.g. AUC) requires all the stored sets,
+    whenever others can be derived from accumulated counts alone.  The
+    former get computed by `fx` (returning a dictionary of them) only
+    whenever any of the `lazy` keys is accessed, or the dictionary is
+    inspected as a whole.
+    """
+    def __init__(self, fx, lazy, *args, **kwargs):
+        """
+        Parameters
+        ----------
+        fx : callable
+          Returns a dictionary with the values for all `lazy` keys.
+        lazy : sequence of str
+          Keys whose values are provided by `fx`.
+        """
+        dict.__init__(self, *args, **kwargs)
+        self.__fx = fx
+        self.__lazy = lazy
+
+    def evaluate(self):
+        """Compute the lazy statistics unless done already"""
+        fx = self.__fx
+        if fx is not None:
+            self.__fx = None
+            self.update(fx())
+
+    def __getitem__(self, key):
+        if key in self.__lazy:
+            self.evaluate()
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key in self.__lazy:
+            self.evaluate()
+        return dict.get(self, key, default)
+
+    def __contains__(self, key):
+        return key in self.__lazy or dict.__contains__(self, key)
+
+    has_key = __contains__
+
+    def __iter__(self):
+        self.evaluate()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.evaluate()
+        return dict.__len__(self)
+
+    def __repr__(self):
+        self.evaluate()
+        return dict.__repr__(self)
+
+    def keys(self):
+        self.evaluate()
+        return dict.keys(self)
+
+    def values(self):
+        self.evaluate()
+        return dict.values(self)
+
+    def items(self):
+        self.evaluate()
+        return dict.items(self)
+
+    def iteritems(self):
+        self.evaluate()
+        return dict.iteritems(self)
+
+    def copy(self):
+        self.evaluate()
+        return dict(self)
+
+    def __reduce__(self):
+        # could be pickled (e.g. to be passed across processes) as a plain
+        # dictionary only, since `fx` is most likely a closure
+        self.evaluate()
+        return (dict, (dict(self),))
+
+
+
+def _compute_roc(sets, labels):
+    """ROC curve (or None if not available) and AUC per each label"""
+    Nlabels = len(labels)
+    ROC = ROCCurve(labels=labels, sets=sets)
+    aucs = ROC.aucs
+    if len(aucs)>0:
+        if len(aucs) != Nlabels:
+            raise RuntimeError, \
+                  "We must got a AUC per label. Got %d instead of %d" % \
+                  (len(aucs), Nlabels)
+        return ROC, aucs
+    # we don't want to provide ROC if it is bogus
+    return None, [np.nan] * Nlabels
+
+
 
 class SummaryStatistics(object):
     """Basic class to collect targets/predictions and report summary statistics
@@ -134,17 +259,23 @@ class SummaryStatistics(object):
         # enforce labels in predictions to be of the same datatype as in
         # targets, since otherwise we are getting doubles for unknown at a
         # given moment labels
+        # (arrays of the same non-object dtype are known to agree already)
         nonetype = type(None)
-        for i in xrange(len(targets)):
-            t1, t2 = type(targets[i]), type(predictions[i])
-            # if there were no prediction made - leave None, otherwise
-            # convert to appropriate type
-            if t1 != t2 and t2 != nonetype:
-                #warning("Obtained target %s and prediction %s are of " %
-                #       (t1, t2) + "different datatypes.")
-                if isinstance(predictions, tuple):
-                    predictions = list(predictions)
-                predictions[i] = t1(predictions[i])
+        same_dtype = isinstance(targets, np.ndarray) \
+                     and isinstance(predictions, np.ndarray) \
+                     and targets.dtype == predictions.dtype \
+                     and targets.dtype != np.object_
+        if not same_dtype:
+            for i in xrange(len(targets)):
+                t1, t2 = type(targets[i]), type(predictions[i])
+                # if there were no prediction made - leave None, otherwise
+                # convert to appropriate type
+                if t1 != t2 and t2 != nonetype:
+                    #warning("Obtained target %s and prediction %s are of " %
+                    #       (t1, t2) + "different datatypes.")
+                    if isinstance(predictions, tuple):
+                        predictions = list(predictions)
+                    predictions[i] = t1(predictions[i])
 
         if estimates is not None:
             # assure that we have a copy, or otherwise further in-place
@@ -506,6 +637,12 @@ class ConfusionMatrix(SummaryStatistics):
         """Mapping from original into given labels"""
         self.__matrix = None
         """Resultant confusion matrix"""
+        self.__set_matrices = []
+        """Confusion matrices of the sets already accounted for"""
+        self.__matrix_sets = []
+        """Sets which were already accounted for in the matrix"""
+        self.__rev_map = {}
+        """Reverse mapping from label into index in the list of labels"""
 
 
     def __call__(self, predictions, targets, estimates=None, store=False):
@@ -532,20 +669,13 @@ class ConfusionMatrix(SummaryStatistics):
         if labels is None or not len(labels):
             raise RuntimeError("ConfusionMatrix must have labels assigned prior"
                                "__call__()")
-        # verify that we know all the labels
-        labels_set = set(labels)
-        if not (labels_set.issuperset(targets)
-                and labels_set.issuperset(predictions)):
+        try:
+            cm = _confusion_counts(targets, predictions,
+                                   self._get_rev_map(labels))
+        except KeyError:
             raise ValueError("Known labels %r does not include some labels "
                              "found in predictions %r or targets %r provided"
-                             % (labels_set, set(predictions), set(targets)))
-
-        Nlabels = len(labels_set)
-        cm = np.zeros( (Nlabels, Nlabels), dtype=int )
-
-        rev_map = dict([ (x[1], x[0]) for x in enumerate(labels)])
-        for t,p in zip(targets, predictions):
-            cm[rev_map[p], rev_map[t]] += 1
+                             % (set(labels), set(predictions), set(targets)))
 
         if store:
             self.add(targets=targets, predictions=predictions, estimates=estimates)
@@ -561,17 +691,37 @@ class ConfusionMatrix(SummaryStatistics):
                                 sets=[x]) for x in self.sets]
 
 
-    def _compute(self):
-        """Actually compute the confusion matrix based on all the sets"""
+    def _get_rev_map(self, labels):
+        """Reverse mapping from label into its index in `labels`
 
-        super(ConfusionMatrix, self)._compute()
+        Mapping is rebuilt only whenever `labels` change.
+        """
+        rev_map = self.__rev_map
+        if len(rev_map) != len(labels) \
+               or [rev_map.get(l, -1) for l in labels] != range(len(labels)):
+            rev_map = self.__rev_map = \
+                      dict([ (x[1], x[0]) for x in enumerate(labels)])
+        return rev_map
 
-        if __debug__:
-            if not self.__matrix is None:
-                debug("LAZY",
-                      "Have to recompute %s#%s" \
-                        % (self.__class__.__name__, id(self)))
 
+    def _update_matrix(self):
+        """Account for the sets added since the last update
+
+        Counts of the previously seen sets are kept, so only the new
+        sets get processed.
+        """
+        sets = self.sets
+        nseen = len(self.__matrix_sets)
+        if self.__matrix is not None and nseen == len(sets) \
+               and (not nseen or sets[-1] is self.__matrix_sets[-1]):
+            return
+
+        if nseen > len(sets) \
+               or [x for x, y in zip(sets, self.__matrix_sets) if not x is y]:
+            # sets were reset or replaced -- start from scratch
+            nseen = 0
+            self.__set_matrices = []
+        new_sets = sets[nseen:]
 
         # TODO: BinaryClassifier might spit out a list of predictions for each
         # value need to handle it... for now just keep original labels
@@ -579,11 +729,71 @@ class ConfusionMatrix(SummaryStatistics):
             # figure out what labels we have
             labels = \
                 list(reduce(lambda x, y: x.union(set(y[0]).union(set(y[1]))),
-                            self.sets,
+                            new_sets,
                             set(self.__labels)))
         except:
             labels = self.__labels
 
+        labels.sort()
+
+        if self.__labels is None or not len(self.__labels):
+            self.__labels = labels          # just store the recomputed labels
+        else:
+            # we should append them to already known ones
+            # Otherwise order of labels known before might be altered
+            add_labels = [x for x in labels if not (x in self.__labels)]
+            if len(add_labels):
+                self.__labels += add_labels
+            labels = self.__labels      # and us them later on
+
+        if __debug__:
+            debug("CM", "Got labels %s" % labels)
+
+        Nlabels = len(labels)
+        def pad(m):
+            """Pad counts for the labels which were added later on"""
+            if len(m) == Nlabels:
+                return m
+            # newly added labels go to the end
+            m_ = np.zeros((Nlabels, Nlabels), dtype=int)
+            m_[:len(m), :len(m)] = m
+            return m_
+
+        if nseen:
+            matrix = pad(self.__matrix)
+        else:
+            matrix = np.zeros((Nlabels, Nlabels), dtype=int)
+        # for now simply compute a sum of votes across different sets
+        # we might do something more sophisticated later on, and this setup
+        # should easily allow it
+        rev_map = self._get_rev_map(labels)
+        new_matrices = [_confusion_counts(set_[0], set_[1], rev_map)
+                        for set_ in new_sets]
+        for m in new_matrices:
+            matrix = matrix + m
+
+        self.__set_matrices = [pad(m) for m in self.__set_matrices[:nseen]] \
+                              + new_matrices
+        self.__matrix_sets = list(sets)
+        self.__matrix = matrix
+        self.__Nsamples = np.sum(self.__matrix, axis=0)
+        self.__Ncorrect = sum(np.diag(self.__matrix))
+
+
+    def _compute(self):
+        """Actually compute the confusion matrix based on all the sets"""
+
+        super(ConfusionMatrix, self)._compute()
+
+        if __debug__:
+            if not self.__matrix is None:
+                debug("LAZY",
+                      "Have to recompute %s#%s" \
+                        % (self.__class__.__name__, id(self)))
+
+        self._update_matrix()
+        labels = self.__labels
+
         # Check labels_map if it was provided if it covers all the labels
         labels_map = self.__labels_map
         if labels_map is not None:
@@ -606,44 +816,8 @@ class ConfusionMatrix(SummaryStatistics):
                 labels_map_rev[v] = v_mapping
         self.__labels_map_rev = labels_map_rev
 
-        labels.sort()
-
-        if self.__labels is None or not len(self.__labels):
-            self.__labels = labels          # just store the recomputed labels
-        else:
-            # we should append them to already known ones
-            # Otherwise order of labels known before might be altered
-            add_labels = [x for x in labels if not (x in self.__labels)]
-            if len(add_labels):
-                self.__labels += add_labels
-            labels = self.__labels      # and us them later on
-
         Nlabels, Nsets = len(labels), len(self.sets)
-
-        if __debug__:
-            debug("CM", "Got labels %s" % labels)
-
-        # Create a matrix for all votes
-        mat_all = np.zeros( (Nsets, Nlabels, Nlabels), dtype=int )
-
-        # create total number of samples of each label counts
-        # just for convinience I guess since it can always be
-        # computed from mat_all
-        counts_all = np.zeros( (Nsets, Nlabels) )
-
-        # reverse mapping from label into index in the list of labels
-        rev_map = dict([ (x[1], x[0]) for x in enumerate(labels)])
-        for iset, set_ in enumerate(self.sets):
-            for t,p in zip(*set_[:2]):
-                mat_all[iset, rev_map[p], rev_map[t]] += 1
-
-
-        # for now simply compute a sum of votes across different sets
-        # we might do something more sophisticated later on, and this setup
-        # should easily allow it
-        self.__matrix = np.sum(mat_all, axis=0)
-        self.__Nsamples = np.sum(self.__matrix, axis=0)
-        self.__Ncorrect = sum(np.diag(self.__matrix))
+        mat_all = self.__set_matrices
 
         TP = np.diag(self.__matrix)
         offdiag = self.__matrix - np.diag(TP)
@@ -706,30 +880,35 @@ class ConfusionMatrix(SummaryStatistics):
             ## stats['Friedman(CM):chi^2'], stats['Friedman(CM):p'] = \
             ##                              friedmanchisquare(*CM_per_set)
 
-        #
-        # ROC computation if available
-        ROC = ROCCurve(labels=labels, sets=self.sets)
-        aucs = ROC.aucs
-        if len(aucs)>0:
-            stats['AUC'] = aucs
-            if len(aucs) != Nlabels:
-                raise RuntimeError, \
-                      "We must got a AUC per label. Got %d instead of %d" % \
-                      (len(aucs), Nlabels)
-            self.ROC = ROC
-        else:
-            # we don't want to provide ROC if it is bogus
-            stats['AUC'] = [np.nan] * Nlabels
-            self.ROC = None
-
-
         # compute mean stats
         for k,v in stats.items():
             stats['mean(%s)' % k] = np.mean(v)
 
+        # ROC needs all the estimates, so it is computed only if asked for
+        # (on the sets and labels present now)
+        sets, labels, roc = list(self.sets), list(labels), {}
+        def compute_roc():
+            roc['ROC'], aucs = _compute_roc(sets, labels)
+            return {'AUC': aucs, 'mean(AUC)': np.mean(aucs)}
+        self.__roc = roc
+        self._stats = _LazyStats(compute_roc, ('AUC', 'mean(AUC)'),
+                                 self._stats)
         self._stats.update(stats)
 
 
+    @property
+    def ROC(self):
+        """ROC curve of the stored sets, or None if it is not available"""
+        self.compute()
+        if isinstance(self._stats, _LazyStats):
+            self._stats.evaluate()
+        roc = self.__roc
+        if not 'ROC' in roc:
+            # statistics were restored (e.g. unpickled) without it
+            roc['ROC'] = _compute_roc(list(self.sets), list(self.labels))[0]
+        return roc['ROC']
+
+
     ##REF: Name was automagically refactored
     def as_string(self, short=False, header=True, summary=True,
                  description=False):
@@ -1059,13 +1238,13 @@ class ConfusionMatrix(SummaryStatistics):
 
     @property
     def error(self):
-        self.compute()
+        self._update_matrix()
         return 1.0-self.__Ncorrect*1.0/sum(self.__Nsamples)
 
 
     @property
     def labels(self):
-        self.compute()
+        self._update_matrix()
         return self.__labels
 
 
@@ -1087,14 +1266,14 @@ class ConfusionMatrix(SummaryStatistics):
 
     @property
     def matrix(self):
-        self.compute()
+        self._update_matrix()
         return self.__matrix
 
 
     @property
     ##REF: Name was automagically refactored
     def percent_correct(self):
-        self.compute()
+        self._update_matrix()
         return 100.0*self.__Ncorrect/sum(self.__Nsamples)
 
     labels_map = property(fget=get_labels_map, fset=set_labels_map)
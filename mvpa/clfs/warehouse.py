@@ -43,7 +43,8 @@ _KNOWN_INTERNALS = [ 'knn', 'binary', 'svm', 'linear',
         'regression', 'regression_based',
         'libsvm', 'sg', 'meta', 'retrainable', 'gpr',
         'notrain2predict', 'ridge', 'blr', 'gnpp', 'enet', 'glmnet',
-        'gnb', 'plr', 'rpy2', 'swig', 'skl', 'lda', 'qda' ]
+        'gnb', 'plr', 'rpy2', 'swig', 'skl', 'lda', 'qda',
+        'suffstats' ]
 
 class Warehouse(object):
     """Class to keep known instantiated classifiers
@@ -120,6 +120,19 @@ class Dataset(AttrDataset):
         return ds
 
 
+    def fast_select(self, features, a=[], copy=False):
+        ds = super(Dataset, self).fast_select(features, a=a, copy=copy)
+        # keep mapper (if requested) in sync with the selection
+        if 'mapper' in ds.a:
+            subsetmapper = StaticFeatureSelection(features,
+                                              dshape=self.samples.shape[1:])
+            subsetmapper.forward(np.zeros((1,) + self.shape[1:], dtype='bool'))
+            ds._append_mapper(subsetmapper)
+        return ds
+
+    fast_select.__doc__ = AttrDataset.fast_select.__doc__
+
+
     def find_collection(self, attr):
         """Lookup collection that contains an attribute of a given name.
 
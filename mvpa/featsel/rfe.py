@@ -224,8 +224,11 @@ class RFE(IterativeFeatureSelection):
                       (sensitivity, len(selected_ids), selected_ids))
 
 
-            # Create a dataset only with selected features
-            wdataset = wdataset[:, selected_ids]
+            # Create a dataset only with selected features (copying, since
+            # learners might modify their input in-place).  Dataset
+            # attributes are kept, so every step sees the same kind of input
+            wdataset = wdataset.fast_select(selected_ids, a=None,
+                                            copy=True)
 
             # select corresponding sensitivity values if they are not
             # recomputed
@@ -240,7 +243,8 @@ class RFE(IterativeFeatureSelection):
             #      on a wdataset
             # TODO: document these cases in this class
             if not testdataset is None:
-                wtestdataset = wtestdataset[:, selected_ids]
+                wtestdataset = wtestdataset.fast_select(selected_ids, a=None,
+                                                        copy=True)
 
             step += 1
 
@@ -33,6 +33,13 @@ if __debug__:
 __all__ = ['Kernel', 'NumpyKernel', 'CustomKernel', 'PrecomputedKernel',
            'CachedKernel']
 
+def _get_nfeatures(ds):
+    """Number of features in a dataset or an array of samples"""
+    if is_datasetlike(ds):
+        ds = ds.samples
+    return np.shape(ds)[-1]
+
+
 class Kernel(ClassWithCollections):
     """Abstract class which calculates a kernel function between datasets
 
@@ -283,10 +290,11 @@ class CachedKernel(NumpyKernel):
 
     The cache is asymmetric for lhs and rhs, so compute(d1, d2) does not create
     a cache usable for compute(d2, d1).
-    """
 
-    # TODO: Figure out how to design objects like CrossValidation etc to
-    # precompute this kernel automatically, making it transparent to the user
+    `CrossValidation` of a learner with a `NumpyKernel` computes the
+    kernel on the full dataset automatically, so there is no need to
+    precompute it by hand in that case.
+    """
 
     @property
     def __kernel_name__(self):
@@ -306,6 +314,7 @@ class CachedKernel(NumpyKernel):
         self._kernel = kernel
         self.params.update(self._kernel.params)
         self._rhsids = self._lhsids = self._kfull = None
+        self._nfeatures = None
         self._recomputed = None
 
     def _cache(self, ds1, ds2=None):
@@ -321,6 +330,7 @@ class CachedKernel(NumpyKernel):
         else:
             self._rhsids = SamplesLookup(ds2)
 
+        self._nfeatures = _get_nfeatures(ds1)
         ckernel = self._kernel
         ckernel.compute(ds1, ds2)
         self._kfull = ckernel.as_raw_np()
@@ -357,7 +367,8 @@ class CachedKernel(NumpyKernel):
         # params_modified = True
         changedData = False or force
         if len(self.params.which_set()) or changedData \
-           or self._lhsids is None:
+           or self._lhsids is None \
+           or _get_nfeatures(ds1) != self._nfeatures:
             self._cache(ds1, ds2)# hopefully this will never reset values, just
             # changed status
         else:
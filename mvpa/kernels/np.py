@@ -35,12 +35,14 @@ if __debug__:
 
 class LinearKernel(NumpyKernel):
     """Simple linear kernel: K(a,b) = a*b.T"""
+    __kernel_name__ = 'linear'
     def _compute(self, d1, d2):
         self._k = np.dot(d1, d2.T)
 
 
 class PolyKernel(NumpyKernel):
     """Polynomial kernel: K(a,b) = (gamma*a*b.T+coef0)**degree"""
+    __kernel_name__ = 'poly'
     gamma = Parameter(1, doc='Gamma scaling coefficient')
     degree = Parameter(2, doc="Polynomial degree")
     coef0 = Parameter(1, doc="Offset added to dot product before exponent")
@@ -54,6 +56,7 @@ class RbfKernel(NumpyKernel):
     """Radial basis function (aka Gausian, aka ) kernel
     K(a,b) = exp(-||a-b||**2/sigma)
     """
+    __kernel_name__ = 'rbf'
     sigma = Parameter(1.0, allowedtype=float, doc="Width parameter sigma")
     
     def _compute(self, d1, d2):
@@ -14,7 +14,6 @@ import numpy as np
 
 from mvpa.base import externals
 from mvpa.measures.base import FeaturewiseMeasure
-from mvpa.base.dataset import vstack
 from mvpa.datasets.base import Dataset
 
 # TODO: Extend with access to functionality from scipy.stats?
@@ -28,6 +27,162 @@ from mvpa.datasets.base import Dataset
 #
 # and may be some others
 
+def _expand_stats(labels, all_labels, stats):
+    """Place statistics of `labels` into rows of an array for `all_labels`"""
+    out = np.zeros((len(all_labels),) + stats.shape[1:], dtype=stats.dtype)
+    out[np.searchsorted(all_labels, labels)] = stats
+    return out
+
+
+def _f_scores(ssbn, sstot, na, bign):
+    """F-scores from between group and total sums of squares"""
+    # degrees of freedom
+    dfbn = na - 1
+    dfwn = bign - na
+
+    # within
+    sswn = sstot - ssbn
+
+    # mean sums of squares
+    msb = ssbn / np.asarray(dfbn, dtype=float)
+    msw = sswn / np.asarray(dfwn, dtype=float)
+    f = msb / msw
+    # assure no NaNs -- otherwise it leads instead of
+    # sane unittest failure (check of NaNs) to crazy
+    #   File "mtrand.pyx", line 1661, in mtrand.shuffle
+    #  TypeError: object of type 'numpy.int64' has no len()
+    # without any sane backtrace
+    f[np.isnan(f)] = 0
+    return f, dfbn, dfwn
+
+
+class GroupStats(object):
+    """Per-group sufficient statistics of samples for ANOVAs.
+
+    Holds the number of samples, and per feature the sums and sums of
+    squares of the samples of each group (unique label).  All F-scores of
+    a one-way ANOVA, as well as of all one-vs-rest comparisons, can be
+    derived from them.  Statistics can be updated incrementally, e.g. as
+    samples stream in.
+    """
+
+    def __init__(self, samples=None, labels=None):
+        """
+        Parameters
+        ----------
+        samples : array (nsamples x nfeatures) or None
+          Initial samples.
+        labels : array (nsamples,) or None
+          Group label of each sample.
+        """
+        self.labels = None
+        """Sorted unique labels of the groups."""
+        self.counts = None
+        """Number of samples per group."""
+        self.sums = None
+        """Sums of samples per group (ngroups x nfeatures)."""
+        self.sqsums = None
+        """Sums of squared samples per group (ngroups x nfeatures)."""
+        if samples is not None:
+            self.update(samples, labels)
+
+
+    def update(self, samples, labels):
+        """Add samples with their group labels to the statistics."""
+        samples = np.asanyarray(samples)
+        labels = np.asanyarray(labels)
+        ul = np.unique(labels)
+        codes = np.searchsorted(ul, labels)
+        # all groups are summed up at once via an indicator matrix
+        indicators = (codes[None] == np.arange(len(ul))[:, None]).astype(float)
+        counts = np.bincount(codes, minlength=len(ul))
+        sums = np.dot(indicators, samples)
+        sqsums = np.dot(indicators, samples * samples)
+
+        if self.labels is None:
+            self.labels = ul
+            self.counts, self.sums, self.sqsums = counts, sums, sqsums
+            return
+
+        if sums.shape[1:] != self.sums.shape[1:]:
+            raise ValueError, \
+                  "Samples have %i features, while statistics were " \
+                  "collected for %i" % (sums.shape[1], self.sums.shape[1])
+        all_labels = np.union1d(self.labels, ul)
+        stats = []
+        for old, new in ((self.counts, counts), (self.sums, sums),
+                         (self.sqsums, sqsums)):
+            stats.append(_expand_stats(self.labels, all_labels, old)
+                         + _expand_stats(ul, all_labels, new))
+        self.labels = all_labels
+        self.counts, self.sums, self.sqsums = stats
+
+
+    def _get_totals(self):
+        """Number of samples, total squares of sums and sum of squares"""
+        bign = float(self.counts.sum())
+        total = self.sums.sum(axis=0)
+        # total squares of sums
+        sostot = total * total
+        sostot /= bign
+        # total sum of squares
+        sstot = self.sqsums.sum(axis=0) - sostot
+        return bign, sostot, sstot
+
+
+    def anova(self):
+        """F-scores of a one-way ANOVA across all groups.
+
+        Returns
+        -------
+        f : array (nfeatures,)
+        dfbn : int
+          Degrees of freedom between groups.
+        dfwn : float
+          Degrees of freedom within groups.
+        """
+        bign, sostot, sstot = self._get_totals()
+        # between group sum of squares
+        present = self.counts > 0
+        ssbn = np.sum(self.sums[present] ** 2
+                      / self.counts[present][:, None].astype(float), axis=0)
+        ssbn -= sostot
+        return _f_scores(ssbn, sstot, np.sum(present), bign)
+
+
+    def one_vs_rest_anova(self):
+        """F-scores of one-way ANOVAs of each group vs all others.
+
+        Returns
+        -------
+        f : array (ngroups x nfeatures)
+        dfbn : array (ngroups,)
+          Degrees of freedom between groups for each comparison.
+        dfwn : array (ngroups,)
+          Degrees of freedom within groups for each comparison.
+        """
+        bign, sostot, sstot = self._get_totals()
+        counts = self.counts[:, None].astype(float)
+        rest_counts = bign - counts
+        # sums of all other groups (summed up rather than subtracted from
+        # the total, so e.g. for two groups both comparisons are identical)
+        others = 1 - np.eye(len(counts))
+        rest_sums = np.dot(others, self.sums)
+        # between group sum of squares (of both groups, if they are present)
+        ssbn = np.zeros(self.sums.shape)
+        rest_ssbn = np.zeros(self.sums.shape)
+        for c, s, ss in ((counts, self.sums, ssbn),
+                         (rest_counts, rest_sums, rest_ssbn)):
+            present = c[:, 0] > 0
+            ss[present] = s[present] ** 2 / c[present]
+        ssbn += rest_ssbn
+        ssbn -= sostot
+        # number of groups in each comparison
+        na = (counts > 0).astype(int) + (rest_counts > 0)
+        f, dfbn, dfwn = _f_scores(ssbn, sstot, na, bign)
+        return f, dfbn[:, 0], dfwn[:, 0]
+
+
 class OneWayAnova(FeaturewiseMeasure):
     """`FeaturewiseMeasure` that performs a univariate ANOVA.
 
@@ -55,6 +210,8 @@ class OneWayAnova(FeaturewiseMeasure):
         # so by default auto train
         kwargs['auto_train'] = kwargs.get('auto_train', True)
         FeaturewiseMeasure.__init__(self, space=space, **kwargs)
+        # per-group statistics accumulated by update()
+        self._stats = None
 
 
     def __repr__(self, prefixes=None):
@@ -66,57 +223,51 @@ class OneWayAnova(FeaturewiseMeasure):
             super(FeaturewiseMeasure, self).__repr__(prefixes=prefixes)
 
 
-    def _call(self, dataset):
-        # This code is based on SciPy's stats.f_oneway()
-        # Copyright (c) Gary Strangman.  All rights reserved
-        # License: BSD
-        #
-        # However, it got tweaked and optimized to better fit into PyMVPA.
+    def _untrain(self):
+        self._stats = None
+        super(OneWayAnova, self)._untrain()
 
-        # number of groups
-        targets_sa = dataset.sa[self.get_space()]
-        labels = targets_sa.value
-        ul = targets_sa.unique
 
-        na = len(ul)
-        bign = float(dataset.nsamples)
-        alldata = dataset.samples
+    def update(self, dataset):
+        """Accumulate per-group statistics of (a portion of) a dataset.
 
-        # total squares of sums
-        sostot = np.sum(alldata, axis=0)
-        sostot *= sostot
-        sostot /= bign
+        Allows to compute the measure for data that is streaming in (or
+        does not fit into memory at once) -- use `from_stats()` to compute
+        the result for all samples seen so far.
 
-        # total sum of squares
-        sstot = np.sum(alldata * alldata, axis=0) - sostot
+        Returns
+        -------
+        GroupStats
+          The accumulated statistics.
+        """
+        labels = dataset.sa[self.get_space()].value
+        if self._stats is None:
+            self._stats = GroupStats(dataset.samples, labels)
+        else:
+            self._stats.update(dataset.samples, labels)
+        return self._stats
 
-        # between group sum of squares
-        ssbn = 0
-        for l in ul:
-            # all samples for the respective label
-            d = alldata[labels == l]
-            sos = np.sum(d, axis=0)
-            sos *= sos
-            ssbn += sos / float(len(d))
 
-        ssbn -= sostot
-        # within
-        sswn = sstot - ssbn
-
-        # degrees of freedom
-        dfbn = na-1
-        dfwn = bign - na
-
-        # mean sums of squares
-        msb = ssbn / float(dfbn)
-        msw = sswn / float(dfwn)
-        f = msb / msw
-        # assure no NaNs -- otherwise it leads instead of
-        # sane unittest failure (check of NaNs) to crazy
-        #   File "mtrand.pyx", line 1661, in mtrand.shuffle
-        #  TypeError: object of type 'numpy.int64' has no len()
-        # without any sane backtrace
-        f[np.isnan(f)] = 0
+    def from_stats(self, stats=None):
+        """Compute the measure from per-group statistics.
+
+        Parameters
+        ----------
+        stats : GroupStats or None
+          If None, the statistics accumulated via `update()` are used.
+        """
+        if stats is None:
+            stats = self._stats
+            if stats is None:
+                raise RuntimeError, \
+                      "No statistics were accumulated with update() yet."
+
+        # This code is based on SciPy's stats.f_oneway()
+        # Copyright (c) Gary Strangman.  All rights reserved
+        # License: BSD
+        #
+        # However, it got tweaked and optimized to better fit into PyMVPA.
+        f, dfbn, dfwn = stats.anova()
 
         if externals.exists('scipy'):
             from scipy.stats import fprob
@@ -125,6 +276,11 @@ class OneWayAnova(FeaturewiseMeasure):
             return Dataset(f[np.newaxis])
 
 
+    def _call(self, dataset):
+        return self.from_stats(
+            GroupStats(dataset.samples, dataset.sa[self.get_space()].value))
+
+
 class CompoundOneWayAnova(OneWayAnova):
     """Compound comparisons via univariate ANOVA.
 
@@ -138,29 +294,29 @@ class CompoundOneWayAnova(OneWayAnova):
     returned dataset.
     """
 
-    def _call(self, dataset):
-        """Computes featurewise f-scores using compound comparisons."""
-
-        targets_sa = dataset.sa[self.get_space()]
-        orig_labels = targets_sa.value
-        labels = orig_labels.copy()
-
-        # Lets create a very shallow copy of a dataset with just
-        # samples and targets_attr
-        dataset_mod = Dataset(dataset.samples,
-                              sa={self.get_space() : labels})
-        results = []
-        for ul in targets_sa.unique:
-            labels[orig_labels == ul] = 1
-            labels[orig_labels != ul] = 2
-            f_ds = OneWayAnova._call(self, dataset_mod)
-            if 'fprob' in f_ds.fa:
-                # rename the fprob attribute to something label specific
-                # to survive final aggregation stage
-                f_ds.fa['fprob_' + str(ul)] = f_ds.fa.fprob
-                del f_ds.fa['fprob']
-            results.append(f_ds)
-
-        results = vstack(results)
-        results.sa[self.get_space()] = targets_sa.unique
+    def from_stats(self, stats=None):
+        """Compute the measure from per-group statistics.
+
+        All one-vs-rest comparisons are derived from the same statistics.
+
+        Parameters
+        ----------
+        stats : GroupStats or None
+          If None, the statistics accumulated via `update()` are used.
+        """
+        if stats is None:
+            stats = self._stats
+            if stats is None:
+                raise RuntimeError, \
+                      "No statistics were accumulated with update() yet."
+
+        f, dfbn, dfwn = stats.one_vs_rest_anova()
+        results = Dataset(f, sa={self.get_space(): stats.labels})
+
+        if externals.exists('scipy'):
+            from scipy.stats import fprob
+            fprobs = fprob(dfbn[:, None], dfwn[:, None], f)
+            for ul, p in zip(stats.labels, fprobs):
+                # label specific name to distinguish the comparisons
+                results.fa['fprob_' + str(ul)] = p
         return results
@@ -37,6 +37,7 @@ from mvpa.base.dataset import AttrDataset
 from mvpa.datasets import Dataset, vstack, hstack
 from mvpa.mappers.fx import BinaryFxNode
 from mvpa.generators.splitters import Splitter
+from mvpa.kernels.base import NumpyKernel, PrecomputedKernel, CachedKernel
 
 if __debug__:
     from mvpa.base import debug
@@ -389,7 +390,8 @@ class CrossValidation(RepeatedMeasure):
 
     # TODO move conditional attributes from CVTE into this guy
     def __init__(self, learner, generator, errorfx=mean_mismatch_error,
-                 splitter=None, **kwargs):
+                 splitter=None, cache_kernel=True, cache_suffstats=True,
+                 **kwargs):
         """
         Parameters
         ----------
@@ -416,6 +418,17 @@ class CrossValidation(RepeatedMeasure):
           ``2``-labeled partition second. This behavior corresponds to most
           Partitioners that label the taken-out portion ``2`` and the remainder
           with ``1``.
+        cache_kernel : bool
+          If the learner has a `NumpyKernel` (e.g. SVM with a kernel
+          computed by PyMVPA), compute the kernel once on the full dataset
+          and let all folds look up their parts of it.  A `CachedKernel`
+          assigned to the learner gets reused, any other kernel gets
+          wrapped into a `CachedKernel` for the duration of the call.
+        cache_suffstats : bool
+          If the learner is trained from sufficient statistics (tagged
+          'suffstats', e.g. GNB, LDA/QDA, RidgeReg, BLR), compute them
+          once on the full dataset, so training in every fold only has to
+          subtract the contribution of the left out samples.
         """
         # compile the appropriate repeated measure to do cross-validation from
         # pieces
@@ -446,6 +459,9 @@ class CrossValidation(RepeatedMeasure):
         RepeatedMeasure.__init__(self, tm, generator, space=space,
                                  **kwargs)
 
+        self.cache_kernel = cache_kernel
+        self.cache_suffstats = cache_suffstats
+
         for ca in ['stats', 'training_stats']:
             if self.ca.is_enabled(ca):
                 # enforce ca if requested
@@ -460,13 +476,56 @@ class CrossValidation(RepeatedMeasure):
             + _repr_attrs(self, ['learner', 'splitter'])
             + _repr_attrs(self, ['errorfx'], default=mean_mismatch_error)
             + _repr_attrs(self, ['space'], default='sa.cvfolds')
+            + _repr_attrs(self, ['cache_kernel', 'cache_suffstats'],
+                          default=True)
             )
 
 
     def _call(self, ds):
         # always untrain to wipe out previous stats
         self.untrain()
-        return super(CrossValidation, self)._call(ds)
+        learner = self.learner
+        kernel = None
+        params = getattr(learner, 'params', None)
+        if self.cache_kernel and params is not None \
+               and params.has_key('kernel'):
+            kernel = params.kernel
+            if not isinstance(kernel, NumpyKernel) \
+                   or isinstance(kernel, PrecomputedKernel):
+                kernel = None
+        tags = getattr(learner, '__tags__', [])
+        # meta learners inherit tags of the slave learners
+        suffstats = self.cache_suffstats \
+                    and 'suffstats' in tags and not 'meta' in tags
+        if kernel is None and not suffstats:
+            return super(CrossValidation, self)._call(ds)
+
+        # kernel and/or sufficient statistics get computed once on the full
+        # dataset, so all the folds only look their parts up.  Lookup
+        # attributes get assigned to a shallow copy to not alter the input
+        # dataset
+        ds = ds.copy(deep=False)
+        if isinstance(kernel, CachedKernel):
+            # might be precached already
+            kernel.compute(ds)
+            kernel = None               # nothing to restore
+        elif kernel is not None:
+            if __debug__:
+                debug("CERR", "Caching kernel %s of %s for cross-validation"
+                      % (kernel, learner))
+            ckernel = CachedKernel(kernel)
+            ckernel.compute(ds)
+            params.kernel = ckernel
+        if suffstats:
+            learner.cache_suffstats(ds)
+        try:
+            res = super(CrossValidation, self)._call(ds)
+        finally:
+            if kernel is not None:
+                params.kernel = kernel
+            if suffstats:
+                learner.cache_suffstats(None)
+        return res
 
 
     def _repetition_postcall(self, ds, node, result):
@@ -15,8 +15,7 @@ from mvpa.base import externals
 import numpy as np
 
 if externals.exists('scipy', raise_=True):
-    # TODO: implement corrcoef optionally without scipy, e.g. np.corrcoef
-    from scipy.stats import pearsonr
+    from scipy.special import betainc
 
 from mvpa.measures.base import FeaturewiseMeasure
 from mvpa.datasets.base import Dataset
@@ -37,8 +36,9 @@ class CorrCoef(FeaturewiseMeasure):
         pvalue : bool
           Either to report p-value of pearsons correlation coefficient
           instead of pure correlation coefficient
-        attr : str
-          What attribut to correlate with
+        attr : str or list of str
+          What attribute(s) to correlate with. For a list of attributes
+          the result contains one row per attribute (in the same order).
         """
         # init base classes first
         FeaturewiseMeasure.__init__(self, **kwargs)
@@ -50,29 +50,62 @@ class CorrCoef(FeaturewiseMeasure):
     def _call(self, dataset):
         """Computes featurewise scores."""
 
-        attrdata = dataset.sa[self.__attr].value
-        if np.issubdtype(attrdata.dtype, 'c'):
-            raise ValueError("Correlation coefficent measure is not meaningful "
-                             "for datasets with literal labels.")
+        if isinstance(self.__attr, basestring):
+            attrs = [self.__attr]
+        else:
+            attrs = self.__attr
+
+        attrdata = []
+        for attr in attrs:
+            values = dataset.sa[attr].value
+            if np.issubdtype(values.dtype, 'c'):
+                raise ValueError("Correlation coefficent measure is not "
+                                 "meaningful for datasets with literal labels.")
+            attrdata.append(values)
+        # samples x attributes
+        attrdata = np.array(attrdata, dtype=float).T
 
         samples = dataset.samples
+        nsamples = len(samples)
         pvalue_index = self.__pvalue
-        result = np.empty((dataset.nfeatures,), dtype=float)
-
-        for ifeature in xrange(dataset.nfeatures):
-            samples_ = samples[:, ifeature]
-            corr = pearsonr(samples_, attrdata)
-            corrv = corr[pvalue_index]
-            # Should be safe to assume 0 corr_coef (or 1 pvalue) if value
-            # is actually NaN, although it might not be the case (covar of
-            # 2 constants would be NaN although should be 1)
-            if np.isnan(corrv):
-                if np.var(samples_) == 0.0 and np.var(attrdata) == 0.0 \
-                   and len(samples_):
-                    # constant terms
-                    corrv = 1.0 - pvalue_index
-                else:
-                    corrv = pvalue_index
-            result[ifeature] = corrv
-
-        return Dataset(result[np.newaxis])
+
+        # Pearson's r for all pairs of attributes and features at once
+        # (same computation as in scipy.stats.pearsonr)
+        xm = samples - samples.mean(axis=0)
+        ym = attrdata - attrdata.mean(axis=0)
+        r_num = np.dot(ym.T, xm)
+        r_den = np.sqrt(np.multiply.outer(np.add.reduce(ym * ym),
+                                          np.add.reduce(xm * xm)))
+        # 0/0 for constant features/attributes gives NaN -- handled below
+        olderr = np.seterr(divide='ignore', invalid='ignore')
+        try:
+            result = r_num / r_den
+            result = np.clip(result, -1.0, 1.0)
+
+            if pvalue_index:
+                # two-sided p-value from the t-distribution
+                df = nsamples - 2
+                t_squared = result * result \
+                            * (df / ((1.0 - result) * (1.0 + result)))
+                x = df / (df + t_squared)
+                # NaN (undefined correlation) yields a p-value of 1
+                x = np.where(x < 1.0, x, 1.0)
+                prob = betainc(0.5 * df, 0.5, x)
+                prob[np.abs(result) == 1.0] = 0.0
+                result = prob
+        finally:
+            np.seterr(**olderr)
+
+        # Should be safe to assume 0 corr_coef (or 1 pvalue) if value
+        # is actually NaN, although it might not be the case (covar of
+        # 2 constants would be NaN although should be 1)
+        nans = np.isnan(result)
+        if np.any(nans):
+            # constant terms
+            constant = np.multiply.outer(np.var(attrdata, axis=0) == 0.0,
+                                         np.var(samples, axis=0) == 0.0)
+            constant &= nsamples > 0
+            result[nans] = pvalue_index
+            result[nans & constant] = 1.0 - pvalue_index
+
+        return Dataset(result)
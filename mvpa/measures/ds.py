@@ -14,29 +14,62 @@ __docformat__ = 'restructuredtext'
 
 import numpy as np
 from mvpa.measures.base import Measure
-from mvpa.misc.stats import DSMatrix
+from mvpa.misc.stats import DSMatrix, _correlation_transform
 
 class DSMMeasure(Measure):
     """DSMMeasure creates a Measure object
        where metric can be one of 'euclidean', 'spearman', 'pearson'
-       or 'confusion'"""
+       or 'confusion'
+
+       For the 'spearman' and 'pearson' output metrics the rank-transformed
+       (and z-scored) vector form of the target `dsmatrix` is computed only
+       once, so it is reused across all ROIs when running in a searchlight.
+       """
 
     def __init__(self, dsmatrix, dset_metric, output_metric='spearman'):
+        """
+        Parameters
+        ----------
+        dsmatrix : DSMatrix
+          Target dissimilarity matrix.
+        dset_metric : str
+          Metric to compute the dissimilarity matrix of a dataset.
+        output_metric : str
+          Metric to compare the two dissimilarity matrices.
+        """
         Measure.__init__(self)
 
         self.dsmatrix = dsmatrix
         self.dset_metric = dset_metric
         self.output_metric = output_metric
         self.dset_dsm = []
+        # (dsmatrix, transformed vector form) of the target
+        self.__target = None
+
+
+    def _get_target(self):
+        """Transformed vector form of the target dissimilarity matrix"""
+        if self.__target is None or self.__target[0] is not self.dsmatrix:
+            self.__target = (self.dsmatrix, _correlation_transform(
+                self.dsmatrix.get_vector_form()[None], self.output_metric)[0])
+        return self.__target[1]
 
 
     def __call__(self, dataset):
         # create the dissimilarity matrix for the data in the input dataset
         self.dset_dsm = DSMatrix(dataset.samples, self.dset_metric)
 
-        in_vec = self.dsmatrix.get_vector_form()
         dset_vec = self.dset_dsm.get_vector_form()
 
+        if self.output_metric in ('spearman', 'pearson'):
+            # correlate with the cached transformed target
+            target = self._get_target()
+            dset_z = _correlation_transform(dset_vec[None],
+                                            self.output_metric)[0]
+            return 1 - np.dot(target, dset_z) / len(dset_z)
+
+        in_vec = self.dsmatrix.get_vector_form()
+
         # concatenate the two vectors, send to dissimlarity function
         test_mat = np.asarray([in_vec, dset_vec])
 
@@ -22,43 +22,79 @@ class GLM(FeaturewiseMeasure):
     Regressors can be defined in a design matrix and a linear fit of the data
     is computed univariately (i.e. indepently for each feature). This measure
     can report 'raw' parameter estimates (i.e. beta weights) of the linear
-    model, as well as standardized parameters (z-stat) using an ordinary
-    least squares (aka fixed-effects) approach to estimate the parameter
-    estimate.
-
-    The measure is reported in a (nfeatures x nregressors)-shaped array.
+    model, as well as standardized parameters (z-stat) or t-statistics using
+    an ordinary least squares (aka fixed-effects) approach to estimate the
+    parameter estimate.  Instead of individual parameters, standardized
+    scores can also be reported for linear contrasts of the parameters, in
+    which case the covariance of the parameter estimates (full inverse of
+    the design's inner product) is taken into account.
+
+    The measure is reported in a (nregressors x nfeatures)-shaped array
+    (or (ncontrasts x nfeatures) for statistics of contrasts).  Features
+    can be processed in chunks to limit the memory needed for large
+    (e.g. whole-brain) datasets.
     """
 
     pe = ConditionalAttribute(enabled=False,
         doc="Parameter estimates (nfeatures x nparameters).")
 
     zstat = ConditionalAttribute(enabled=False,
-        doc="Standardized parameter estimates (nfeatures x nparameters).")
+        doc="Standardized parameter (or contrast) estimates "
+            "(nfeatures x nparameters, or nfeatures x ncontrasts).")
+
+    tstat = ConditionalAttribute(enabled=False,
+        doc="t-statistics of parameter (or contrast) estimates "
+            "(nfeatures x nparameters, or nfeatures x ncontrasts).")
 
     is_trained = True
     """Indicate that this measure is always trained."""
 
-    def __init__(self, design, voi='pe', **kwargs):
+    def __init__(self, design, voi='pe', contrasts=None, chunksize=None,
+                 **kwargs):
         """
         Parameters
         ----------
         design : array (nsamples x nregressors)
           GLM design matrix.
-        voi : {'pe', 'zstat'}
+        voi : {'pe', 'zstat', 'tstat'}
           Variable of interest that should be reported as feature-wise
-          measure. 'beta' are the parameter estimates and 'zstat' returns
-          standardized parameter estimates.
+          measure. 'pe' are the parameter estimates, 'zstat' returns
+          standardized parameter estimates (estimates divided by their
+          standard error based on the variance of the residuals), and
+          'tstat' returns t-statistics (standard error based on the residual
+          sum of squares divided by the residual degrees of freedom).
+        contrasts : array (nregressors,) or (ncontrasts x nregressors) or None
+          If provided, 'zstat' and 'tstat' are computed for these linear
+          combinations of the parameter estimates instead of the individual
+          parameters.
+        chunksize : int or None
+          Number of features processed at once.  If None, all features are
+          processed in a single chunk.
         """
         FeaturewiseMeasure.__init__(self, **kwargs)
         # store the design matrix as a such (no copying if already array)
-        self._design = np.asmatrix(design)
+        self._design = np.asarray(design)
 
         # what should be computed ('variable of interest')
-        if not voi in ['pe', 'zstat']:
+        if not voi in ['pe', 'zstat', 'tstat']:
             raise ValueError, \
                   "Unknown variable of interest '%s'" % str(voi)
         self._voi = voi
 
+        if contrasts is not None:
+            contrasts = np.atleast_2d(np.asarray(contrasts, dtype=float))
+            if contrasts.ndim != 2 \
+               or contrasts.shape[1] != self._design.shape[1]:
+                raise ValueError, \
+                      "Contrasts need to have as many columns as there are " \
+                      "regressors in the design (%i). Got %s." \
+                      % (self._design.shape[1], contrasts.shape)
+        self._contrasts = contrasts
+
+        if chunksize is not None and chunksize < 1:
+            raise ValueError, "chunksize must be a positive integer"
+        self._chunksize = chunksize
+
         # will store the precomputed Moore-Penrose pseudo-inverse of the
         # design matrix (lazy calculation)
         self._inv_design = None
@@ -70,48 +106,80 @@ class GLM(FeaturewiseMeasure):
     def _call(self, dataset):
         # just for the beauty of it
         X = self._design
+        C = self._contrasts
+        samples = dataset.samples
+        nsamples, nfeatures = samples.shape
 
         # precompute transformation is not yet done
         if self._inv_design is None:
-            self._inv_ip = (X.T * X).I
-            self._inv_design = self._inv_ip * X.T
-
-        # get parameter estimations for all features at once
-        # (betas x features)
-        betas = self._inv_design * dataset.samples
+            self._inv_ip = np.linalg.inv(np.dot(X.T, X))
+            self._inv_design = np.dot(self._inv_ip, X.T)
+
+        # if betas and no z/t-stats are desired we can skip the residuals
+        need_stats = not self._voi == 'pe' \
+                     or self.ca.is_enabled('zstat') \
+                     or self.ca.is_enabled('tstat')
+
+        chunksize = self._chunksize
+        if chunksize is None:
+            chunksize = max(nfeatures, 1)
+
+        # parameter estimations (betas x features) and residual variance
+        # estimates (features), computed for a chunk of features at a time
+        betas = np.empty((X.shape[1], nfeatures))
+        if need_stats:
+            resvar = np.empty(nfeatures)
+            rss = np.empty(nfeatures)
+        for start in xrange(0, nfeatures, chunksize):
+            chunk = slice(start, start + chunksize)
+            data = samples[:, chunk]
+            betas[:, chunk] = chunk_betas = np.dot(self._inv_design, data)
+            if need_stats:
+                residuals = np.dot(X, chunk_betas)
+                residuals -= data
+                # assumption of mean(E) == 0 and equal variance
+                resvar[chunk] = residuals.var(axis=0)
+                residuals *= residuals
+                rss[chunk] = residuals.sum(axis=0)
 
         # charge state
-        self.ca.pe = pe = betas.T.A
-
-        # if betas and no z-stats are desired return them right away
-        if not self._voi == 'pe' or self.ca.is_enabled('zstat'):
-            # compute residuals
-            residuals = X * betas
-            residuals -= dataset.samples
-
-            # estimates of the parameter variance and compute zstats
-            # assumption of mean(E) == 0 and equal variance
-            # XXX next lines ignore off-diagonal elements and hence covariance
-            # between regressors. The humble being writing these lines asks the
-            # god of statistics for forgives, because it knows not what it does
-            diag_ip = np.diag(self._inv_ip)
-            # (features x betas)
-            beta_vars = np.array([ r.var() * diag_ip for r in residuals.T ])
+        self.ca.pe = betas.T
+
+        if need_stats:
+            # estimates of interest and their variance factors, i.e.
+            # diag(C (X'X)^-1 C')
+            if C is None:
+                estimates = betas
+                var_factors = np.diag(self._inv_ip)
+            else:
+                estimates = np.dot(C, betas)
+                var_factors = np.sum(np.dot(C, self._inv_ip) * C, axis=1)
+            var_factors = var_factors[:, None]
+
             # (parameter x feature)
-            zstat = pe / np.sqrt(beta_vars)
+            zstat = estimates / np.sqrt(resvar * var_factors)
+            dof = nsamples - X.shape[1]
+            tstat = estimates / np.sqrt(rss / dof * var_factors)
 
             # charge state
-            self.ca.zstat = zstat
+            self.ca.zstat = zstat.T
+            self.ca.tstat = tstat.T
 
         if self._voi == 'pe':
             # return as (beta x feature)
-            result = Dataset(pe.T)
+            result = Dataset(betas)
         elif self._voi == 'zstat':
             # return as (zstat x feature)
-            result = Dataset(zstat.T)
+            result = Dataset(zstat)
+        elif self._voi == 'tstat':
+            # return as (tstat x feature)
+            result = Dataset(tstat)
         else:
             # we shall never get to this point
             raise ValueError, \
                   "Unknown variable of interest '%s'" % str(self._voi)
-        result.sa['regressor'] = np.arange(len(result))
+        if self._voi != 'pe' and C is not None:
+            result.sa['contrast'] = np.arange(len(result))
+        else:
+            result.sa['regressor'] = np.arange(len(result))
         return result
@@ -21,6 +21,7 @@ from mvpa.misc.errorfx import mean_mismatch_error
 from mvpa.measures.searchlight import BaseSearchlight
 from mvpa.base import externals, warning
 from mvpa.base.dochelpers import borrowkwargs, _repr_attrs
+from mvpa.base.parallel import parallel_map
 from mvpa.generators.splitters import Splitter
 
 #from mvpa.base.param import Parameter
@@ -40,7 +41,8 @@ if externals.exists('scipy'):
         True: 'shape',
         False: 'dims'} [externals.versions['scipy'] >= '0.7.0']
 
-__all__ = [ "GNBSearchlight", 'sphere_gnbsearchlight' ]
+__all__ = [ "GNBSearchlight", "GNBSearchlightCache",
+            'sphere_gnbsearchlight' ]
 
 def lastdim_columnsums_fancy_indexing(a, inds, out):#, out=None):
     ## if out is None:
@@ -120,10 +122,178 @@ def lastdim_columnsums_spmatrix(a, inds, out):
         inds_s = inds_to_coo(inds, shape=(n_cols, n_sums))
 
     ar = a.reshape((-1, a.shape[-1]))
-    sums = np.asarray((sps.csr_matrix(ar) * inds_s).todense())
+    # sparse by dense product avoids conversion of `a` into sparse matrix
+    sums = np.asarray(inds_s.T.tocsr() * ar.T).T
     out[:] = sums.reshape(in_shape+(n_sums,))
 
 
+class GNBSearchlightCache(object):
+    """Statistics which `GNBSearchlight` can reuse across its calls.
+
+    Running the same `GNBSearchlight` over and over on the same data
+    (e.g. with permuted targets to estimate a null distribution)
+    recomputes a lot of information which does not depend on the
+    targets.  Providing an instance of this class as the `cache`
+    argument to (possibly multiple) `GNBSearchlight` instances keeps
+
+    - the neighborhood of each ROI (and its representation for the
+      `indexsum` method),
+    - the samples and their squares in floating point, so whenever the
+      assignment of the samples into blocks changes (e.g. due to permuted
+      targets) per-block sums and sums of squares are only re-aggregated
+      from them,
+    - the per-block sums and sums of squares themselves, which are reused
+      as long as the assignment of the samples into blocks stays the same.
+
+    Keeping per-sample statistics doubles the memory footprint of the
+    samples array, which is the price for not rescanning the data for
+    every permutation.
+
+    Cached information is tied to the memory of the samples array of
+    the dataset (shallow copies of a dataset share it), so modifying the
+    samples in-place requires to `reset()` the cache.
+    """
+
+    def __init__(self):
+        """Initialize an empty cache"""
+        self.reset()
+
+
+    def reset(self):
+        """Forget all cached information"""
+        self._samples = None
+        self._neighbors_key = None
+        self._roi_fids = None
+        self._roi_chunks = {}
+        self._sample_stats = None
+        self._blocks_key = None
+        self._block_stats = None
+
+
+    def _check_samples(self, samples):
+        """Reset the cache whenever it is used with different samples"""
+        cached = self._samples
+        if cached is None or not (
+            samples is cached
+            or (samples.__array_interface__ == cached.__array_interface__)):
+            self.reset()
+            # keep a reference, so the memory could not get reused
+            self._samples = samples
+
+
+    def get_neighbors(self, samples, qe, roi_ids):
+        """List of feature ids for each ROI
+
+        Parameters
+        ----------
+        samples : ndarray
+          Samples of the dataset the query engine was trained on.
+        qe : QueryEngine
+          Trained query engine.
+        roi_ids : sequence of int
+          Ids of the ROI centers.
+        """
+        self._check_samples(samples)
+        key = (qe, np.asanyarray(roi_ids))
+        if self._neighbors_key is None \
+               or not key[0] is self._neighbors_key[0] \
+               or not np.array_equal(key[1], self._neighbors_key[1]):
+            self._roi_fids = [qe.query_byid(f) for f in roi_ids]
+            self._roi_chunks = {}
+            self._neighbors_key = key
+        elif __debug__:
+            debug('SLC', 'Reusing neighbors of %i ROIs'
+                  % len(self._roi_fids))
+        return self._roi_fids
+
+
+    def get_roi_chunks(self, nchunks, nfeatures, indexsum):
+        """Split ROIs (as of last `get_neighbors`) into `nchunks` chunks
+
+        Returns
+        -------
+        list of tuple
+          (roi_slice, fids, indexer) per each chunk, where `fids` are
+          the features (or slice(None) for all of them) needed for the
+          ROIs in `roi_slice` and `indexer` is the ROIs representation
+          (in terms of positions among `fids`) suitable for `indexsum`.
+        """
+        key = (nchunks, nfeatures, indexsum)
+        if key in self._roi_chunks:
+            return self._roi_chunks[key]
+        roi_fids = self._roi_fids
+        nrois = len(roi_fids)
+        bounds = np.linspace(0, nrois, nchunks + 1).astype(int)
+        chunks = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if start == stop:
+                continue
+            chunk_fids = roi_fids[start:stop]
+            if nchunks == 1:
+                fids = slice(None)
+                nfids = nfeatures
+            else:
+                # features involved in any of the chunk's ROIs, so only
+                # those need to be considered while summing
+                fids = np.unique(np.concatenate(
+                    [np.asanyarray(x, dtype=int) for x in chunk_fids]))
+                chunk_fids = [np.searchsorted(fids, x) for x in chunk_fids]
+                nfids = len(fids)
+            if indexsum == 'sparse':
+                # convert to "sparse representation" where column j
+                # contains 1s only at the chunk_fids[j] indices
+                indexer = inds_to_coo(chunk_fids,
+                                      shape=(nfids, len(chunk_fids))).tocsc()
+            else:
+                indexer = chunk_fids
+            chunks.append((slice(start, stop), fids, indexer))
+        self._roi_chunks[key] = chunks
+        return chunks
+
+
+    def get_sample_stats(self, samples):
+        """Samples and their squares (as float) for the aggregation
+
+        Those do not depend on the targets, so they are computed only
+        once for the same samples.
+        """
+        self._check_samples(samples)
+        if self._sample_stats is None:
+            X = np.asarray(samples, dtype=float)
+            self._sample_stats = X, np.square(X)
+        elif __debug__:
+            debug('SLC', 'Reusing statistics for %i samples' % len(samples))
+        return self._sample_stats
+
+
+    def get_block_stats(self, samples, sample2block, nblocks):
+        """Sums, sums of squares and number of samples per each block
+
+        Statistics are re-aggregated from the cached per-sample statistics
+        only if the assignment of samples into blocks changes.
+        """
+        self._check_samples(samples)
+        key = self._blocks_key
+        if key is not None and key[1] == nblocks \
+               and np.array_equal(key[0], sample2block):
+            if __debug__:
+                debug('SLC', 'Reusing statistics for %i blocks' % nblocks)
+            return self._block_stats
+        X, X2 = self.get_sample_stats(samples)
+        # collect samples of the same block together, so each block
+        # gets summed up at once
+        order = np.argsort(sample2block, kind='mergesort')
+        starts = np.searchsorted(sample2block[order], np.arange(nblocks))
+        sums = np.add.reduceat(X[order], starts, axis=0)
+        sums2 = np.add.reduceat(X2[order], starts, axis=0)
+        block_counts = np.bincount(sample2block,
+                                   minlength=nblocks).astype(float)
+        self._blocks_key = (sample2block.copy(), nblocks)
+        self._block_stats = sums, sums2, block_counts
+        return self._block_stats
+
+
+
 class GNBSearchlight(BaseSearchlight):
     """Efficient implementation of Gaussian Naive Bayes `Searchlight`.
 
@@ -145,7 +315,7 @@ class GNBSearchlight(BaseSearchlight):
 
     @borrowkwargs(BaseSearchlight, '__init__')
     def __init__(self, gnb, generator, qe, errorfx=mean_mismatch_error,
-                 indexsum=None, **kwargs):
+                 indexsum=None, cache=None, **kwargs):
         """Initialize a GNBSearchlight
 
         Parameters
@@ -163,6 +333,10 @@ class GNBSearchlight(BaseSearchlight):
           corresponds to regular fancy indexing over columns, whenever
           in 'sparse', produce of sparse matrices is used (usually
           faster, so is default if `scipy` is available.
+        cache : GNBSearchlightCache, optional
+          Cache to reuse neighborhoods and data statistics across calls
+          (e.g. while computing a permutation-based null distribution).
+          If None, nothing is kept in between the calls.
         """
 
         # init base class first
@@ -183,17 +357,14 @@ class GNBSearchlight(BaseSearchlight):
                         "'indexsum' method.")
                 indexsum = 'fancy'
         self._indexsum = indexsum
-
-        if not self.nproc in (None, 1):
-            raise NotImplementedError, "For now only nproc=1 (or None for " \
-                  "autodetection) is supported by GNBSearchlight"
+        self._cache = cache
 
     def __repr__(self, prefixes=[]):
         return super(GNBSearchlight, self).__repr__(
             prefixes=prefixes
             + _repr_attrs(self, ['gnb', 'generator'])
             + _repr_attrs(self, ['errorfx'], default=mean_mismatch_error)
-            + _repr_attrs(self, ['indexsum'])
+            + _repr_attrs(self, ['indexsum', 'cache'])
             )
 
     def _sl_call(self, dataset, roi_ids, nproc):
@@ -335,51 +506,20 @@ class GNBSearchlight(BaseSearchlight):
             debug('SLC',
                   'Phase 3. Computing statistics for %i blocks' % (nblocks,))
 
-        #
-        # reusable containers which should stay of the same size
-        #
-
-        # sums and sums of squares per each block
-        sums = np.zeros((nblocks, ) + s_shape)
-        # sums of squares
-        sums2 = np.zeros((nblocks, ) + s_shape)
-
-        # per each label:
-        means = np.zeros((nlabels, ) + s_shape)
-        # means of squares for stddev computation
-        means2 = np.zeros((nlabels, ) + s_shape)
-        variances = np.zeros((nlabels, ) + s_shape)
-        # degenerate dimension are added for easy broadcasting later on
-        nsamples_per_class = np.zeros((nlabels,) + (1,)*len(s_shape))
-
-        # results
-        results = np.zeros((nsplits,) + r_shape)
+        cache = self._cache
+        if cache is None:
+            cache = GNBSearchlightCache()
+        sums, sums2, block_counts = \
+              cache.get_block_stats(X, sample2block, nblocks)
+        block_labels = np.zeros((nblocks,), dtype=int)
+        block_labels[sample2block] = labels_numeric
 
-        block_counts = np.zeros((nblocks,))
-        block_labels = [None] * nblocks
-
-        X2 = np.square(X)
-        # silly way for now
-        for l, s, s2, ib in zip(labels_numeric, X, X2, sample2block):
-            sums[ib] += s
-            sums2[ib] += s2
-            block_counts[ib] += 1
-            if block_labels[ib] is None:
-                block_labels[ib] = l
-            else:
-                assert(block_labels[ib] == l)
-        block_labels = np.asanyarray(block_labels)
-        # additional silly tests for paranoid
-        assert(block_labels.dtype.kind is 'i')
-
-        # 4. Lets deduce all neighbors... might need to be RF into the
-        #    parallel part later on
+        # 4. Lets deduce all neighbors
         if __debug__:
             debug('SLC',
                   'Phase 4. Deducing neighbors information for %i ROIs'
                   % (nrois,))
-        roi_fids = [qe.query_byid(f) for f in roi_ids]
-        nroi_fids = len(roi_fids)
+        roi_fids = cache.get_neighbors(X, qe, roi_ids)
         # makes sense to waste precious ms only if ca is enabled
         if self.ca.is_enabled('roi_sizes'):
             roi_sizes = [len(x) for x in roi_fids]
@@ -388,28 +528,22 @@ class GNBSearchlight(BaseSearchlight):
 
         indexsum = self._indexsum
         if indexsum == 'sparse':
-            if __debug__:
-                debug('SLC',
-                      'Phase 4b. Converting neighbors to sparse matrix '
-                      'representation')
-            # convert to "sparse representation" where column j contains
-            # 1s only at the roi_fids[j] indices
-            roi_fids = inds_to_coo(roi_fids,
-                                   shape=(dataset.nfeatures, nroi_fids))
             indexsum_fx = lastdim_columnsums_spmatrix
         elif indexsum == 'fancy':
             indexsum_fx = lastdim_columnsums_fancy_indexing
         else:
             raise ValueError, \
                   "Do not know how to deal with indexsum=%s" % indexsum
+        roi_chunks = cache.get_roi_chunks(min(nproc, max(nrois, 1)),
+                                          dataset.nfeatures, indexsum)
 
-        # 5. Lets do actual "splitting" and "classification"
+        # 5. Lets do actual "splitting" and "training", which requires
+        #    only aggregation of the block statistics
         if __debug__:
-            debug('SLC', 'Phase 5. Major loop' )
+            debug('SLC', 'Phase 5. Training for %i splits' % nsplits)
 
+        models = []
         for isplit, split in enumerate(splits):
-            if __debug__:
-                debug('SLC', ' Split %i out of %i' % (isplit, nsplits))
             # figure out for a given splits the blocks we want to work
             # with
             # sample_indicies
@@ -417,6 +551,14 @@ class GNBSearchlight(BaseSearchlight):
             # convert to blocks training split
             training_bis = np.unique(sample2block[training_sis])
 
+            # per each label:
+            means = np.zeros((nlabels, ) + s_shape)
+            # means of squares for stddev computation
+            means2 = np.zeros((nlabels, ) + s_shape)
+            variances = np.zeros((nlabels, ) + s_shape)
+            # degenerate dimension are added for easy broadcasting later on
+            nsamples_per_class = np.zeros((nlabels,) + (1,)*len(s_shape))
+
             # now lets do our GNB business
             training_nsamples = 0
             for il, l in enumerate(ulabels_numeric):
@@ -459,53 +601,69 @@ class GNBSearchlight(BaseSearchlight):
             # last added dimension would be for ROIs
             logpriors = np.log(priors[:, np.newaxis, np.newaxis])
 
+            models.append((means, variances, norm_weight, logpriors,
+                           split[1].samples[:, 0]))
+
+        def classify(isplit, ichunk):
+            """'Classify' testing samples of a split within a chunk of ROIs
+            """
+            means, variances, norm_weight, logpriors, testing_sis = \
+                   models[isplit]
+            rois, fids, indexer = roi_chunks[ichunk]
             if __debug__:
-                debug('SLC', "  'Training' is done")
+                debug('SLC', "  Doing 'Searchlight' for split %i on ROIs "
+                      "%i-%i" % (isplit, rois.start, rois.stop - 1))
 
             # Now it is time to "classify" our samples.
             # and for that we first need to compute corresponding
             # probabilities (or may be un
-            data = X[split[1].samples[:, 0]]
-            targets = labels_numeric[split[1].samples[:, 0]]
+            data = X[testing_sis][:, fids]
+            targets = labels_numeric[testing_sis]
 
             # argument of exponentiation
             scaled_distances = \
-                 -0.5 * (((data - means[:, np.newaxis, ...])**2) \
-                         / variances[:, np.newaxis, ...])
+                 -0.5 * (((data - means[:, fids][:, np.newaxis])**2) \
+                         / variances[:, fids][:, np.newaxis])
 
             # incorporate the normalization from normals
-            lprob_csfs = norm_weight[:, np.newaxis, ...] + scaled_distances
+            lprob_csfs = norm_weight[:, fids][:, np.newaxis] + scaled_distances
 
             ## First we need to reshape to get class x samples x features
             lprob_csf = lprob_csfs.reshape(lprob_csfs.shape[:2] + (-1,))
 
-            ## Now we come to naive part which requires looping
-            ## through all spheres
-            if __debug__:
-                debug('SLC', "  Doing 'Searchlight'")
+            ## Now we come to naive part which requires summing
+            ## within all spheres
             # resultant logprobs for each class x sample x roi
-            lprob_cs_sl = np.zeros(lprob_csfs.shape[:2] + (nroi_fids,))
-            indexsum_fx(lprob_csf, roi_fids, out=lprob_cs_sl)
+            lprob_cs_sl = np.zeros(lprob_csfs.shape[:2]
+                                   + (rois.stop - rois.start,))
+            indexsum_fx(lprob_csf, indexer, out=lprob_cs_sl)
 
             lprob_cs_sl += logpriors
-            lprob_cs_cp_sl = lprob_cs_sl
             # for each of the ROIs take the class with maximal (log)probability
-            predictions = lprob_cs_cp_sl.argmax(axis=0)
+            predictions = lprob_cs_sl.argmax(axis=0)
             # no need to map back [self.ulabels[c] for c in winners]
             #predictions = winners
             # assess the errors
-            if __debug__:
-                debug('SLC', "  Assessing accuracies")
-
             if errorfx is mean_mismatch_error:
-                results[isplit, :] = \
-                    (predictions != targets[:, None]).sum(axis=0) \
-                    / float(len(targets))
+                return (predictions != targets[:, None]).sum(axis=0) \
+                       / float(len(targets))
             else:
                 # somewhat silly but a way which allows to use pre-crafted
                 # error functions without a chance to screw up
-                for i, fpredictions in enumerate(predictions.T):
-                    results[isplit, i] = errorfx(fpredictions, targets)
+                return [errorfx(fpredictions, targets)
+                        for fpredictions in predictions.T]
+
+        # 6. Major loop, which could be split across processes
+        if __debug__:
+            debug('SLC', 'Phase 6. Major loop for %i splits x %i chunks of '
+                  'ROIs' % (nsplits, len(roi_chunks)))
+        jobs = [(isplit, ichunk) for isplit in xrange(nsplits)
+                                 for ichunk in xrange(len(roi_chunks))]
+        results = np.zeros((nsplits,) + r_shape)
+        for (isplit, ichunk), errors in zip(
+                jobs, parallel_map(classify, jobs, nproc=nproc,
+                                   backend=self.backend)):
+            results[isplit, roi_chunks[ichunk][0]] = errors
 
         if __debug__:
             debug('SLC', "GNBSearchlight is done in %.3g sec" %
@@ -517,6 +675,7 @@ class GNBSearchlight(BaseSearchlight):
     generator = property(fget=lambda self: self._generator)
     errorfx = property(fget=lambda self: self._errorfx)
     indexsum = property(fget=lambda self: self._indexsum)
+    cache = property(fget=lambda self: self._cache)
 
 @borrowkwargs(GNBSearchlight, '__init__', exclude=['roi_ids'])
 def sphere_gnbsearchlight(gnb, generator, radius=1, center_ids=None,
@@ -21,7 +21,7 @@ import numpy as np
 from mvpa.datasets import Dataset
 from mvpa.measures.base import FeaturewiseMeasure
 from mvpa.kernels.np import ExponentialKernel
-from mvpa.clfs.distance import pnorm_w
+from mvpa.clfs.distance import _get_max_memory
 
 if __debug__:
     from mvpa.base import debug
@@ -263,7 +263,9 @@ class IterativeRelief(FeaturewiseMeasure):
     Batch I-RELIEF-2 feature weighting algorithm. Works for binary or
     multiclass class-labels. Batch version with complexity O(T*N^2*I),
     where T is the number of iterations, N the number of instances, I
-    the number of features.
+    the number of features. Within each iteration instances are processed
+    in memory-bounded blocks (optionally in parallel threads and in single
+    precision).
 
     References
     ----------
@@ -280,9 +282,34 @@ class IterativeRelief(FeaturewiseMeasure):
     """Indicate that this measure doesn't have to be trained"""
 
     def __init__(self, threshold=1.0e-2, kernel_width=1.0,
-                 w_guess=None, **kwargs):
+                 w_guess=None, max_iter=None, stable_nfeatures=None,
+                 dtype=None, blocksize=None, nproc=1, **kwargs):
         """Constructor of the IRELIEF class.
 
+        Parameters
+        ----------
+        threshold : float
+          Stop once the (1-norm) change of the weights drops below it.
+        kernel_width : float
+          Width of the exponential kernel.
+        w_guess : array or None
+          Initial feature weights. Uniform weights if None.
+        max_iter : int or None
+          Maximal number of iterations (unlimited if None).
+        stable_nfeatures : int or None
+          If set, also stop as soon as the set of the `stable_nfeatures`
+          highest weighted features does not change between two consecutive
+          iterations, e.g. when I-RELIEF is used to select features.
+        dtype : dtype or None
+          Floating point type for the differences between samples,
+          e.g. 'float32' to halve memory and bandwidth demands. If None,
+          float64 is used.
+        blocksize : int or None
+          Number of samples whose differences to all other samples are
+          processed at once. If None, it is chosen to fit the memory budget
+          of distance computations (see `mvpa.clfs.distance.tiled_distance`).
+        nproc : int
+          Number of threads to process blocks of samples concurrently.
         """
         # init base classes first
         FeaturewiseMeasure.__init__(self, **kwargs)
@@ -292,6 +319,11 @@ class IterativeRelief(FeaturewiseMeasure):
         self.w_guess = w_guess
         self.w = None
         self.kernel_width = kernel_width
+        self.max_iter = max_iter
+        self.stable_nfeatures = stable_nfeatures
+        self.dtype = dtype
+        self.blocksize = blocksize
+        self.nproc = nproc
 
 
     def compute_M_H(self, label):
@@ -327,33 +359,103 @@ class IterativeRelief(FeaturewiseMeasure):
         return kd
 
 
+    def _get_ni(self, samples, labels, w, start, stop):
+        """Contribution of samples `start:stop` to the margin vector.
+
+        For each sample n the (weighted) differences to its misses and hits
+        enter with the coefficients gamma_n * alpha_n and -gamma_n * beta_n
+        respectively, so for a block of samples all of them are computed at
+        once from the block's differences to all samples.
+        """
+        # absolute differences (block x samples x features)
+        d_x = samples[start:stop, None, :] - samples[None, :, :]
+        np.abs(d_x, d_x)
+        # weighted 1-norm distances and their kernel values
+        d_w_k = self.k(np.dot(d_x, w.astype(d_x.dtype)).astype(float))
+
+        misses = labels[start:stop, None] != labels[None, :]
+        hits = ~misses
+        # d_w_k[n, n] == 0.0, hence sample n is not among its own hits
+        d_w_k_M = d_w_k * misses
+        d_w_k_H = d_w_k * hits
+        sum_M = d_w_k_M.sum(1)[:, None]
+        sum_H = d_w_k_H.sum(1)[:, None]
+
+        olderr = np.seterr(divide='ignore', invalid='ignore')
+        try:
+            gamma = 1.0 - np.nan_to_num(sum_M / d_w_k.sum(1)[:, None])
+            alpha = np.nan_to_num(d_w_k_M / sum_M)
+            beta = np.nan_to_num(d_w_k_H / sum_H)
+        finally:
+            np.seterr(**olderr)
+
+        coefs = (gamma * (alpha - beta)).astype(d_x.dtype)
+        return np.tensordot(coefs, d_x, axes=([0, 1], [0, 1]))
+
+
     def _call(self, dataset):
         """Computes featurewise I-RELIEF weights."""
         samples = dataset.samples
         NS, NF = samples.shape[:2]
-
-        if self.w_guess == None:
+        labels = dataset.targets
+
+        # There must be at least two examples for each class label
+        ul = np.unique(labels)
+        if np.any(np.bincount(np.searchsorted(ul, labels)) < 2):
+            raise ValueError, \
+                  "I-RELIEF requires at least two samples per class label."
+
+        dtype = np.dtype(self.dtype or 'float64')
+        samples = np.asarray(samples, dtype=dtype)
+
+        blocksize = self.blocksize
+        if blocksize is None:
+            # the differences of all blocks processed at once (and their
+            # temporaries) have to fit into the memory budget
+            blocksize = max(1, int(_get_max_memory(None) * 2**20
+                                   / (2 * NS * NF * dtype.itemsize
+                                      * max(self.nproc, 1))))
+        starts = range(0, NS, blocksize)
+
+        if self.w_guess is None:
             w = np.ones(NF, 'd')
+        else:
+            w = np.array(self.w_guess, dtype='d')
 
         w /= (w ** 2).sum() # do normalization in all cases to be safe :)
 
-        M, H = self.compute_M_H(dataset.targets)
-
+        iteration = 0
+        top = None
         while True:
-            d_w_k = self.k(pnorm_w(data1=samples, weight=w, p=1))
             ni = np.zeros(NF, 'd')
-            for n in range(NS):
-                 # d_w_k[n, n] could be omitted since == 0.0
-                gamma_n = 1.0 - np.nan_to_num(d_w_k[n, M[n]].sum() \
-                                / (d_w_k[n, :].sum() - d_w_k[n, n]))
-                alpha_n = np.nan_to_num(d_w_k[n, M[n]] / (d_w_k[n, M[n]].sum()))
-                beta_n = np.nan_to_num(d_w_k[n, H[n]] / (d_w_k[n, H[n]].sum()))
-
-                m_n = (np.abs(samples[n, :] - samples[M[n], :]) \
-                       * alpha_n[:, None]).sum(0)
-                h_n = (np.abs(samples[n, :] - samples[H[n], :]) \
-                       * beta_n[:, None]).sum(0)
-                ni += gamma_n*(m_n - h_n)
+            if self.nproc > 1 and len(starts) > 1:
+                import threading
+                partial, errors = [], []
+                def _worker(starts):
+                    try:
+                        ni_ = np.zeros(NF, 'd')
+                        for start in starts:
+                            ni_ += self._get_ni(samples, labels, w,
+                                                start, start + blocksize)
+                        partial.append(ni_)
+                    except Exception, e:
+                        errors.append(e)
+                # distribute blocks round-robin across the threads
+                threads = [threading.Thread(target=_worker,
+                                            args=(starts[i::self.nproc],))
+                           for i in xrange(min(self.nproc, len(starts)))]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                if len(errors):
+                    raise errors[0]
+                for ni_ in partial:
+                    ni += ni_
+            else:
+                for start in starts:
+                    ni += self._get_ni(samples, labels, w,
+                                       start, start + blocksize)
 
             ni = ni / NS
 
@@ -368,8 +470,16 @@ class IterativeRelief(FeaturewiseMeasure):
 
             # update weights:
             w = w_new
+            iteration += 1
             if change < self.threshold:
                 break
+            if self.max_iter is not None and iteration >= self.max_iter:
+                break
+            if self.stable_nfeatures is not None:
+                top_new = set(np.argsort(w)[::-1][:self.stable_nfeatures])
+                if top_new == top:
+                    break
+                top = top_new
 
         self.w = w
         return Dataset(self.w[np.newaxis])
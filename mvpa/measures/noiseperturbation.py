@@ -19,8 +19,10 @@ from mvpa.support.copy import deepcopy
 
 import numpy as np
 
+from mvpa.base.parallel import get_nproc, parallel_map
 from mvpa.measures.base import FeaturewiseMeasure
 from mvpa.datasets.base import Dataset
+from mvpa.misc.neighborhood import QueryEngineInterface
 
 
 class NoisePerturbationSensitivity(FeaturewiseMeasure):
@@ -36,6 +38,11 @@ class NoisePerturbationSensitivity(FeaturewiseMeasure):
     perturbed feature. Large differences are treated as an indicator of a
     feature having great impact on the scalar `Measure`.
 
+    As this requires one run of the scalar `Measure` per feature, features
+    can instead be perturbed in groups (random blocks, searchlight
+    neighborhoods, or parcels defined by a feature attribute), and the
+    perturbed runs can be distributed across multiple processes.
+
     Notes
     -----
     The computed sensitivity map might have positive and negative values!
@@ -44,7 +51,7 @@ class NoisePerturbationSensitivity(FeaturewiseMeasure):
     """Indicate that this measure is always trained."""
 
     def __init__(self, datameasure,
-                 noise=np.random.normal):
+                 noise=np.random.normal, groups=None, nproc=1, backend=None):
         """
         Parameters
         ----------
@@ -55,12 +62,87 @@ class NoisePerturbationSensitivity(FeaturewiseMeasure):
           of n values when called the `size=n` keyword argument. This is the
           default interface of the random number generators in NumPy's
           `random` module.
+        groups : None or int or str or QueryEngine
+          Which features to perturb at once. If None, every feature is
+          perturbed on its own. An integer perturbs random blocks of
+          (up to) that many features and assigns the effect to all of them.
+          A string names a feature attribute (e.g. atlas parcel labels):
+          all features sharing a value are perturbed together, and all of
+          them get the effect assigned. A query engine (see
+          :mod:`~mvpa.misc.neighborhood`) perturbs the neighborhood of each
+          feature and assigns the effect to the center feature only.
+        nproc : None or int
+          How many processes to use to compute the perturbed measures. If
+          None -- all available cores will be used. Each perturbation
+          reseeds NumPy's global random number generator with a seed drawn
+          upfront, so as long as `noise` relies on it, results do not
+          depend on the number of processes.
+        backend : None or {'multiprocessing', 'pprocess'}
+          How to spawn the processes if `nproc` > 1. See
+          :func:`~mvpa.base.parallel.parallel_map`.
         """
         # init base classes first
         FeaturewiseMeasure.__init__(self)
 
         self.__datameasure = datameasure
         self.__noise = noise
+        self.__groups = groups
+        self.nproc = nproc
+        self.backend = backend
+
+
+    def _get_groups(self, dataset):
+        """Features perturbed together, and those the effect is assigned to.
+
+        Returns
+        -------
+        list of tuples
+          `(perturbed_ids, assigned_ids)` for every perturbation.
+        """
+        groups = self.__groups
+        nfeatures = dataset.nfeatures
+        if groups is None:
+            return [([f], [f]) for f in xrange(nfeatures)]
+        elif isinstance(groups, (int, long, np.integer)):
+            if groups < 1:
+                raise ValueError, "Size of feature blocks must be positive."
+            ids = np.random.permutation(nfeatures)
+            return [(ids[i:i + groups], ids[i:i + groups])
+                    for i in xrange(0, nfeatures, groups)]
+        elif isinstance(groups, basestring):
+            values = dataset.fa[groups].value
+            return [(np.where(values == v)[0],) * 2
+                    for v in dataset.fa[groups].unique]
+        elif isinstance(groups, QueryEngineInterface):
+            groups.train(dataset)
+            return [(groups[f], [f]) for f in xrange(nfeatures)]
+        else:
+            raise ValueError, \
+                  "Don't know how to group features according to %r" % groups
+
+
+    def _perturb(self, dataset, ids, seed=None):
+        """Difference of the measure with features `ids` perturbed by noise
+        """
+        if seed is not None:
+            np.random.seed(seed)
+        ids = np.asarray(ids)
+
+        # store current features to restore them later on
+        current_features = dataset.samples[:, ids].copy()
+
+        # add noise to current features
+        noise = self.__noise(size=len(dataset) * len(ids))
+        dataset.samples[:, ids] += np.reshape(noise, (len(dataset), len(ids)))
+
+        try:
+            # compute the datameasure on the perturbed dataset
+            perturbed_measure = self.__datameasure(dataset)
+        finally:
+            # restore the current features
+            dataset.samples[:, ids] = current_features
+
+        return perturbed_measure.samples
 
 
     def _call(self, dataset):
@@ -71,46 +153,58 @@ class NoisePerturbationSensitivity(FeaturewiseMeasure):
             ds.samples = dataset.samples.astype('float32')
             dataset = ds
 
-        if __debug__:
-            nfeatures = dataset.nfeatures
-
-        # using a list here, to be able to handle output of unknown
-        # dimensionality
-        sens_map = []
-
         # compute the datameasure on the original dataset
         # this is used as a baseline
         orig_measure = self.__datameasure(dataset)
 
-        # do for every _single_ feature in the dataset
-        for feature in xrange(dataset.nfeatures):
-            if __debug__:
-                debug('PSA', "Analyzing %i features: %i [%i%%]" \
-                    % (nfeatures,
-                       feature+1,
-                       float(feature+1)/nfeatures*100,), cr=True)
+        groups = self._get_groups(dataset)
+        ngroups = len(groups)
+        nproc = get_nproc(self.nproc)
 
-            # store current feature to restore it later on
-            current_feature = dataset.samples[:, feature].copy()
-
-            # add noise to current feature
-            dataset.samples[:, feature] += self.__noise(size=len(dataset))
-
-            # compute the datameasure on the perturbed dataset
-            perturbed_measure = self.__datameasure(dataset)
-
-            # restore the current feature
-            dataset.samples[:, feature] = current_feature
-
-            # difference from original datameasure is sensitivity
-            sens_map.append(perturbed_measure.samples - orig_measure.samples)
+        # every group gets its own seed, so the noise does not depend on the
+        # number of processes nor on the order the groups are done in
+        seeds = np.random.randint(np.iinfo(np.int32).max, size=ngroups)
+        if __debug__:
+            progress = dict(ndone=0)
+            def report_progress(igroup, result):
+                progress['ndone'] += 1
+                debug('PSA', "Analyzing %i feature groups: %i [%i%%]" \
+                      % (ngroups,
+                         progress['ndone'],
+                         float(progress['ndone'])/ngroups*100,), cr=True)
+        else:
+            report_progress = None
+        # reseeding for every group must not affect the caller
+        rng_state = np.random.get_state()
+        try:
+            # worker processes inherit the dataset, and perturb their own
+            # copy of it
+            perturbed = parallel_map(
+                lambda ids, seed: self._perturb(dataset, ids, seed),
+                [(g[0], seed) for g, seed in zip(groups, seeds)],
+                nproc=nproc, backend=self.backend, callback=report_progress)
+        finally:
+            np.random.set_state(rng_state)
 
         if __debug__:
             debug('PSA', '')
 
+        # difference from original datameasure is sensitivity of every
+        # feature the perturbation is assigned to
+        sens_map = [None] * dataset.nfeatures
+        for (ids, assigned), p in zip(groups, perturbed):
+            diff = p - orig_measure.samples
+            for f in assigned:
+                sens_map[f] = diff
+
         # turn into an array and get rid of unnecessary axes -- ideally yielding
         # 2D array
-        sens_map = np.array(sens_map).squeeze()
+        sens_map = np.array(sens_map)
+        if sens_map.ndim == 3 and sens_map.shape[2] == 1:
+            # a single value per sample (e.g. error per fold, or a scalar)
+            sens_map = sens_map[:, :, 0]
+        else:
+            sens_map = sens_map.squeeze()
         # swap first to axis: we have nfeatures on first but want it as second
         # in a dataset
         sens_map = np.swapaxes(sens_map, 0, 1)
@@ -12,18 +12,22 @@ __docformat__ = 'restructuredtext'
 
 if __debug__:
     from mvpa.base import debug
+    import time
 
 import numpy as np
 
 from mvpa.base import externals, warning
 from mvpa.base.dochelpers import borrowkwargs, _repr_attrs
+from mvpa.base.parallel import get_nproc, shared_empty, parallel_map
+from mvpa.base.types import is_datasetlike
 
-from mvpa.datasets import hstack
+from mvpa.base.dataset import AttrDataset, hstack
 from mvpa.support import copy
 from mvpa.featsel.base import StaticFeatureSelection
 from mvpa.measures.base import Measure
 from mvpa.base.state import ConditionalAttribute
 from mvpa.misc.neighborhood import IndexQueryEngine, Sphere
+from mvpa.misc.support import get_progress_msg
 
 
 class BaseSearchlight(Measure):
@@ -41,7 +45,8 @@ class BaseSearchlight(Measure):
 
 
     @borrowkwargs(Measure, '__init__')
-    def __init__(self, queryengine, roi_ids=None, nproc=None, **kwargs):
+    def __init__(self, queryengine, roi_ids=None, nproc=None, backend=None,
+                 **kwargs):
         """
         Parameters
         ----------
@@ -54,19 +59,27 @@ class BaseSearchlight(Measure):
           feature attribute of the input dataset, whose non-zero values
           determine the feature ids. By default all features will be used.
         nproc : None or int
-          How many processes to use for computation.  Requires `pprocess`
-          external module.  If None -- all available cores will be used.
+          How many processes to use for computation.  If None -- all
+          available cores will be used if the `pprocess` module is
+          available, and a single process otherwise (as it used to be
+          when `pprocess` was the only backend).
+        backend : None or {'multiprocessing', 'pprocess'}
+          How to spawn the processes if `nproc` > 1.  If None --
+          configuration setting 'parallel.backend' is consulted (default:
+          'multiprocessing').  See :func:`~mvpa.base.parallel.parallel_map`.
         **kwargs
           In addition this class supports all keyword arguments of its
           base-class :class:`~mvpa.measures.base.Measure`.
       """
         Measure.__init__(self, **kwargs)
 
-        if nproc > 1 and not externals.exists('pprocess'):
+        if nproc > 1 and backend == 'pprocess' \
+               and not externals.exists('pprocess'):
             raise RuntimeError("The 'pprocess' module is required for "
-                               "multiprocess searchlights. Please either "
-                               "install python-pprocess, or reduce `nproc` "
-                               "to 1 (got nproc=%i)" % nproc)
+                               "multiprocess searchlights with 'pprocess' "
+                               "backend. Please either install "
+                               "python-pprocess, or use 'multiprocessing' "
+                               "backend (got nproc=%i)" % nproc)
 
         self._queryengine = queryengine
         if roi_ids is not None and not isinstance(roi_ids, str) \
@@ -75,6 +88,7 @@ class BaseSearchlight(Measure):
                   "Cannot run searchlight on an empty list of roi_ids"
         self.__roi_ids = roi_ids
         self.nproc = nproc
+        self.backend = backend
 
 
     def __repr__(self, prefixes=[]):
@@ -84,7 +98,8 @@ class BaseSearchlight(Measure):
         """
         return super(BaseSearchlight, self).__repr__(
             prefixes=prefixes
-            + _repr_attrs(self, ['queryengine', 'roi_ids', 'nproc']))
+            + _repr_attrs(self, ['queryengine', 'roi_ids', 'nproc',
+                                 'backend']))
 
 
     def _call(self, dataset):
@@ -92,16 +107,11 @@ class BaseSearchlight(Measure):
         """
         # local binding
         nproc = self.nproc
+        if nproc is None and not externals.exists('pprocess'):
+            # no parallelism was asked for
+            nproc = 1
+        nproc = get_nproc(nproc)
 
-        if nproc is None and externals.exists('pprocess'):
-            import pprocess
-            try:
-                nproc = pprocess.get_number_of_cores() or 1
-            except AttributeError:
-                warning("pprocess version %s has no API to figure out maximal "
-                        "number of cores. Using 1"
-                        % externals.versions['pprocess'])
-                nproc = 1
         # train the queryengine
         self._queryengine.train(dataset)
 
@@ -156,6 +166,113 @@ class BaseSearchlight(Measure):
     roi_ids = property(fget=lambda self: self.__roi_ids)
 
 
+class _ResultsAssembler(object):
+    """Helper to assemble searchlight results without hstacking them.
+
+    The result of the first ROI determines the layout of the results of
+    all ROIs: an array for all of them is preallocated and results are
+    stored into their respective columns as soon as they are computed.
+    Sample attributes are taken from the first result only.  Results not
+    matching the layout (e.g. varying number of features or having
+    feature attributes) are rejected by `put()` and need to be passed to
+    `assemble()`, which falls back to hstacking then.
+    """
+    def __init__(self, first, nroi, shared=False):
+        """
+        Parameters
+        ----------
+        first
+          Result of the measure for the first ROI.
+        nroi : int
+          Total number of ROIs.
+        shared : bool
+          Whether to allocate the results in memory shared across
+          processes, so results could be stored by child processes.
+        """
+        self._nroi = nroi
+        self._out = None
+        if is_datasetlike(first):
+            self._cls = first.__class__
+            self._sa = first.sa
+            samples = first.samples
+            if len(first.fa) or not isinstance(samples, np.ndarray):
+                # no fast path
+                return
+        else:
+            self._cls = AttrDataset
+            self._sa = None
+            samples = np.atleast_2d(first)
+        if samples.ndim != 2 or samples.dtype.hasobject:
+            return
+        self._shape = samples.shape
+        self._dtype = samples.dtype
+        shape = (samples.shape[0], nroi * samples.shape[1])
+        if shared:
+            self._out = shared_empty(shape, samples.dtype)
+        else:
+            self._out = np.empty(shape, dtype=samples.dtype)
+
+
+    def put(self, i, result):
+        """Store the result for the `i`-th ROI.
+
+        Returns
+        -------
+        bool
+          False, if `result` does not match the layout of the results.
+        """
+        if self._out is None:
+            return False
+        if is_datasetlike(result):
+            if result.__class__ is not self._cls or len(result.fa):
+                return False
+            samples = result.samples
+        elif self._cls is AttrDataset:
+            samples = np.atleast_2d(result)
+        else:
+            return False
+        if not isinstance(samples, np.ndarray) \
+           or samples.shape != self._shape or samples.dtype != self._dtype:
+            return False
+        nf = self._shape[1]
+        self._out[:, i * nf:(i + 1) * nf] = samples
+        return True
+
+
+    def assemble(self, others):
+        """Provide a dataset with the results of all ROIs.
+
+        Parameters
+        ----------
+        others : dict
+          Results rejected by `put()`, keyed by the index of their ROI.
+        """
+        if not len(others):
+            results = self._cls(self._out)
+            if self._sa is not None:
+                results.sa.update(self._sa)
+            return results
+
+        # do it the slow way
+        if __debug__:
+            debug('SLC', "Hstacking results of %i ROIs, which do not match "
+                         "the layout of the first one" % len(others))
+        nf = self._out is not None and self._shape[1] or None
+        results = []
+        for i in xrange(self._nroi):
+            if i in others:
+                res = others[i]
+                if not is_datasetlike(res):
+                    res = AttrDataset(np.atleast_2d(res))
+            else:
+                res = self._cls(self._out[:, i * nf:(i + 1) * nf])
+                if self._sa is not None:
+                    res.sa.update(self._sa)
+            results.append(res)
+        # this uses the Dataset-hstack
+        return hstack(results)
+
+
 class Searchlight(BaseSearchlight):
     """The implementation of a generic searchlight measure.
 
@@ -166,7 +283,8 @@ class Searchlight(BaseSearchlight):
     """
 
     @borrowkwargs(BaseSearchlight, '__init__')
-    def __init__(self, datameasure, queryengine, add_center_fa=False, **kwargs):
+    def __init__(self, datameasure, queryengine, add_center_fa=False,
+                 batch_size=None, **kwargs):
         """
         Parameters
         ----------
@@ -179,12 +297,23 @@ class Searchlight(BaseSearchlight):
           seed (e.g. sphere center) for the respective ROI. If True, the
           attribute is named 'roi_seed', the provided string is used as the name
           otherwise.
+        batch_size : None or int
+          Only in effect if `nproc` > 1.  If None, ROIs are split into `nproc`
+          equally sized blocks, one per process.  Otherwise, ROIs are split
+          into batches of (at most) `batch_size` ROIs, and each process takes
+          the next pending batch as soon as it is done with the previous one.
+          The latter balances the load across processes if ROIs vary in
+          their size or in the time it takes to compute the measure.
         **kwargs
           In addition this class supports all keyword arguments of its
           base-class :class:`~mvpa.measures.searchlight.BaseSearchlight`.
         """
         BaseSearchlight.__init__(self, queryengine, **kwargs)
         self.__datameasure = datameasure
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be a positive integer "
+                             "(got %r)" % (batch_size,))
+        self.__batch_size = batch_size
         if isinstance(add_center_fa, str):
             self.__add_center_fa = add_center_fa
         elif add_center_fa:
@@ -197,79 +326,112 @@ class Searchlight(BaseSearchlight):
             prefixes=prefixes
             + _repr_attrs(self, ['datameasure'])
             + _repr_attrs(self, ['add_center_fa'], default=False)
+            + _repr_attrs(self, ['batch_size'])
             )
 
 
     def _sl_call(self, dataset, roi_ids, nproc):
         """Classical generic searchlight implementation
         """
+        if not len(roi_ids):
+            raise ValueError("There are no ROIs to run the searchlight on")
+        measure = self.__datameasure
+
+        # the result of the first ROI determines the layout of the results,
+        # so the results of all others could be stored into a preallocated
+        # array right away
+        others, roi_sizes = self._proc_block(roi_ids[:1], dataset, measure,
+                                             batch=True)
+        results = _ResultsAssembler(others[0], len(roi_ids),
+                                    shared=nproc > 1)
+        if results.put(0, others[0]):
+            del others[0]
+        roi_ids = roi_ids[1:]
+
         # compute
-        if nproc > 1:
-            # split all target ROIs centers into `nproc` equally sized blocks
-            nproc_needed = min(len(roi_ids), nproc)
-            roi_blocks = np.array_split(roi_ids, nproc_needed)
-
-            # the next block sets up the infrastructure for parallel computing
-            # this can easily be changed into a ParallelPython loop, if we
-            # decide to have a PP job server in PyMVPA
-            import pprocess
-            p_results = pprocess.Map(limit=nproc_needed)
+        if nproc > 1 and len(roi_ids):
+            if self.__batch_size is None:
+                # split all target ROIs centers into `nproc` equally sized
+                # blocks
+                roi_blocks = np.array_split(roi_ids,
+                                            min(len(roi_ids), nproc))
+            else:
+                # small batches which are handed out to idle processes
+                roi_blocks = [roi_ids[i:i + self.__batch_size]
+                              for i in xrange(0, len(roi_ids),
+                                              self.__batch_size)]
+            nproc_needed = min(len(roi_blocks), nproc)
+            # position of the first ROI of each block among all ROIs
+            offsets = np.cumsum([1] + [len(b) for b in roi_blocks[:-1]])
+
+            # child processes are forked, thus they share the samples with
+            # this process (copy-on-write) without pickling or copying them
             if __debug__:
-                debug('SLC', "Starting off child processes for nproc=%i"
-                      % nproc_needed)
-            compute = p_results.manage(
-                        pprocess.MakeParallel(self._proc_block))
-            for block in roi_blocks:
-                # should we maybe deepcopy the measure to have a unique and
-                # independent one per process?
-                compute(block, dataset, copy.copy(self.__datameasure))
-
-            # collect results
-            results = []
-            if self.ca.is_enabled('roi_sizes'):
-                roi_sizes = []
+                debug('SLC', "Starting off %i child processes for %i blocks"
+                      % (nproc_needed, len(roi_blocks)))
+                time_start = time.time()
+                progress = dict(ndone=0)
+                def report_progress(iblock, result):
+                    progress['ndone'] += len(roi_blocks[iblock])
+                    debug('SLC', "Doing %i ROIs: %s"
+                          % (len(roi_ids),
+                             get_progress_msg(progress['ndone'], len(roi_ids),
+                                              time_start)),
+                          cr=True)
             else:
-                roi_sizes = None
-
-            for r, rsizes in p_results:
-                results += r
-                if not roi_sizes is None:
-                    roi_sizes += rsizes
+                report_progress = None
+            # children store results into shared memory, and only pass back
+            # those not fitting into it
+            p_results = parallel_map(
+                lambda block, offset: self._proc_block(block, dataset, measure,
+                                                       results, offset,
+                                                       batch=True),
+                zip(roi_blocks, offsets),
+                nproc=nproc_needed, backend=self.backend,
+                callback=report_progress)
         else:
-            # otherwise collect the results in a list
-            results, roi_sizes = \
-                    self._proc_block(roi_ids, dataset, self.__datameasure)
+            p_results = [self._proc_block(roi_ids, dataset, measure,
+                                          results, 1)]
+
+        # collect results
+        for bothers, rsizes in p_results:
+            others.update(bothers)
+            if not roi_sizes is None:
+                roi_sizes += rsizes
 
         if __debug__ and 'SLC' in debug.active:
             debug('SLC', '')            # just newline
-            resshape = len(results) and np.asanyarray(results[0]).shape or 'N/A'
-            debug('SLC', ' hstacking %d results of shape %s'
-                  % (len(results), resshape))
 
-        # but be careful: this call also serves as conversion from parallel maps
-        # to regular lists!
-        # this uses the Dataset-hstack
-        results = hstack(results)
+        results = results.assemble(others)
 
         if __debug__:
-            debug('SLC', " hstacked shape %s" % (results.shape,))
+            debug('SLC', " assembled results of shape %s" % (results.shape,))
 
         return results, roi_sizes
 
 
-    def _proc_block(self, block, ds, measure):
+    def _proc_block(self, block, ds, measure, results=None, offset=0,
+                    batch=False):
         """Little helper to capture the parts of the computation that can be
         parallelized
+
+        Results are stored into `results` (a `_ResultsAssembler`) under the
+        position of their ROI among all ROIs, i.e. `offset` plus the position
+        within the `block`.  Results which could not be stored that way (or
+        all if `results` is None) are returned in a dictionary keyed by this
+        position, along with the ROI sizes.  If `batch` is True, the progress
+        is reported by the caller instead (e.g. the parent process).
         """
         if __debug__:
             debug_slc_ = 'SLC_' in debug.active
-            debug('SLC',
-                  "Starting computing block for %i elements" % len(block))
+            report_progress = not batch and 'SLC' in debug.active
+            if report_progress:
+                time_start = time.time()
         if self.ca.is_enabled('roi_sizes'):
             roi_sizes = []
         else:
             roi_sizes = None
-        results = []
+        others = {}
         # put rois around all features in the dataset and compute the
         # measure within them
         for i, f in enumerate(block):
@@ -280,8 +442,10 @@ class Searchlight(BaseSearchlight):
             if __debug__ and  debug_slc_:
                 debug('SLC_', 'For %r query returned ids %r' % (f, roi_fids))
 
-            # slice the dataset
-            roi = ds[:, roi_fids]
+            # slice the dataset -- neither the mapper nor other dataset
+            # attributes are needed to compute the measure.  The measure
+            # might modify its input in-place, so never hand out views
+            roi = ds.fast_select(roi_fids, copy=True)
 
             if self.__add_center_fa:
                 # add fa to indicate ROI seed if requested
@@ -290,23 +454,25 @@ class Searchlight(BaseSearchlight):
                 roi.fa[self.__add_center_fa] = roi_seed
 
             # compute the datameasure and store in results
-            results.append(measure(roi))
+            res = measure(roi)
+            if results is None or not results.put(offset + i, res):
+                others[offset + i] = res
 
             # store the size of the roi dataset
             if not roi_sizes is None:
                 roi_sizes.append(roi.nfeatures)
 
-            if __debug__:
-                debug('SLC', "Doing %i ROIs: %i (%i features) [%i%%]" \
-                    % (len(block),
-                       f+1,
-                       roi.nfeatures,
-                       float(i+1)/len(block)*100,), cr=True)
+            if __debug__ and report_progress:
+                debug('SLC', "Doing %i ROIs: %s"
+                      % (len(block),
+                         get_progress_msg(i + 1, len(block), time_start)),
+                      cr=True)
 
-        return results, roi_sizes
+        return others, roi_sizes
 
     datameasure = property(fget=lambda self: self.__datameasure)
     add_center_fa = property(fget=lambda self: self.__add_center_fa)
+    batch_size = property(fget=lambda self: self.__batch_size)
 
 @borrowkwargs(Searchlight, '__init__', exclude=['roi_ids'])
 def sphere_searchlight(datameasure, radius=1, center_ids=None,
@@ -12,8 +12,12 @@ import numpy as np
 from numpy import array
 import operator
 import sys
+import os
+import types
+import hashlib
+from collections import OrderedDict
 
-from mvpa.base import warning
+from mvpa.base import warning, externals
 from mvpa.base.dochelpers import borrowkwargs, borrowdoc, _repr_attrs, _repr
 from mvpa.clfs.distance import cartesian_distance
 
@@ -397,12 +401,19 @@ class IndexQueryEngine(QueryEngine):
     """
 
     @borrowkwargs(QueryEngine, '__init__')
-    def __init__(self, sorted=True, **kwargs):
+    def __init__(self, sorted=True, precompute=False, **kwargs):
         """
         Parameters
         ----------
         sorted : bool
           Results of query get sorted
+        precompute : bool
+          If True, neighborhoods of all features get computed at once
+          while training, and :meth:`query_byid` becomes a simple lookup
+          into them.  Neighborhoods are computed in a vectorized fashion
+          if all query objects are `Sphere`\s (or None).  Precomputed
+          neighborhoods are accessible as a sparse adjacency matrix
+          through the `neighbors` property.
         """
         QueryEngine.__init__(self, **kwargs)
         self._spaceorder = None
@@ -415,12 +426,18 @@ class IndexQueryEngine(QueryEngine):
         """Actual searcharray"""
         self.sorted = sorted
         """Either to sort the query results"""
+        self.precompute = precompute
+        """Either to precompute all neighborhoods while training"""
+        self._nb_indptr = None
+        self._nb_indices = None
+        """Precomputed neighborhoods in CSR layout"""
 
 
     def __repr__(self, prefixes=[]):
         return super(IndexQueryEngine, self).__repr__(
             prefixes=prefixes
-            + _repr_attrs(self, ['sorted'], default=True))
+            + _repr_attrs(self, ['sorted'], default=True)
+            + _repr_attrs(self, ['precompute'], default=False))
 
 
     def _train(self, dataset):
@@ -493,6 +510,128 @@ class IndexQueryEngine(QueryEngine):
                              "cases -- use another appropriate query engine"
                              % (self._spaceorder, self))
 
+        self._nb_indptr = self._nb_indices = None
+        if self.precompute:
+            self._precompute_neighbors(dataset.nfeatures)
+
+
+    def _get_space_coords(self):
+        """Integer coordinates and increments per space for vectorized queries
+
+        Returns
+        -------
+        list of (coords, increments) or None
+          None if any query object is not a `Sphere` or operates on
+          non-integer coordinates.
+        """
+        out = []
+        for space in self._spaceorder:
+            qobj = self._queryobjs[space]
+            qattr = np.asanyarray(self._queryattrs[space])
+            if qobj is None:
+                # only the very same value is "neighboring"
+                lookup = self._lookups[space]
+                if qattr.ndim > 1:
+                    qattr = [tuple(x) for x in qattr]
+                coords = np.array([lookup[x] for x in qattr])[:, None]
+                increments = np.zeros((1, 1), dtype=int)
+            elif isinstance(qobj, Sphere) \
+                     and qattr.dtype.char in np.typecodes['AllInteger']:
+                coords = qattr.reshape((len(qattr), -1))
+                increments = qobj._get_increments(coords.shape[1])
+                if not len(increments):
+                    increments = np.zeros((0, coords.shape[1]), dtype=int)
+            else:
+                return None
+            out.append((coords, increments))
+        return out
+
+
+    def _precompute_neighbors(self, nfeatures):
+        """Compute neighborhoods of all features at once
+        """
+        if __debug__:
+            debug('NBH', "Precomputing neighborhoods for %i features"
+                  % nfeatures)
+        spaces = self._get_space_coords()
+        if spaces is None:
+            # generic, but slow -- query each feature on its own
+            nbs = [self._query_byid(fid) for fid in xrange(nfeatures)]
+            rows = np.repeat(np.arange(nfeatures), [len(x) for x in nbs])
+            cols = np.asanyarray(np.hstack(nbs) if len(rows) else [],
+                                 dtype=int)
+        else:
+            # joint coordinates and increments across all spaces
+            coords = np.hstack([c for c, i in spaces]).astype(int)
+            increments = spaces[0][1]
+            for c, incs in spaces[1:]:
+                # cartesian product of the increments
+                increments = np.hstack(
+                    (np.repeat(increments, len(incs), axis=0),
+                     np.tile(incs, (len(increments), 1))))
+            increments = np.asanyarray(increments, dtype=int)
+            # encode coordinates into linear keys within a box padded
+            # by the largest increments, so neighbors never wrap around
+            if len(increments):
+                maxinc = np.abs(increments).max(axis=0)
+            else:
+                maxinc = np.zeros(coords.shape[1], dtype=int)
+            origin = coords.min(axis=0) - maxinc
+            extent = coords.max(axis=0) + maxinc - origin + 1
+            strides = np.cumprod(np.r_[extent[1:], 1][::-1])[::-1]
+            keys = np.dot(coords - origin, strides)
+            order = np.argsort(keys)
+            skeys = keys[order]
+            rows, cols = [], []
+            for inc in increments:
+                nkeys = keys + np.dot(inc, strides)
+                pos = np.searchsorted(skeys, nkeys)
+                pos[pos == nfeatures] = 0
+                found = skeys[pos] == nkeys
+                rows.append(np.arange(nfeatures)[found])
+                cols.append(order[pos[found]])
+            if len(rows):
+                rows, cols = np.hstack(rows), np.hstack(cols)
+            else:
+                rows = cols = np.zeros(0, dtype=int)
+        # sort into CSR layout
+        sorter = np.lexsort((cols, rows))
+        self._nb_indices = cols[sorter]
+        self._nb_indptr = np.r_[0, np.cumsum(np.bincount(rows,
+                                                         minlength=nfeatures))]
+
+
+    def query_byid(self, fid):
+        """Return feature ids of neighbors for a given feature id
+        """
+        if self._nb_indptr is None:
+            return self._query_byid(fid)
+        # neighbors are stored sorted, so the same list serves both cases
+        return self._nb_indices[
+            self._nb_indptr[fid]:self._nb_indptr[fid+1]].tolist()
+
+
+    def _query_byid(self, fid):
+        return QueryEngine.query_byid(self, fid)
+
+
+    @property
+    def neighbors(self):
+        """Precomputed neighborhoods as a sparse (nfeatures x nfeatures) matrix
+
+        Row `i` has non-zero elements in the columns of the neighbors of
+        feature `i`.
+        """
+        if self._nb_indptr is None:
+            raise RuntimeError("%s has no precomputed neighborhoods. Train it "
+                               "with precompute=True first." % self)
+        externals.exists('scipy', raise_=True)
+        import scipy.sparse as sps
+        nfeatures = len(self._nb_indptr) - 1
+        return sps.csr_matrix((np.ones(len(self._nb_indices), dtype=bool),
+                               self._nb_indices, self._nb_indptr),
+                              shape=(nfeatures, nfeatures))
+
 
     def query(self, **kwargs):
         # construct the search array slicer
@@ -534,6 +673,31 @@ class IndexQueryEngine(QueryEngine):
             return res
 
 
+def _get_description(obj):
+    """Deterministic description of a query object for content hashing
+    """
+    if obj is None or isinstance(obj, (int, long, float, basestring)):
+        return repr(obj)
+    elif isinstance(obj, (tuple, list)):
+        return '(%s)' % ', '.join([_get_description(x) for x in obj])
+    elif isinstance(obj, (types.FunctionType, types.BuiltinFunctionType)):
+        desc = '%s.%s' % (obj.__module__, obj.__name__)
+        if hasattr(obj, 'func_code'):
+            # lambdas do not have distinctive names
+            desc += ':%s:%r' % (obj.func_code.co_code.encode('hex'),
+                                obj.func_code.co_consts)
+        return desc
+    elif hasattr(obj, '__dict__'):
+        # e.g. Sphere -- all of its state, but no cached increments
+        return '%s(%s)' % (
+            obj.__class__.__name__,
+            ', '.join(['%s=%s' % (k.lstrip('_'), _get_description(v))
+                       for k, v in sorted(obj.__dict__.items())
+                       if not k.startswith('_increments')]))
+    else:
+        return repr(obj)
+
+
 class CachedQueryEngine(QueryEngineInterface):
     """Provides caching facility for query engines.
 
@@ -551,29 +715,52 @@ class CachedQueryEngine(QueryEngineInterface):
     :func:`query_byid` should be working reliably and without
     surprises.
 
-    :func:`query` relies on hashid of the queries, so there might be a
-    collision! Thus consider it EXPERIMENTAL for now.
+    Results of :func:`query` are cached by the content of the query.
+    Their number could be bounded with `maxsize`, in which case least
+    recently used results get evicted first.
+
+    If `cachedir` is provided, neighborhoods of all features get
+    computed at once upon the first training, and stored in a file
+    named after a content hash of the relevant feature attributes and
+    of the specification of the underlying query engine.  Any
+    `CachedQueryEngine` with the same `cachedir` trained later on
+    (e.g. for another subject with the same mask, or in another
+    process) on such a dataset would simply load them.
     """
 
-    def __init__(self, queryengine):
+    def __init__(self, queryengine, maxsize=None, cachedir=None):
         """
         Parameters
         ----------
         queryengine : QueryEngine
           Results of which engine to cache
+        maxsize : None or int
+          Maximal number of cached results of :meth:`query`.  If None --
+          no limit.
+        cachedir : None or str
+          Directory to store neighborhoods of all features into (as .npz
+          files).  If None -- nothing is stored on disk.
         """
         super(CachedQueryEngine, self).__init__()
         self._queryengine = queryengine
+        self._maxsize = maxsize
+        self._cachedir = cachedir
         self._trained_ds_fa_hash = None
         """Will give information about either dataset's FA were changed
         """
         self._lookup_ids = None
         self._lookup = None
+        """Cached results of query() from least to most recently used"""
+        self._stored = None
+        """(indptr, indices) of neighborhoods loaded from cachedir"""
+        self._untrained_ds = None
+        """Dataset to train underlying engine on, whenever it is needed"""
 
     def __repr__(self, prefixes=[]):
         return super(CachedQueryEngine, self).__repr__(
             prefixes=prefixes
-            + _repr_attrs(self, ['qe']))
+            + _repr_attrs(self, ['qe'])
+            + _repr_attrs(self, ['maxsize', 'cachedir']))
 
 
     def train(self, dataset):
@@ -591,9 +778,14 @@ class CachedQueryEngine(QueryEngineInterface):
         if self._trained_ds_fa_hash is None:
             # First time is called
             self._trained_ds_fa_hash = ds_fa_hash
-            self._queryengine.train(dataset)     # train the queryengine
             self._lookup_ids = [None] * dataset.nfeatures # lookup for query_byid
-            self._lookup = {}           # generic lookup
+            self._lookup = OrderedDict() # generic lookup
+            self._stored = None
+            if self._cachedir is None:
+                self._queryengine.train(dataset)     # train the queryengine
+                self._untrained_ds = None
+            else:
+                self._train_stored(dataset)
         elif self._trained_ds_fa_hash != ds_fa_hash:
             raise ValueError, \
                   "Feature attributes of %s (idhash=%r) were changed from " \
@@ -603,14 +795,88 @@ class CachedQueryEngine(QueryEngineInterface):
         else:
             pass
 
+    def _train_stored(self, dataset):
+        """Load neighborhoods from `cachedir` or compute and store them
+        """
+        filename = os.path.join(self._cachedir,
+                                '%s.npz' % self.get_content_hash(dataset))
+        if os.path.exists(filename):
+            if __debug__:
+                debug('NBH', "Loading neighborhoods from %s" % filename)
+            stored = np.load(filename)
+            try:
+                self._stored = (stored['indptr'], stored['indices'])
+            finally:
+                stored.close()
+            # underlying engine gets trained only if query() gets called
+            self._untrained_ds = dataset
+            return
+
+        self._queryengine.train(dataset)
+        self._untrained_ds = None
+        qe = self._queryengine
+        if getattr(qe, '_nb_indptr', None) is not None:
+            # IndexQueryEngine has precomputed them already
+            indptr, indices = qe._nb_indptr, qe._nb_indices
+        else:
+            nbs = [qe.query_byid(fid) for fid in xrange(dataset.nfeatures)]
+            indptr = np.r_[0, np.cumsum([len(x) for x in nbs])]
+            indices = np.zeros(indptr[-1], dtype=int)
+            for fid, nb in enumerate(nbs):
+                indices[indptr[fid]:indptr[fid + 1]] = nb
+        self._stored = (indptr, indices)
+        if __debug__:
+            debug('NBH', "Storing neighborhoods into %s" % filename)
+        if not os.path.exists(self._cachedir):
+            os.makedirs(self._cachedir)
+        # store under a temporary name first, so concurrent processes
+        # never see incomplete files
+        tmpfilename = '%s.%i.tmp.npz' % (filename[:-4], os.getpid())
+        np.savez(tmpfilename, indptr=indptr, indices=indices)
+        os.rename(tmpfilename, filename)
+
+    def get_content_hash(self, dataset):
+        """Hash of everything which determines the neighborhoods.
+
+        That is the specification of the underlying query engine (e.g.
+        `Sphere` radius and distance function) and the content of the
+        feature attributes it operates on.
+        """
+        qe = self._queryengine
+        queryobjs = getattr(qe, '_queryobjs', None)
+        if queryobjs is None:
+            spaces = sorted(dataset.fa.keys())
+        else:
+            spaces = sorted(queryobjs.keys())
+        h = hashlib.md5()
+        h.update(qe.__class__.__name__)
+        h.update('sorted=%r' % getattr(qe, 'sorted', None))
+        h.update('nfeatures=%i' % dataset.nfeatures)
+        for space in spaces:
+            h.update(space)
+            if queryobjs is not None:
+                h.update(_get_description(queryobjs[space]))
+            value = np.asanyarray(dataset.fa[space].value)
+            h.update('%s%s' % (value.dtype.str, value.shape))
+            if value.dtype.hasobject:
+                h.update(repr(value.tolist()))
+            else:
+                h.update(np.ascontiguousarray(value).tostring())
+        return h.hexdigest()
+
     def untrain(self):
         """Forgetting that CachedQueryEngine was already trained
         """
         self._trained_ds_fa_hash = None
+        self._stored = None
+        self._untrained_ds = None
 
 
     @borrowdoc(QueryEngineInterface)
     def query_byid(self, fid):
+        if self._stored is not None:
+            indptr, indices = self._stored
+            return indices[indptr[fid]:indptr[fid + 1]].tolist()
         v = self._lookup_ids[fid]
         if v is None:
             self._lookup_ids[fid] = v = self._queryengine.query_byid(fid)
@@ -618,10 +884,23 @@ class CachedQueryEngine(QueryEngineInterface):
 
     @borrowdoc(QueryEngineInterface)
     def query(self, **kwargs):
-        k = idhash_(kwargs.items())
-        v = self._lookup.get(k, None)
+        # key by the content of the query
+        k = tuple(sorted([(space, repr(np.asanyarray(v).tolist()))
+                          for space, v in kwargs.iteritems()]))
+        lookup = self._lookup
+        v = lookup.pop(k, None)
         if v is None:
-            self._lookup[k] = v = self._queryengine.query(**kwargs)
+            if self._untrained_ds is not None:
+                self._queryengine.train(self._untrained_ds)
+                self._untrained_ds = None
+            v = self._queryengine.query(**kwargs)
+        # (re)insert as the most recently used one
+        lookup[k] = v
+        if self._maxsize is not None and len(lookup) > self._maxsize:
+            # evict the least recently used one
+            lookup.popitem(last=False)
         return v
 
     queryengine = property(fget=lambda self: self._queryengine)
+    maxsize = property(fget=lambda self: self._maxsize)
+    cachedir = property(fget=lambda self: self._cachedir)
@@ -13,6 +13,10 @@ import numpy as np
 if __debug__:
     from mvpa.base import debug
 
+# next origid to be assigned by SamplesLookup -- plain integers, but unique
+# across all datasets of this process, so datasets could still be merged
+_next_origid = [0]
+
 class SamplesLookup(object):
     """Map to translate sample origids into unique indices.
     """
@@ -33,13 +37,17 @@ class SamplesLookup(object):
         try:
             sample_ids = ds.sa.origids
         except AttributeError:
-            # origids not yet generated
+            # origids not yet generated -- consecutive integers are cheaper
+            # to generate and to look up than the literal ids of
+            # init_origids(), and are unique across datasets as well
             if __debug__:
                 debug('SAL',
                       "Generating dataset origids in SamplesLookup for %(ds)s",
                       msgargs=dict(ds=ds))
 
-            ds.init_origids('samples')  # XXX may be both?
+            start = _next_origid[0]
+            _next_origid[0] += len(ds)
+            ds.sa['origids'] = np.arange(start, start + len(ds))
             sample_ids = ds.sa.origids
 
         try:
@@ -52,12 +60,26 @@ class SamplesLookup(object):
                       "Generating dataset magic_id in SamplesLookup for %(ds)s",
                       msgargs=dict(ds=ds))
 
+        sample_ids = np.asanyarray(sample_ids)
         nsample_ids = len(sample_ids)
-        self._map = dict(zip(sample_ids,
-                             range(nsample_ids)))
+        if np.issubdtype(sample_ids.dtype, np.integer) and nsample_ids \
+               and sample_ids.max() - sample_ids.min() < 4 * nsample_ids:
+            # densely packed integer ids: (id - offset) -> position table
+            self._offset = sample_ids.min()
+            self._map = np.repeat(-1, sample_ids.max() - self._offset + 1)
+            self._map[sample_ids - self._offset] = np.arange(nsample_ids)
+            self._sorted_ids = None
+        else:
+            # any other ids get looked up in their sorted sequence
+            self._map = np.argsort(sample_ids, kind='mergesort')
+            self._sorted_ids = sample_ids[self._map]
         if __debug__:
             # some sanity checks
-            if len(self._map) != nsample_ids:
+            if self._sorted_ids is None:
+                nunique = np.sum(self._map >= 0)
+            else:
+                nunique = len(np.unique(sample_ids))
+            if nunique != nsample_ids:
                 raise ValueError, \
                     "Apparently samples' origids are not uniquely identifying" \
                     " samples in %s.  You must change them so they are unique" \
@@ -74,9 +96,33 @@ class SamplesLookup(object):
                   'Dataset %s is not indexed by %s' % (ds, self)
 
         _map = self._map
-        _origids = ds.sa.origids
+        _origids = np.asanyarray(ds.sa.origids)
 
-        res = np.array([_map[i] for i in _origids])
+        if self._sorted_ids is None:
+            if not np.issubdtype(_origids.dtype, np.integer):
+                raise KeyError, \
+                      'Dataset %s has origids unknown to %s' % (ds, self)
+            pos = _origids - self._offset
+            if len(pos) and (pos.min() < 0 or pos.max() >= len(_map)):
+                raise KeyError, \
+                      'Dataset %s has origids unknown to %s' % (ds, self)
+            res = _map[pos]
+            known = res >= 0
+        else:
+            _sorted_ids = self._sorted_ids
+            if _origids.dtype.kind != _sorted_ids.dtype.kind:
+                raise KeyError, \
+                      'Dataset %s has origids unknown to %s' % (ds, self)
+            pos = np.searchsorted(_sorted_ids, _origids)
+            pos[pos == len(_sorted_ids)] = 0
+            if len(_origids) and not len(_sorted_ids):
+                known = False
+            else:
+                known = _sorted_ids[pos] == _origids
+                res = _map[pos]
+        if not np.all(known):
+            raise KeyError, \
+                  'Dataset %s has origids unknown to %s' % (ds, self)
         if __debug__:
             debug('SAL',
                   "Successful lookup: %(inst)s on %(ds)s having "
@@ -14,9 +14,9 @@ from mvpa.base import externals
 
 if externals.exists('scipy', raise_=True):
     import scipy.stats as st
+    import scipy.spatial.distance as ssd
 
 import numpy as np
-import copy
 
 def chisquare(obs, exp='uniform'):
     """Compute the chisquare value of a contingency table with arbitrary
@@ -81,6 +81,47 @@ def chisquare(obs, exp='uniform'):
     return chisq, st.chisqprob(chisq, np.sum(exp_nonzeros) - 1)
 
 
+def _rankdata_rows(x):
+    """Rank-transform each row of a 2D array.
+
+    Equivalent to applying `scipy.stats.rankdata` to every row, i.e. ties
+    get the average of the ranks they span, but done for all rows at once.
+    """
+    x = np.asarray(x)
+    nrows, ncols = x.shape
+    rows = np.arange(nrows)[:, None]
+    order = np.argsort(x, axis=1, kind='mergesort')
+    sx = x[rows, order]
+    # consecutive runs of equal values form groups, numbered across all rows
+    newgroup = np.ones(x.shape, dtype=bool)
+    newgroup[:, 1:] = sx[:, 1:] != sx[:, :-1]
+    groups = np.cumsum(newgroup.ravel()) - 1
+    # average of the (1-based) positions within each group
+    positions = np.tile(np.arange(1, ncols + 1, dtype=float), nrows)
+    avgranks = np.bincount(groups, weights=positions) / np.bincount(groups)
+    ranks = np.empty(x.shape)
+    ranks[rows, order] = avgranks[groups].reshape(x.shape)
+    return ranks
+
+
+def _correlation_transform(x, metric='pearson'):
+    """Transform rows, so their correlations are plain dot products.
+
+    Rows are rank-transformed for 'spearman' and z-scored, so that
+    `np.dot(z, z.T) / z.shape[1]` is the matrix of (Pearson or Spearman)
+    correlations between the rows of `x`.
+    """
+    if metric == 'spearman':
+        x = _rankdata_rows(x)
+    elif metric == 'pearson':
+        x = np.array(x, dtype=float)
+    else:
+        raise ValueError, "Unknown correlation metric '%s'" % metric
+    x -= x.mean(axis=1)[:, None]
+    x /= x.std(axis=1)[:, None]
+    return x
+
+
 class DSMatrix(object):
     """DSMatrix allows for the creation of dissilimarity matrices using
        arbitrary distance metrics.
@@ -118,54 +159,31 @@ class DSMatrix(object):
             flag_1d = True
             num_features = 1
 
-        # generate output (dissimilarity) matrix
-        dsmatrix = np.mat(np.zeros((num_exem, num_exem)))
+        # 2D view with samples in rows
+        if flag_1d:
+            data = np.reshape(data_vectors, (num_exem, 1))
+        else:
+            data = np.asarray(data_vectors)
 
         if (metric == 'euclidean'):
-            #print 'Using Euclidean distance metric...'
-            # down rows
-            for i in range(num_exem):
-                # across columns
-                for j in range(num_exem):
-                    if (not(flag_1d)):
-                        dsmatrix[i, j] = np.linalg.norm(
-                            data_vectors[i, :] - data_vectors[j, :])
-                    else:
-                        dsmatrix[i, j] = np.linalg.norm(
-                            data_vectors[i] - data_vectors[j])
-
-        elif (metric == 'spearman'):
-            #print 'Using Spearman rank-correlation metric...'
-            # down rows
-            for i in range(num_exem):
-                # across columns
-                for j in range(num_exem):
-                    dsmatrix[i, j] = 1 - st.spearmanr(
-                        data_vectors[i,:], data_vectors[j,:])[0]
-
-        elif (metric == 'pearson'):
-            #print 'Using Pearson correlation metric...'
-            # down rows
-            for i in range(num_exem):
-                # across columns
-                for j in range(num_exem):
-                    dsmatrix[i, j] = 1 - st.pearsonr(
-                        data_vectors[i,:], data_vectors[j,:])[0]
+            dsmatrix = ssd.squareform(ssd.pdist(data, 'euclidean'))
+
+        elif (metric in ('spearman', 'pearson')):
+            # all correlations at once on ranked/z-scored rows
+            z = _correlation_transform(data, metric)
+            dsmatrix = 1 - np.dot(z, z.T) / num_features
 
         elif (metric == 'confusion'):
-            #print 'Using confusion correlation metric...'
-            # down rows
-            for i in range(num_exem):
-                # across columns
-                for j in range(num_exem):
-                    if (not(flag_1d)):
-                        dsmatrix[i, j] = 1 - int(
-                            np.floor(np.sum((
-                                data_vectors[i, :] == data_vectors[j, :]
-                                ).astype(np.int32)) / num_features))
-                    else:
-                        dsmatrix[i, j] = 1 - int(
-                            data_vectors[i] == data_vectors[j])
+            # 0 for exemplars equal in all features, 1 otherwise
+            equal = np.ones((num_exem, num_exem), dtype=bool)
+            for column in data.T:
+                equal &= column[:, None] == column[None, :]
+            dsmatrix = 1 - equal.astype(int)
+
+        else:
+            dsmatrix = np.zeros((num_exem, num_exem))
+
+        dsmatrix = np.mat(dsmatrix)
 
         self.full_matrix = dsmatrix
 
@@ -181,36 +199,17 @@ class DSMatrix(object):
     # two dissimilarity matrices; we can just reuse the same dissimilarity
     # matrix code, but since it will return a matrix, we need to pick out
     # either dsm[0,1] or dsm[1,0]
-    # note:  this is a bit of a kludge right now, but it's the only way to solve
-    # certain problems:
-    #  1.  Set all 0-valued elements in the original matrix to -1 (an impossible
-    #        value for a dissimilarity matrix)
-    #  2.  Find the upper triangle of the matrix
-    #  3.  Create a vector from the upper triangle, but only with the
-    #      elements whose absolute value is greater than 0 -- this
-    #      will keep everything from the original matrix that wasn't
-    #      part of the zero'ed-out portion when we took the upper
-    #      triangle
-    #  4.  Set all the -1-valued elements in the vector to 0 (their
-    #      original value)
-    #  5.  Cast to numpy array
     ##REF: Name was automagically refactored
     def get_vector_form(self):
+        """Upper triangle (including the diagonal) as a flat array.
+
+        Elements are in row-major order.
+        """
         if (self.vector_form is not None):
             return self.vector_form
 
-        orig_dsmatrix = copy.deepcopy(self.get_full_matrix())
-
-        orig_dsmatrix[orig_dsmatrix == 0] = -1
-
-        orig_tri = np.triu(orig_dsmatrix)
-
-        vector_form = orig_tri[abs(orig_tri) > 0]
-
-        vector_form[vector_form == -1] = 0
-
-        vector_form = np.asarray(vector_form)
-        self.vector_form = vector_form[0]
+        full = np.asarray(self.get_full_matrix())
+        self.vector_form = full[np.triu_indices(len(full))]
 
         return self.vector_form
 
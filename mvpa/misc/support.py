@@ -11,7 +11,7 @@
 __docformat__ = 'restructuredtext'
 
 import numpy as np
-import re, os
+import re, os, time
 
 # for SmartVersion
 from distutils.version import Version
@@ -667,3 +667,33 @@ def get_nelements_per_value(data):
         result[l] += 1
 
     return result
+
+
+def get_progress_msg(ndone, ntotal, time_start):
+    """Compose a progress report with an estimate of the remaining time.
+
+    Parameters
+    ----------
+    ndone : int
+      Number of already processed items.
+    ntotal : int
+      Total number of items to be processed.
+    time_start : float
+      Time (as returned by `time.time()`) when processing has started.
+
+    Returns
+    -------
+    str
+      E.g. '120/400 [30%] elapsed 0:01:12, ETA 0:02:48'
+    """
+    elapsed = time.time() - time_start
+    if ndone:
+        eta = elapsed * (ntotal - ndone) / float(ndone)
+    else:
+        eta = 0.
+    def _fmt(t):
+        t = int(round(t))
+        return '%d:%02d:%02d' % (t // 3600, (t // 60) % 60, t % 60)
+    return "%i/%i [%i%%] elapsed %s, ETA %s" \
+           % (ndone, ntotal, ndone * 100 / max(ntotal, 1),
+              _fmt(elapsed), _fmt(eta))
@@ -113,6 +113,7 @@ def collect_nose_tests(verbosity=1):
         'test_neighborhood',
         'test_stats',
         'test_stats_sp',
+        'test_parallel',
 
         # Mappers
         'test_mapper',
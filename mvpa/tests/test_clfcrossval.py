@@ -14,9 +14,16 @@ from mvpa.base.node import ChainNode
 from mvpa.generators.partition import NFoldPartitioner
 from mvpa.generators.permutation import AttributePermutator
 from mvpa.measures.base import CrossValidation
+from mvpa.misc.errorfx import mean_mismatch_error, rms_error
+from mvpa.clfs.gnb import GNB
+from mvpa.clfs.gda import LDA, QDA
+from mvpa.clfs.ridge import RidgeReg
+from mvpa.clfs.blr import BLR
 
+import mvpa
 from mvpa.testing import *
-from mvpa.testing.datasets import pure_multivariate_signal, get_mv_pattern
+from mvpa.testing.datasets import pure_multivariate_signal, get_mv_pattern, \
+     datasets
 from mvpa.testing.clfs import *
 
 class CrossValidationTests(unittest.TestCase):
@@ -80,6 +87,57 @@ class CrossValidationTests(unittest.TestCase):
         self.failUnless( pmean < 0.58 and pmean > 0.42 )
 
 
+    @sweepargs(clf=[GNB(), GNB(common_variance=True), LDA(), QDA(),
+                    RidgeReg(), BLR()])
+    def test_suffstats_cv(self, clf):
+        if clf.__is_regression__:
+            ds = datasets['chirp_linear'].copy()
+            errorfx, assert_same = rms_error, assert_array_almost_equal
+        else:
+            ds = datasets['uni3medium'].copy()
+            if not 'qda' in clf.__tags__:
+                # a subset without some label
+                ds = ds[~((ds.chunks > 1) & (ds.targets == 'L1'))]
+            errorfx, assert_same = mean_mismatch_error, assert_array_equal
+        clf_ = clf.clone()
+        cds = ds.copy(deep=False)
+        clf.cache_suffstats(cds)
+        for sel in (ds.chunks != 1, ds.chunks > 1, ds.chunks >= 0):
+            train = cds[sel]
+            clf.train(train)
+            clf_.train(train)
+            # the same models with and without cached statistics
+            assert_same(clf.predict(ds), clf_.predict(ds))
+            assert_array_almost_equal(clf.ca.estimates, clf_.ca.estimates)
+        # modified samples are not mistaken for the cached ones
+        train = cds[ds.chunks != 1]
+        train.samples = train.samples.copy()
+        train.samples[1:-1] += 10
+        clf.train(train)
+        clf_.train(train)
+        assert_same(clf.predict(ds), clf_.predict(ds))
+        assert_array_almost_equal(clf.ca.estimates, clf_.ca.estimates)
+        clf.cache_suffstats(None)
+
+        # cross-validation uses it automatically
+        for gen in (NFoldPartitioner(),
+                    # permuted targets are not confused with the cached ones
+                    ChainNode([NFoldPartitioner(),
+                               AttributePermutator('targets', count=2)],
+                              space='partitions')):
+            cv = CrossValidation(clf, gen, errorfx=errorfx)
+            cv_ = CrossValidation(clf, gen, errorfx=errorfx,
+                                  cache_suffstats=False)
+            # the same permutations for both
+            mvpa.seed(1)
+            res = cv(ds)
+            mvpa.seed(1)
+            assert_same(res.samples, cv_(ds).samples)
+        # input is not altered
+        self.failIf('origids' in ds.sa)
+        # and no cache is left behind
+        self.failUnless(clf._Classifier__suffstats is None)
+
 
 def suite():
     return unittest.makeSuite(CrossValidationTests)
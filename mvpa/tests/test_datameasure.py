@@ -472,6 +472,63 @@ class SensitivityAnalysersTests(unittest.TestCase):
         self.failUnless(np.allclose(r_custom.samples, r_custom2.samples))
 
 
+    def test_corrcoef(self):
+        if not externals.exists('scipy'):
+            return
+        from scipy.stats import pearsonr
+
+        ds = datasets['uni2small'].copy()
+        ds.samples[:, 2] = 1.0          # constant feature
+        ds.targets = np.searchsorted(ds.sa['targets'].unique, ds.targets)
+        ds.sa['other'] = np.arange(len(ds))
+        for pvalue in (False, True):
+            r = CorrCoef(pvalue=pvalue)(ds)
+            assert_equal(r.shape, (1, ds.nfeatures))
+            # matches featurewise scipy computation
+            for i in (0, 1, 3):
+                assert_almost_equal(
+                    r.samples[0, i],
+                    pearsonr(ds.samples[:, i], ds.targets)[int(pvalue)])
+            # constant feature: 0 correlation and p-value of 1
+            assert_equal(r.samples[0, 2], float(pvalue))
+
+            # one row per attribute
+            rm = CorrCoef(pvalue=pvalue, attr=['targets', 'other'])(ds)
+            assert_equal(rm.shape, (2, ds.nfeatures))
+            assert_array_almost_equal(rm.samples[:1], r.samples)
+            assert_array_almost_equal(
+                rm.samples[1:], CorrCoef(pvalue=pvalue, attr='other')(ds))
+
+        # constant attribute and feature are perfectly correlated
+        ds.sa['const'] = np.zeros(len(ds))
+        assert_equal(CorrCoef(attr='const')(ds).samples[0, 2], 1.0)
+        ds.sa['literal'] = ['a'] * len(ds)
+        self.failUnlessRaises(ValueError, CorrCoef(attr='literal'), ds)
+
+
+    def test_irelief_blocked(self):
+        ds = datasets['uni4medium']
+        w = IterativeRelief()(ds).samples
+        # processing samples in blocks (and threads) doesn't change weights
+        for kwargs in ({'blocksize': 7}, {'blocksize': 5, 'nproc': 3}):
+            assert_array_almost_equal(IterativeRelief(**kwargs)(ds).samples, w)
+        assert_array_almost_equal(IterativeRelief(dtype='float32')(ds).samples,
+                                  w, decimal=4)
+
+        # early stopping
+        ir = IterativeRelief(max_iter=1, threshold=0)
+        w1 = ir(ds).samples
+        assert_equal(w1.shape, w.shape)
+        assert_array_almost_equal(np.sum(w1 ** 2), 1)
+        w_stable = IterativeRelief(threshold=0, stable_nfeatures=4)(ds).samples
+        assert_equal(set(np.argsort(w_stable[0])[-4:]),
+                     set(np.argsort(w[0])[-4:]))
+
+        # a class with a single sample only
+        ds1 = ds[np.hstack(([0], np.where(ds.targets != ds.targets[0])[0]))]
+        self.failUnlessRaises(ValueError, IterativeRelief(), ds1)
+
+
     def test_transfer_measure(self):
         # come up with my own measure that only checks if training data
         # and test data are the same
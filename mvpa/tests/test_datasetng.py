@@ -514,6 +514,52 @@ def test_combined_samplesfeature_selection():
     ok_(isinstance(single.samples, myarray))
 
 
+def test_fast_select():
+    ds = datasets['3dsmall'].copy()
+    ds.fa['ids'] = np.arange(ds.nfeatures)
+    for fids in ([3, 1, 7], [2, 3, 4], [5], slice(2, 6),
+                 np.arange(ds.nfeatures) % 3 == 0):
+        ref = ds[:, fids]
+        sel = ds.fast_select(fids)
+        ok_(sel.__class__ is ds.__class__)
+        assert_array_equal(sel.samples, ref.samples)
+        assert_array_equal(sel.fa.ids, ref.fa.ids)
+        assert_equal(sorted(sel.sa.keys()), sorted(ds.sa.keys()))
+        assert_array_equal(sel.targets, ds.targets)
+        # sample attributes are shared, not copied
+        ok_(sel.sa['targets'].value is ds.sa['targets'].value)
+        # no dataset attributes by default
+        assert_equal(len(sel.a), 0)
+        # but fresh collections
+        sel.fa['new'] = np.ones(sel.nfeatures)
+        ok_(not 'new' in ds.fa)
+
+    # consecutive ids give a view of the samples
+    sel = ds.fast_select([2, 3, 4])
+    ok_(sel.samples.base is ds.samples or sel.samples.base is ds.samples.base)
+    sel.samples[0, 0] = 12345
+    assert_equal(ds.samples[0, 2], 12345)
+
+    # unless a copy is requested
+    orig = ds.samples.copy()
+    for fids in ([2, 3, 4], slice(2, 6), [3, 1, 7]):
+        sel = ds.fast_select(fids, copy=True)
+        assert_array_equal(sel.samples, ds[:, fids].samples)
+        ok_(not np.may_share_memory(sel.samples, ds.samples))
+        ok_(not np.may_share_memory(sel.targets, ds.targets))
+        sel.samples[:] = -1
+        sel.targets[:] = -1
+        assert_array_equal(ds.samples, orig)
+        ok_(not np.any(ds.targets == -1))
+
+    # mapper is kept in sync with the selection if requested
+    ref = ds[:, [3, 1, 7]]
+    sel = ds.fast_select([3, 1, 7], a=None)
+    assert_equal(sorted(sel.a.keys()), sorted(ds.a.keys()))
+    assert_array_equal(sel.a.mapper.reverse(sel.samples),
+                       ref.a.mapper.reverse(ref.samples))
+
+
 @reseed_rng()
 def test_labelpermutation_randomsampling():
     ds = Dataset.from_wizard(np.ones((5, 10)),     targets=range(5), chunks=1)
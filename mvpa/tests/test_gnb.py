@@ -13,6 +13,7 @@ import numpy as np
 from mvpa.testing import *
 from mvpa.testing.datasets import *
 
+from mvpa.datasets import Dataset
 from mvpa.clfs.gnb import GNB
 from mvpa.measures.base import TransferMeasure
 from mvpa.generators.splitters import Splitter
@@ -56,6 +57,71 @@ class GNBTests(unittest.TestCase):
                         d1 = np.sum(v, axis=1) - 1.0
                         self.failUnless(np.max(np.abs(d1)) < 1e-5)
 
+
+    def test_gnb_partial_fit(self):
+        ds = datasets['uni4medium']
+        for common_variance in (False, True):
+            gnb = GNB(common_variance=common_variance)
+            gnb.train(ds)
+            gnb_ = GNB(common_variance=common_variance)
+            # in portions, some of them introducing new labels
+            early = ds.chunks < 2
+            for sel in (early & (ds.targets != 'L0'),
+                        ~early & (ds.targets == 'L1'),
+                        ds.targets == 'L0',
+                        ~early & (ds.targets > 'L1')):
+                gnb_.partial_fit(ds[sel])
+            assert_array_equal(gnb_.ulabels, gnb.ulabels)
+            assert_array_almost_equal(gnb_.means, gnb.means)
+            assert_array_almost_equal(gnb_.variances, gnb.variances)
+            assert_array_almost_equal(gnb_.priors, gnb.priors)
+            assert_array_equal(gnb_.predict(ds), gnb.predict(ds))
+            assert_equal(gnb_.ca.trained_nsamples, len(ds))
+        self.failUnlessRaises(ValueError, gnb_.partial_fit, ds[:, :2])
+
+
+    def test_gnb_float32(self):
+        ds = datasets['uni4medium']
+        gnb = GNB()
+        gnb32 = GNB(dtype='float32')
+        gnb.train(ds)
+        gnb32.train(ds)
+        self.failUnless(gnb32.means.dtype == np.float32)
+        self.failUnless(gnb32.variances.dtype == np.float32)
+        assert_array_almost_equal(gnb32.means, gnb.means, decimal=5)
+        assert_array_almost_equal(gnb32.variances, gnb.variances, decimal=4)
+        assert_array_equal(gnb32.predict(ds), gnb.predict(ds))
+
+        # classes far apart relative to their spread must not lose the
+        # precision of the variances
+        ds = Dataset(np.random.normal(scale=0.1, size=(40, 4))
+                     + np.repeat([[-1000], [1000]], 20, axis=0),
+                     sa={'targets': np.repeat([0, 1], 20)})
+        gnb.train(ds)
+        gnb32.train(ds)
+        self.failUnless(np.all(gnb32.variances > 0.001))
+        assert_array_almost_equal(gnb32.variances, gnb.variances, decimal=5)
+        assert_array_equal(gnb32.predict(ds), ds.targets)
+
+
+    def test_gnb_blocks(self):
+        import mvpa.clfs.gnb as gnb_module
+        ds = datasets['uni4medium']
+        gnb = GNB()
+        gnb.train(ds)
+        blocksize = gnb_module._SUFFSTATS_BLOCK_SIZE
+        try:
+            # statistics reduced over several blocks of samples
+            gnb_module._SUFFSTATS_BLOCK_SIZE = 7 * ds.nfeatures
+            gnb_ = GNB()
+            gnb_.train(ds)
+        finally:
+            gnb_module._SUFFSTATS_BLOCK_SIZE = blocksize
+        assert_array_almost_equal(gnb_.means, gnb.means)
+        assert_array_almost_equal(gnb_.variances, gnb.variances)
+        assert_array_equal(gnb_.predict(ds), gnb.predict(ds))
+
+
 def suite():
     return unittest.makeSuite(GNBTests)
 
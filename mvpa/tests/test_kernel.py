@@ -16,7 +16,8 @@ from mvpa.testing.datasets import datasets
 from mvpa.base.externals import exists
 from mvpa.datasets import Dataset
 from mvpa.clfs.distance import squared_euclidean_distance, \
-     pnorm_w, pnorm_w_python
+     pnorm_w, pnorm_w_python, one_minus_correlation, distance_blocks, \
+     tiled_distance
 
 import mvpa.kernels.np as npK
 from mvpa.kernels.base import PrecomputedKernel, CachedKernel
@@ -125,6 +126,35 @@ class KernelTests(unittest.TestCase):
         self.failUnless((d == nk._k).all(),
                         'Failure setting and retrieving PrecomputedKernel data')
 
+    def test_samples_lookup(self):
+        from mvpa.misc.sampleslookup import SamplesLookup
+        d = Dataset(np.random.randn(20, 3))
+        sl = SamplesLookup(d)
+        # integer ids are assigned if there were none
+        ok_(np.issubdtype(d.sa.origids.dtype, np.integer))
+        assert_array_equal(sl(d[[5, 2, 17]]), [5, 2, 17])
+        # which are unique across datasets, so they could be merged
+        d2 = Dataset(np.random.randn(5, 3))
+        SamplesLookup(d2)
+        assert_equal(len(np.unique(np.r_[d.sa.origids, d2.sa.origids])), 25)
+        # sparse integer ids are fine as well
+        d3 = Dataset(np.random.randn(5, 3),
+                     sa={'origids': [7, -3, 1000, 2, 9]})
+        sl = SamplesLookup(d3)
+        assert_array_equal(sl(d3[[4, 2, 1]]), [4, 2, 1])
+        d3_ = d3[:2].copy()
+        d3_.sa.origids[0] = 8
+        self.failUnlessRaises(KeyError, sl, d3_)
+        # literal ids work as well
+        d.init_origids('samples')
+        sl = SamplesLookup(d)
+        assert_array_equal(sl(d[::-3]), np.arange(20)[::-3])
+        # unknown samples or datasets are not looked up
+        d_ = d[:5].copy()
+        d_.sa.origids[0] = 'bogus'
+        self.failUnlessRaises(KeyError, sl, d_)
+        self.failUnlessRaises(KeyError, sl, Dataset(np.random.randn(2, 3)))
+
     @reseed_rng()
     def test_cached_kernel(self):
         nchunks = 5
@@ -342,6 +372,49 @@ class KernelTests(unittest.TestCase):
                             "Norm of the difference is %g"
                             % (did, iid, p, dnorm))
 
+    def test_tiled_distance(self):
+        data1 = datasets['uni4large'].samples[:23, :10]
+        data2 = datasets['uni4large'].samples[30:37, :10]
+        weight = np.abs(datasets['uni4large'].samples[40, :10])
+
+        for dfx, kwargs in ((squared_euclidean_distance, {}),
+                            (squared_euclidean_distance, {'weight': weight}),
+                            (one_minus_correlation, {}),
+                            (pnorm_w, {'weight': weight, 'p': 1})):
+            full = dfx(data1, data2, **kwargs)
+            # various tilings (incl. memory bound), threads and output buffer
+            for tkwargs in ({}, {'blocksize': 5}, {'blocksize': 100},
+                            {'max_memory': 1e-4},
+                            {'blocksize': 4, 'nproc': 3}):
+                d = tiled_distance(data1, data2, dfx=dfx, **dict(kwargs,
+                                                                **tkwargs))
+                assert_array_almost_equal(d, full)
+            out = np.zeros(full.shape)
+            d = tiled_distance(data1, data2, dfx=dfx, blocksize=6, out=out,
+                               **kwargs)
+            self.failUnless(d is out)
+            assert_array_almost_equal(out, full)
+            # single precision
+            d = tiled_distance(data1, data2, dfx=dfx, dtype='float32',
+                               blocksize=6, **kwargs)
+            self.failUnlessEqual(d.dtype, np.float32)
+            assert_array_almost_equal(d, full, decimal=4)
+
+            # row blocks cover the matrix in order
+            blocks = list(distance_blocks(data1, data2, dfx=dfx,
+                                          blocksize=10, **kwargs))
+            self.failUnlessEqual([b[1].shape for b in blocks],
+                                 [(10, 7), (10, 7), (3, 7)])
+            assert_array_almost_equal(np.vstack([b[1] for b in blocks]), full)
+            self.failUnlessEqual(blocks[-1][0], slice(20, 23))
+
+        # distances within a single dataset
+        assert_array_almost_equal(
+            tiled_distance(data1, blocksize=4),
+            squared_euclidean_distance(data1))
+        self.failUnlessRaises(ValueError, tiled_distance, data1, data2,
+                              out=np.zeros((7, 23)))
+
 
 def suite():
     return unittest.makeSuite(KernelTests)
@@ -13,6 +13,7 @@ import numpy as np
 from mvpa.testing import *
 from mvpa.testing.datasets import pure_multivariate_signal
 
+from mvpa.datasets import Dataset
 from mvpa.clfs.knn import kNN
 from mvpa.clfs.distance import one_minus_correlation
 
@@ -62,6 +63,62 @@ class KNNTests(unittest.TestCase):
         self.failUnless(not (clf.ca.distances.fa['chunks'] is train.sa['chunks']))
         self.failUnless(not (clf.ca.distances.fa.chunks is train.sa.chunks))
 
+    def test_knn_blocked_voting(self):
+        train = pure_multivariate_signal(40, 3)
+        test = pure_multivariate_signal(20, 3)
+        labels = train.targets
+        ulabels = np.unique(labels)
+
+        for voting in ('majority', 'weighted'):
+            clf = kNN(k=5, voting=voting)
+            clf.train(train)
+            clf.ca.enable(['estimates', 'distances'])
+            p = clf.predict(test.samples)
+            estimates = clf.ca.estimates
+            dists = clf.ca.distances.samples
+
+            # reference: full argsort and per-sample vote counting
+            knns = dists.argsort(axis=1)[:, :5]
+            votes = np.array([[np.sum(labels[knn] == l) for l in ulabels]
+                              for knn in knns])
+            if voting == 'weighted':
+                votes = votes * np.array(
+                    [1.0 - np.mean(labels == l) for l in ulabels])
+            assert_array_equal(estimates, votes)
+            assert_array_equal(p, ulabels[votes.argmax(axis=1)])
+            # the same votes are provided by the public voting methods
+            for knn, est in zip(knns, estimates):
+                assert_array_equal(getattr(clf, 'get_%s_vote' % voting)(knn)[1],
+                                   est)
+
+            # blocked computation gives identical results
+            bclf = kNN(k=5, voting=voting, blocksize=7)
+            bclf.train(train)
+            bclf.ca.enable(['estimates', 'distances'])
+            assert_array_equal(bclf.predict(test.samples), p)
+            assert_array_equal(bclf.ca.estimates, estimates)
+            assert_array_equal(bclf.ca.distances.samples, dists)
+
+    def test_knn_weighted_voting(self):
+        # 9 samples of 'a' and only 3 of 'b'
+        train = Dataset(np.array([[0.0], [0.1], [0.2],
+                                  [0.3], [0.4], [0.5], [5.], [6.], [7.],
+                                  [8.], [9.], [10.]]),
+                        sa={'targets': ['b'] * 3 + ['a'] * 9})
+        # nearest 5 neighbors are 3 of 'a' and 2 of 'b'
+        test = np.array([[0.26]])
+
+        clf = kNN(k=5, voting='majority')
+        clf.train(train)
+        self.failUnlessEqual(clf.predict(test), ['a'])
+
+        # votes of the rare class weigh more
+        clf = kNN(k=5, voting='weighted')
+        clf.train(train)
+        clf.ca.enable(['estimates'])
+        self.failUnlessEqual(clf.predict(test), ['b'])
+        assert_array_almost_equal(clf.ca.estimates, [[3 * 0.25, 2 * 0.75]])
+
 def suite():
     return unittest.makeSuite(KNNTests)
 
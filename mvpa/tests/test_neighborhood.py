@@ -8,16 +8,18 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 
 import os
+import shutil
 
 import numpy as np
 from numpy import array
 
+from mvpa.base import externals
 from mvpa.datasets.base import Dataset
 import mvpa.misc.neighborhood as ne
 from mvpa.clfs.distance import *
 
 from mvpa.testing.tools import ok_, assert_raises, assert_false, assert_equal, \
-        assert_array_equal
+        assert_array_equal, with_tempfile
 from mvpa.testing.datasets import datasets
 
 def test_distances():
@@ -212,6 +214,45 @@ def test_query_engine():
                        [0, 1, 3, 9, 27, 28, 30, 36])
 
 
+def test_query_engine_precompute():
+    data = np.arange(54)
+    ind = np.transpose((np.ones((3, 3, 3)).nonzero()))
+    ds = Dataset([data, data], fa={'s_ind': np.concatenate((ind, ind)),
+                                   't_ind': np.repeat([0, 1], 27),
+                                   'lit': ['roi1', 'ro2', 'r3'] * 18})
+    ds3d = datasets['3dlarge']
+    for d, qobjs in ((ds, dict(s_ind=ne.Sphere(1), t_ind=None)),
+                     (ds, dict(s_ind=ne.Sphere(1), t_ind=ne.Sphere(1))),
+                     (ds, dict(s_ind=ne.Sphere(1), t_ind=None, lit=None)),
+                     # not a Sphere -- no vectorized precomputation
+                     (ds, dict(s_ind=ne.Sphere(1), t_ind=lambda x: [x])),
+                     (ds3d, dict(myspace=ne.Sphere(2.5))),
+                     (ds3d, dict(myspace=ne.HollowSphere(2, 1))),
+                     (ds3d, dict(myspace=ne.Sphere(2,
+                                               element_sizes=(1, 2, 1.5))))):
+        qe = ne.IndexQueryEngine(**qobjs)
+        qe.train(d)
+        qep = ne.IndexQueryEngine(precompute=True, **qobjs)
+        qep.train(d)
+        for fid in xrange(d.nfeatures):
+            assert_equal(qe[fid], qep[fid])
+        # regular queries are not affected
+        assert_equal(qe(**dict([(s, v[0]) for s, v in qep._queryattrs.items()])),
+                     qep[0])
+        if externals.exists('scipy'):
+            nb = qep.neighbors
+            assert_equal(nb.shape, (d.nfeatures, d.nfeatures))
+            assert_array_equal(nb[3].nonzero()[1], qe[3])
+    # no neighbors without precomputation
+    assert_raises(RuntimeError, getattr, qe, 'neighbors')
+    # results come as lists regardless of sorting
+    for sorted_ in (True, False):
+        qep = ne.IndexQueryEngine(precompute=True, sorted=sorted_,
+                                  myspace=ne.Sphere(1))
+        qep.train(ds3d)
+        ok_(isinstance(qep[0], list))
+
+
 def test_cached_query_engine():
     """Test cached query engine
     """
@@ -258,3 +299,57 @@ def test_cached_query_engine():
     # unfortunately we are not catching those
     #ds2.fa.myspace = ds2.fa.myspace*3
     #assert_raises(ValueError, qec.train, ds2)
+
+
+def test_cached_query_engine_lru():
+    ds = datasets['3dlarge']
+    qec = ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(1)),
+                               maxsize=3)
+    qe = ne.IndexQueryEngine(myspace=ne.Sphere(1))
+    for q in (qe, qec):
+        q.train(ds)
+    coords = ds.fa.myspace[:10]
+    for c in coords:
+        assert_equal(qec(myspace=c), qe(myspace=c))
+        ok_(len(qec._lookup) <= 3)
+    # the most recent ones are kept
+    res = qec(myspace=coords[-1])
+    ok_(res is qec(myspace=coords[-1]))
+    assert_equal(len(qec._lookup), 3)
+    # touching the oldest one keeps it from being evicted
+    oldest = qec(myspace=coords[-3])
+    qec(myspace=coords[0])
+    ok_(oldest is qec(myspace=coords[-3]))
+
+
+@with_tempfile()
+def test_cached_query_engine_cachedir(cachedir):
+    ds = datasets['3dlarge']
+    try:
+        qe = ne.IndexQueryEngine(myspace=ne.Sphere(1))
+        qe.train(ds)
+        qec = ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(1)),
+                                   cachedir=cachedir)
+        qec.train(ds)
+        assert_equal(len(os.listdir(cachedir)), 1)
+        # a fresh engine loads them without training underlying engine
+        qel = ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(1)),
+                                   cachedir=cachedir)
+        qel.train(ds.copy())
+        ok_(qel.queryengine._spaceorder is None)
+        for fid in xrange(ds.nfeatures):
+            assert_equal(qel[fid], qe[fid])
+            assert_equal(qec[fid], qe[fid])
+        # but it gets trained whenever needed
+        assert_equal(qel(myspace=ds.fa.myspace[3]), qe[3])
+        # different neighborhoods get stored separately
+        for qobj in (ne.Sphere(2), ne.HollowSphere(1, 0),
+                     ne.Sphere(1, distance_func=manhatten_distance)):
+            ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=qobj),
+                                 cachedir=cachedir).train(ds)
+        # as well as different spaces
+        ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(1)),
+                             cachedir=cachedir).train(ds[:, 1:])
+        assert_equal(len(os.listdir(cachedir)), 5)
+    finally:
+        shutil.rmtree(cachedir, ignore_errors=True)
@@ -0,0 +1,80 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Unit tests for PyMVPA parallel computation helpers"""
+
+import numpy as np
+
+from mvpa.base.parallel import get_nproc, shared_empty, shared_array, \
+     parallel_map
+
+from mvpa.testing.tools import ok_, assert_raises, assert_equal, \
+        assert_array_equal
+
+
+def test_get_nproc():
+    assert_equal(get_nproc(3), 3)
+    ok_(get_nproc() >= 1)
+
+
+def test_shared_array():
+    a = np.arange(12, dtype='float32').reshape((3, 4))
+    sa = shared_array(a)
+    assert_array_equal(a, sa)
+    assert_equal(sa.dtype, a.dtype)
+    ok_(not sa is a)
+    # modifications done by children are visible in the parent
+    parallel_map(lambda i: sa.__setitem__(i, -1), [(i,) for i in range(3)],
+                 nproc=2)
+    ok_(np.all(sa == -1))
+    # objects cannot be shared
+    o = np.array(['a', None])
+    ok_(shared_array(o) is o)
+
+
+def test_shared_empty():
+    a = shared_empty((2, 3), dtype='int16')
+    assert_equal(a.shape, (2, 3))
+    assert_equal(a.dtype, np.dtype('int16'))
+    assert_equal(shared_empty((4, 0)).shape, (4, 0))
+    assert_raises(ValueError, shared_empty, 3, object)
+
+
+def test_parallel_map():
+    data = np.arange(10)
+    # closures are fine since processes inherit them
+    fx = lambda i, j: data[i:j].sum()
+    jobs = [(i, i + 3) for i in range(8)]
+    target = [fx(*job) for job in jobs]
+    for nproc in (1, 2, 4):
+        assert_equal(parallel_map(fx, jobs, nproc=nproc), target)
+    assert_raises(ValueError, parallel_map, fx, jobs, nproc=2,
+                  backend='bogus')
+
+
+def test_parallel_map_callback():
+    jobs = [(i,) for i in range(7)]
+    for nproc in (1, 3):
+        done = {}
+        def callback(ijob, result):
+            done[ijob] = result
+        results = parallel_map(lambda i: i ** 2, jobs, nproc=nproc,
+                               callback=callback)
+        assert_equal(results, [i ** 2 for i in range(7)])
+        # callback was called in the parent for every job
+        assert_equal(done, dict(enumerate(results)))
+
+
+def test_parallel_map_nested():
+    # workers are daemonic and cannot fork themselves -- inner maps have
+    # to fall back to serial processing
+    inner = lambda i: sum(parallel_map(lambda j: i * j,
+                                       [(j,) for j in range(4)], nproc=2))
+    jobs = [(i,) for i in range(3)]
+    assert_equal(parallel_map(inner, jobs, nproc=2),
+                 [i * 6 for i in range(3)])
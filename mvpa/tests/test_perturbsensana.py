@@ -15,7 +15,9 @@ from mvpa.testing.clfs import *
 from mvpa.datasets.base import Dataset
 from mvpa.measures.noiseperturbation import NoisePerturbationSensitivity
 from mvpa.generators.partition import NFoldPartitioner
-from mvpa.measures.base import CrossValidation
+from mvpa.clfs.gnb import GNB
+from mvpa.measures.base import CrossValidation, Measure
+from mvpa.misc.neighborhood import IndexQueryEngine, Sphere
 
 
 class PerturbationSensitivityAnalyzerTests(unittest.TestCase):
@@ -49,6 +51,59 @@ class PerturbationSensitivityAnalyzerTests(unittest.TestCase):
         # dataset is noise -> mean sensitivity should be zero
         self.failUnless(-0.2 < np.mean(map) < 0.2)
 
+        # the same noise regardless of the number of processes (with a
+        # deterministic classifier -- SMLR seeds from the clock)
+        cv = CrossValidation(GNB(), NFoldPartitioner())
+        pa = NoisePerturbationSensitivity(cv, noise=np.random.normal,
+                                          nproc=2)
+        np.random.seed(1)
+        map_ = pa(self.dataset)
+        pa.nproc = 1
+        np.random.seed(1)
+        assert_array_equal(pa(self.dataset).samples, map_.samples)
+
+
+    def test_perturbation_groups(self):
+        ds = Dataset(np.zeros((5, 10)))
+        ds.fa['coord'] = np.arange(10)
+        ds.fa['parcel'] = [0, 0, 0, 1, 1, 2, 2, 2, 2, 3]
+
+        class SumMeasure(Measure):
+            is_trained = True
+            def _call(self, ds):
+                return Dataset([[ds.samples.sum()]])
+
+        # unit noise: effect is the number of perturbed values
+        ones = lambda size: np.ones(size)
+        for nproc in (1, 2):
+            pa = NoisePerturbationSensitivity(SumMeasure(), noise=ones,
+                                              nproc=nproc)
+            assert_array_equal(pa(ds).samples, [[5] * 10])
+
+            # atlas parcels
+            pa = NoisePerturbationSensitivity(SumMeasure(), noise=ones,
+                                              groups='parcel', nproc=nproc)
+            assert_array_equal(pa(ds).samples,
+                               [[15, 15, 15, 10, 10, 20, 20, 20, 20, 5]])
+
+            # searchlight neighborhoods are assigned to their centers
+            pa = NoisePerturbationSensitivity(
+                SumMeasure(), noise=ones, nproc=nproc,
+                groups=IndexQueryEngine(coord=Sphere(1)))
+            assert_array_equal(pa(ds).samples, [[10] + [15] * 8 + [10]])
+
+            # random blocks
+            pa = NoisePerturbationSensitivity(SumMeasure(), noise=ones,
+                                              groups=4, nproc=nproc)
+            assert_array_equal(np.sort(pa(ds).samples[0]),
+                               [10] * 2 + [20] * 8)
+
+        # perturbation is undone
+        assert_array_equal(ds.samples, 0)
+        self.failUnlessRaises(ValueError,
+                              NoisePerturbationSensitivity(SumMeasure(),
+                                                           groups=0), ds)
+
 
 def suite():
     return unittest.makeSuite(PerturbationSensitivityAnalyzerTests)
@@ -28,7 +28,7 @@ from mvpa.featsel.helpers import \
 from mvpa.clfs.meta import FeatureSelectionClassifier, SplitClassifier
 from mvpa.misc.attrmap import AttributeMap
 from mvpa.clfs.stats import MCNullDist
-from mvpa.measures.base import ProxyMeasure, CrossValidation
+from mvpa.measures.base import ProxyMeasure, CrossValidation, Measure
 
 from mvpa.base.state import UnknownStateError
 
@@ -326,6 +326,29 @@ class RFETests(unittest.TestCase):
         # use the same classifier
 
 
+    def test_rfe_dataset_attributes(self):
+        # every step gets the same dataset attributes
+        seen = []
+        class RecordingMeasure(Measure):
+            is_trained = True
+            def _call(self, ds):
+                seen.append(sorted(ds.a.keys()))
+                return Dataset([np.arange(ds.nfeatures, dtype=float)])
+        class RecordingError(RecordingMeasure):
+            def _call(self, ds):
+                RecordingMeasure._call(self, ds)
+                return Dataset([[0.5]])
+        rfe = RFE(RecordingMeasure(), RecordingError(), Splitter('train'),
+                  fselector=FixedNElementTailSelector(1),
+                  train_pmeasure=False)
+        data = self.get_data()[:, :5]
+        rfe.train(data)
+        # sensitivity and performance measure for every step
+        assert_equal(len(seen), 2 * 5)
+        ok_(len(seen[0]))
+        assert_equal(seen, seen[:1] * len(seen))
+
+
     def test_james_problem(self):
         percent = 80
         dataset = datasets['uni2small']
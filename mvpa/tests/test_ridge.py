@@ -8,6 +8,9 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 """Unit tests for PyMVPA ridge regression classifier"""
 
+import numpy as np
+
+from mvpa.datasets import Dataset
 from mvpa.clfs.ridge import RidgeReg
 from scipy.stats import pearsonr
 from mvpa.testing import *
@@ -40,6 +43,19 @@ class RidgeRegTests(unittest.TestCase):
 
 
 
+    @reseed_rng()
+    def test_ridge_reg_unpenalized(self):
+        # more features than samples: minimum norm least squares solution
+        # of the uncentered design
+        data = Dataset(np.random.randn(4, 10) + 3,
+                       sa={'targets': np.random.randn(4)})
+        clf = RidgeReg(lm=0)
+        clf.train(data)
+        a = np.hstack((data.samples, np.ones((len(data), 1))))
+        assert_array_almost_equal(
+            clf.w, np.linalg.lstsq(a, data.targets)[0])
+
+
     def test_ridge_reg_state(self):
         data = datasets['dumb']
 
@@ -19,13 +19,14 @@ from mvpa.base import externals
 from mvpa.clfs.transerror import ConfusionMatrix
 from mvpa.measures.searchlight import sphere_searchlight, Searchlight
 from mvpa.measures.gnbsearchlight import sphere_gnbsearchlight,\
-     GNBSearchlight
+     GNBSearchlight, GNBSearchlightCache
 
 from mvpa.misc.neighborhood import IndexQueryEngine, Sphere
 from mvpa.generators.partition import NFoldPartitioner
 from mvpa.generators.permutation import AttributePermutator
 from mvpa.measures.base import CrossValidation
 from mvpa.clfs.gnb import GNB
+from mvpa.mappers.zscore import ZScoreMapper
 
 
 class SearchlightTests(unittest.TestCase):
@@ -83,8 +84,14 @@ class SearchlightTests(unittest.TestCase):
                                            indexsum='sparse', **skwargs)]
 
         # Just test nproc whenever common_variance is True
-        if externals.exists('pprocess') and common_variance:
-            sls += [sphere_searchlight(cv, nproc=2, **skwargs)]
+        if common_variance:
+            sls += [sphere_searchlight(cv, nproc=2, **skwargs),
+                    sphere_searchlight(cv, nproc=2, batch_size=5, **skwargs),
+                    sphere_gnbsearchlight(gnb, NFoldPartitioner(cvtype=1),
+                                          nproc=2, **skwargs)]
+            if externals.exists('pprocess'):
+                sls += [sphere_searchlight(cv, nproc=2, backend='pprocess',
+                                           **skwargs)]
 
         all_results = []
         for sl in sls:
@@ -266,6 +273,42 @@ class SearchlightTests(unittest.TestCase):
         self.failUnless(results.nfeatures == 2)
 
 
+    def test_dsm_searchlight(self):
+        if not externals.exists('scipy'):
+            return
+
+        from scipy.stats import spearmanr, pearsonr
+        from mvpa.misc.stats import DSMatrix
+        from mvpa.measures.ds import DSMMeasure
+
+        ds = self.dataset[:12]
+        # target: dissimilarity of the targets
+        target = DSMatrix(ds.targets, 'confusion')
+        tvec = target.get_vector_form()
+        # upper triangle including the diagonal
+        assert_equal(len(tvec), 12 * 13 / 2)
+        assert_array_equal(tvec, np.asarray(target.get_full_matrix())[
+                                            np.triu_indices(12)])
+
+        for metric, cfx in (('spearman', spearmanr), ('pearson', pearsonr)):
+            # vectorized matrix agrees with pairwise scipy computation
+            dsm = DSMatrix(ds.samples[:, :20], metric)
+            full = np.asarray(dsm.get_full_matrix())
+            assert_array_almost_equal(
+                full[2, 5], 1 - cfx(ds.samples[2, :20], ds.samples[5, :20])[0])
+            assert_array_almost_equal(full, full.T)
+
+            measure = DSMMeasure(target, 'pearson', output_metric=metric)
+            sl = sphere_searchlight(measure, radius=1, center_ids=[3, 50])
+            res = sl(ds)
+            assert_equal(res.shape, (1, 2))
+            # same value as comparing the two vector forms directly
+            roi = ds[:, sl.queryengine[3]]
+            dvec = DSMatrix(roi.samples, 'pearson').get_vector_form()
+            assert_array_almost_equal(res.samples[0, 0],
+                                      1 - cfx(tvec, dvec)[0])
+
+
     def test_1d_multispace_searchlight(self):
         ds = Dataset([np.arange(6)])
         ds.fa['coord1'] = np.repeat(np.arange(3), 2)
@@ -290,6 +333,91 @@ class SearchlightTests(unittest.TestCase):
                           nproc=1)(ds)
         assert_array_equal(res.samples,
                            [['0+2', '1+3', '0+2+4', '1+3+5', '2+4', '3+5']])
+        # and the same in parallel
+        res_par = Searchlight(measure,
+                              IndexQueryEngine(coord1=Sphere(1),
+                                               coord2=Sphere(0)),
+                              nproc=3)(ds)
+        assert_array_equal(res_par.samples, res.samples)
+        # and with dynamically scheduled batches
+        for batch_size in (1, 4, 10):
+            res_par = Searchlight(measure,
+                                  IndexQueryEngine(coord1=Sphere(1),
+                                                   coord2=Sphere(0)),
+                                  nproc=2, batch_size=batch_size)(ds)
+            assert_array_equal(res_par.samples, res.samples)
+        assert_raises(ValueError, Searchlight, measure,
+                      IndexQueryEngine(coord1=Sphere(1)), batch_size=0)
+
+
+    def test_searchlight_results_assembly(self):
+        ds = Dataset(np.arange(12).reshape(2, 6))
+        ds.fa['coord'] = np.arange(6)
+        # one sample attribute for all the ROIs
+        def roi_sum(x):
+            return Dataset(x.samples.sum(axis=1)[:, None],
+                           sa={'nfeatures': [x.nfeatures] * 2})
+        # values of varying length -- whenever the ROI size is changing
+        roi_values = lambda x: x.samples[0]
+        for nproc in (1, 2):
+            res = Searchlight(roi_sum, IndexQueryEngine(coord=Sphere(1)),
+                              nproc=nproc)(ds)
+            assert_array_equal(res.samples, [[1, 3, 6, 9, 12, 9],
+                                             [13, 21, 24, 27, 30, 21]])
+            # taken from the first ROI
+            assert_array_equal(res.sa.nfeatures, [2, 2])
+            res = Searchlight(roi_values, IndexQueryEngine(coord=Sphere(1)),
+                              nproc=nproc)(ds)
+            assert_array_equal(res.samples,
+                               [[0, 1, 0, 1, 2, 1, 2, 3, 2, 3, 4, 3, 4, 5,
+                                 4, 5]])
+
+
+    def test_searchlight_inplace_measure(self):
+        # measures modifying their input in-place must not corrupt the
+        # dataset the searchlight runs on
+        ds = Dataset(np.arange(24, dtype=float).reshape(4, 6))
+        ds.fa['coord'] = np.arange(6)
+        orig = ds.samples.copy()
+        def zscore_measure(x):
+            zm = ZScoreMapper(chunks_attr=None)
+            zm.train(x)
+            return zm.forward(x).samples.sum()
+        res = Searchlight(zscore_measure, IndexQueryEngine(coord=Sphere(1)),
+                          nproc=1)(ds)
+        assert_array_equal(ds.samples, orig)
+        assert_array_almost_equal(res.samples, np.zeros((1, 6)))
+
+
+    def test_gnbsearchlight_cache(self):
+        ds = datasets['3dsmall'].copy()
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        cache = GNBSearchlightCache()
+        permutator = AttributePermutator('targets', limit='chunks')
+        for nproc in (1, 3):
+            for indexsum in ('fancy', 'sparse'):
+                if indexsum == 'sparse' and not externals.exists('scipy'):
+                    continue
+                kwargs = dict(radius=1, indexsum=indexsum, nproc=nproc)
+                sl_cached = sphere_gnbsearchlight(GNB(), NFoldPartitioner(),
+                                                  cache=cache, **kwargs)
+                sl = sphere_gnbsearchlight(GNB(), NFoldPartitioner(),
+                                           **kwargs)
+                assert_array_equal(sl_cached(ds), sl(ds))
+                sample_stats = cache._sample_stats
+                # block stats get re-aggregated for permuted targets from
+                # the same per-sample stats, while shallow copies still
+                # share neighbors
+                for ds_perm in permutator.generate(ds):
+                    res = sl_cached(ds_perm)
+                    assert_array_equal(res, sl(ds_perm))
+                    assert_array_equal(res, sl_cached(ds_perm))
+                    assert_true(cache._sample_stats is sample_stats)
+        # reset whenever it meets new data
+        ds2 = ds.copy()
+        ds2.samples *= 2
+        assert_array_equal(sl_cached(ds2), sl(ds2))
+        assert_true(cache._samples is ds2.samples)
 
 def suite():
     return unittest.makeSuite(SearchlightTests)
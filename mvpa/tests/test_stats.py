@@ -8,16 +8,20 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 """Unit tests for PyMVPA stats helpers"""
 
+import os
+
 from mvpa.testing import *
+from mvpa.testing.tools import with_tempfile
 from mvpa.testing.datasets import datasets
 
 from mvpa import cfg
 from mvpa.base import externals
-from mvpa.clfs.stats import MCNullDist, FixedNullDist, NullDist
+from mvpa.clfs.stats import MCNullDist, FixedNullDist, NullDist, \
+     Nonparametric, NonparametricArray, StreamingNormal, StreamingHistogram
 from mvpa.generators.permutation import AttributePermutator
 from mvpa.datasets import Dataset
 from mvpa.measures.glm import GLM
-from mvpa.measures.anova import OneWayAnova, CompoundOneWayAnova
+from mvpa.measures.anova import OneWayAnova, CompoundOneWayAnova, GroupStats
 from mvpa.misc.fx import double_gamma_hrf, single_gamma_hrf
 
 
@@ -80,6 +84,111 @@ class StatsTests(unittest.TestCase):
             self.failUnlessRaises(ValueError, null.p, [5, 3, 4])
 
 
+    def test_nonparametric_array(self):
+        dist_samples = np.random.normal(size=(50, 7))
+        dist_samples[:3, 1] = np.nan
+        x = np.random.normal(size=7)
+        x[2] = np.nan
+        x[3] = dist_samples[5, 3]
+        x[4] = np.inf
+        for correction in ('clip', None):
+            na = NonparametricArray(dist_samples, correction=correction)
+            assert_equal(len(na), 7)
+            # same as the distributions on their own
+            assert_array_equal(
+                na.cdf(x),
+                [Nonparametric(s, correction=correction).cdf(v)
+                 for s, v in zip(dist_samples.T, x)])
+            assert_array_equal(na[3].cdf(x[3]), na.cdf(x)[3])
+        self.failUnlessRaises(ValueError, na.cdf, x[:3])
+        self.failUnlessRaises(ValueError, NonparametricArray, dist_samples,
+                              correction='bogus')
+
+        # is used by MCNullDist
+        null = MCNullDist(permutator, tail='left')
+        ds = datasets['uni2small']
+        null.fit(OneWayAnova(), ds)
+        self.failUnless(isinstance(null._dist, NonparametricArray))
+        assert_equal(len(null._dist), ds.nfeatures)
+
+
+    @with_tempfile()
+    def test_mcnulldist_parallel_resume(self, checkpoint):
+        ds = datasets['uni2small']
+        perm = AttributePermutator('targets', count=12)
+        anova = OneWayAnova()
+        ref = MCNullDist(perm, seed=3)
+        ref.ca.enable('dist_samples')
+        ref.fit(anova, ds)
+        # results do not depend on the number of processes
+        null = MCNullDist(perm, seed=3, nproc=2)
+        null.ca.enable('dist_samples')
+        null.fit(anova, ds)
+        assert_array_equal(null.ca.dist_samples.samples,
+                           ref.ca.dist_samples.samples)
+        # but on the seed
+        null = MCNullDist(perm, seed=4)
+        null.ca.enable('dist_samples')
+        null.fit(anova, ds)
+        self.failIf(np.all(null.ca.dist_samples.samples
+                           == ref.ca.dist_samples.samples))
+
+        # interrupt a fit after a few permutations
+        calls = []
+        def interrupted(ds):
+            if len(calls) == 5:
+                raise RuntimeError("interrupted")
+            calls.append(1)
+            return anova(ds)
+        null = MCNullDist(perm, seed=3, checkpoint=checkpoint,
+                          checkpoint_every=2)
+        self.failUnlessRaises(RuntimeError, null.fit, interrupted, ds)
+        # all completed permutations got stored
+        self.failUnless(os.path.exists(checkpoint))
+        # resume with the same seed
+        null = MCNullDist(perm, seed=4, checkpoint=checkpoint)
+        self.failUnlessRaises(ValueError, null.fit, anova, ds)
+        calls = []
+        def counted(ds):
+            calls.append(1)
+            return anova(ds)
+        null = MCNullDist(perm, checkpoint=checkpoint)
+        null.ca.enable('dist_samples')
+        null.fit(counted, ds)
+        assert_equal(len(calls), 12 - 5)
+        assert_array_equal(null.ca.dist_samples.samples,
+                           ref.ca.dist_samples.samples)
+        # and nothing to resume from anymore
+        self.failIf(os.path.exists(checkpoint))
+
+
+    def test_mcnulldist_streaming(self):
+        ds = datasets['uni2small']
+        perm = AttributePermutator('targets', count=60)
+        anova = OneWayAnova()
+        x = anova(ds).samples[0]
+        ref = MCNullDist(perm, seed=1)
+        ref.fit(anova, ds)
+        for nproc in (1, 2):
+            null = MCNullDist(perm, StreamingHistogram(nbins=200, nwarmup=20),
+                              seed=1, nproc=nproc)
+            null.fit(anova, ds)
+            assert_equal(len(null._dist), ds.nfeatures)
+            # approximates the non-parametric distribution
+            self.failUnless(np.abs(null.cdf(x) - ref.cdf(x)).max() < 0.1)
+        if externals.exists('scipy'):
+            import scipy.stats
+            ref = MCNullDist(perm, scipy.stats.norm, seed=1)
+            ref.fit(anova, ds)
+            null = MCNullDist(perm, StreamingNormal(), seed=1)
+            null.fit(anova, ds)
+            assert_array_almost_equal(null.cdf(x), ref.cdf(x))
+        # not stored
+        self.failUnlessRaises(ValueError,
+                              MCNullDist(perm, StreamingNormal(),
+                                         checkpoint='bogus').fit, anova, ds)
+
+
     def test_anova(self):
         """Do some extended testing of OneWayAnova
 
@@ -119,6 +228,82 @@ class StatsTests(unittest.TestCase):
                         msg='In compound anova, we should get different'
                         ' results for different labels. Got %s' % ac)
 
+    def test_anova_streaming(self):
+        ds = datasets['uni4large']
+        # per-class sums are identical regardless of how samples arrive
+        stats = GroupStats(ds.samples, ds.targets)
+        assert_array_equal(stats.labels, ds.sa['targets'].unique)
+        assert_array_equal(stats.counts,
+                           [np.sum(ds.targets == l) for l in stats.labels])
+
+        for measure in (OneWayAnova(), CompoundOneWayAnova()):
+            full = measure(ds)
+            # stream in blocks, the first ones lacking some labels
+            order = np.argsort(ds.targets, kind='mergesort')
+            for start in xrange(0, len(ds), 13):
+                measure.update(ds[order[start:start + 13]])
+            streamed = measure.from_stats()
+            assert_array_almost_equal(streamed.samples, full.samples)
+            assert_equal(sorted(streamed.fa.keys()), sorted(full.fa.keys()))
+            for k in full.fa.keys():
+                assert_array_almost_equal(streamed.fa[k].value,
+                                          full.fa[k].value)
+            # same from the separately computed statistics
+            assert_array_almost_equal(measure.from_stats(stats).samples,
+                                      full.samples)
+            # untraining discards the accumulated statistics
+            measure.untrain()
+            self.failUnlessRaises(RuntimeError, measure.from_stats)
+
+        self.failUnlessRaises(ValueError, stats.update, ds.samples[:, :2],
+                              ds.targets)
+
+
+    def test_glm_contrasts(self):
+        # two regressors and a constant
+        X = np.hstack((np.random.randn(40, 2), np.ones((40, 1))))
+        data = np.dot(X, [[2.0, 0.0, 1.0], [1.0, 0.0, 0.0], [5.0, 5.0, 5.0]]) \
+               + np.random.randn(40, 3)
+        ds = Dataset(data)
+
+        pe = GLM(X)(ds)
+        assert_array_almost_equal(pe.samples, np.linalg.lstsq(X, data)[0])
+        assert_array_equal(pe.sa.regressor, np.arange(3))
+
+        # chunked processing yields the same
+        for voi in ('pe', 'zstat', 'tstat'):
+            assert_array_almost_equal(GLM(X, voi=voi)(ds).samples,
+                                      GLM(X, voi=voi, chunksize=2)(ds).samples)
+
+        # t-statistics of contrasts consider the covariance of the estimates
+        residuals = data - np.dot(X, pe.samples)
+        sigma2 = np.sum(residuals ** 2, axis=0) / (len(X) - 3)
+        inv_ip = np.linalg.inv(np.dot(X.T, X))
+        contrasts = np.array([[1, -1, 0], [0, 0, 1]])
+        glm = GLM(X, voi='tstat', contrasts=contrasts,
+                  enable_ca=['zstat', 'tstat'])
+        t = glm(ds)
+        assert_equal(t.shape, (2, 3))
+        assert_array_equal(t.sa.contrast, np.arange(2))
+        for c, tc in zip(contrasts, t.samples):
+            assert_array_almost_equal(
+                tc, np.dot(c, pe.samples)
+                    / np.sqrt(sigma2 * np.dot(c, np.dot(inv_ip, c))))
+        assert_array_equal(glm.ca.tstat, t.samples.T)
+        assert_equal(glm.ca.zstat.shape, (3, 2))
+        # a single contrast vector is fine as well
+        assert_array_almost_equal(
+            GLM(X, voi='tstat', contrasts=contrasts[0])(ds).samples,
+            t.samples[:1])
+        # t-stats of individual parameters without contrasts
+        assert_array_almost_equal(
+            GLM(X, voi='tstat')(ds).samples[2],
+            GLM(X, voi='tstat', contrasts=[0, 0, 1])(ds).samples[0])
+
+        self.failUnlessRaises(ValueError, GLM, X, contrasts=[1, 0])
+        self.failUnlessRaises(ValueError, GLM, X, voi='beta')
+
+
 def suite():
     """Create the suite"""
     return unittest.makeSuite(StatsTests)
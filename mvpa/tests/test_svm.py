@@ -175,6 +175,148 @@ class SVMTests(unittest.TestCase):
             self.failUnlessRaises(TypeError, sg.SVM, C=10, kernel_type='RBF',
                                   coef0=3)
 
+
+    @reseed_rng()
+    def test_libsvm_batch_prediction(self):
+        if not externals.exists('libsvm'):
+            raise SkipTest
+        for ds, clf in ((datasets['uni2small'], libsvm.SVM(probability=1)),
+                        (datasets['uni4small'], libsvm.SVM(probability=1)),
+                        (datasets['uni4small'], libsvm.SVM(svm_impl='NU_SVC')),
+                        (datasets['sin_modulated'],
+                         libsvm.SVM(svm_impl='EPSILON_SVR')),
+                        (datasets['uni2small'],
+                         libsvm.SVM(svm_impl='ONE_CLASS'))):
+            clf.train(ds)
+            model = clf.model
+            src = ds.samples.astype(float)
+            predictions, values, prob_predictions, probabilities = \
+                model.predict_batch(src, values=True,
+                                    probabilities=bool(model.probability))
+            # must match per-sample predictions
+            assert_array_equal(predictions, [model.predict(x) for x in src])
+            assert_array_almost_equal(
+                values, [model.predict_values_raw(x) for x in src])
+            if model.probability:
+                pp = [model.predict_probability(x) for x in src]
+                assert_array_equal(prob_predictions, [p[0] for p in pp])
+                assert_array_almost_equal(
+                    probabilities,
+                    [[p[1][l] for l in model.labels] for p in pp])
+            else:
+                self.failUnless(prob_predictions is None)
+                self.failUnless(probabilities is None)
+                self.failUnlessRaises(TypeError, model.predict_batch, src,
+                                      probabilities=True)
+            # nothing but predictions by default
+            res = model.predict_batch(src)
+            assert_array_equal(res[0], predictions)
+            self.failUnless(res[1] is None)
+
+
+    def test_libsvm_problem_reuse(self):
+        if not externals.exists('libsvm'):
+            raise SkipTest
+        from mvpa.clfs.libsvmc._svm import SVMProblem
+        ds = datasets['uni2small'].copy()
+        # dense problem from an array and from a list of samples are alike
+        labels = np.arange(len(ds)) % 2
+        prob = SVMProblem(labels, ds.samples)
+        self.failUnless(prob.is_dense())
+        self.failIf(SVMProblem(labels, list(ds.samples)).is_dense())
+        assert_array_equal(prob.data['value'][:, :-1], ds.samples)
+        assert_array_equal(prob.data['index'][:, -1], -1)
+        self.failUnlessRaises(ValueError, prob.set_labels, labels[:-1])
+
+        clf = libsvm.SVM(C=-1.0, enable_ca=['estimates'])
+        clf_fresh = clf.clone()
+        for C, permute in ((-1.0, False), (-10.0, False), (-10.0, True)):
+            if permute:
+                ds.targets = ds.targets[::-1].copy()
+            clf.params.C = C
+            clf_fresh.params.C = C
+            clf.train(ds)
+            if C == -1.0 and not permute:
+                problem = clf._SVM__problem
+            # the same buffer is used for the same samples
+            self.failUnless(clf._SVM__problem is problem)
+            # the other one always starts from scratch
+            clf_fresh.untrain()
+            clf_fresh._SVM__problem = None
+            clf_fresh.train(ds)
+            assert_array_equal(clf.predict(ds), clf_fresh.predict(ds))
+            assert_array_equal(clf.ca.estimates, clf_fresh.ca.estimates)
+        # in-place changes of the samples are taken into account
+        ds.samples *= -1
+        clf.train(ds)
+        clf_fresh._SVM__problem = None
+        clf_fresh.train(ds)
+        assert_array_equal(clf.predict(ds), clf_fresh.predict(ds))
+        assert_array_equal(clf.ca.estimates, clf_fresh.ca.estimates)
+        # and classifier could still be cloned
+        clf_clone = clf.clone()
+
+
+    def test_libsvm_precomputed_kernel(self):
+        if not externals.exists('libsvm'):
+            raise SkipTest
+        from mvpa.kernels.base import CachedKernel
+        from mvpa.kernels.np import LinearKernel
+        ds = datasets['uni3medium'].copy()
+        clf = libsvm.SVM(C=1.0, enable_ca=['estimates'])
+        clf_np = libsvm.SVM(C=1.0, kernel=LinearKernel(),
+                            enable_ca=['estimates'])
+        ck = CachedKernel(LinearKernel())
+        clf_ck = libsvm.SVM(C=1.0, kernel=ck, enable_ca=['estimates'])
+
+        # the same model and predictions as with libsvm's own kernel
+        train, test = ds[ds.chunks != 0], ds[ds.chunks == 0]
+        for c in (clf, clf_np):
+            c.train(train)
+        assert_array_equal(clf.predict(test), clf_np.predict(test))
+        for e, e_np in zip(clf.ca.estimates, clf_np.ca.estimates):
+            for k in e:
+                assert_almost_equal(e[k], e_np[k])
+        # and so are sensitivities
+        assert_array_almost_equal(
+            clf.get_sensitivity_analyzer()(train).samples,
+            clf_np.get_sensitivity_analyzer()(train).samples)
+
+        # cross-validation with a precached kernel does not recompute it
+        cv = CrossValidation(clf, NFoldPartitioner())
+        cv_ck = CrossValidation(clf_ck, NFoldPartitioner())
+        ck.compute(ds)
+        ok_(ck._recomputed)
+        err, err_ck = cv(ds), cv_ck(ds)
+        ok_(not ck._recomputed)
+        assert_array_almost_equal(err.samples, err_ck.samples)
+
+
+    def test_cv_caches_kernel(self):
+        if not externals.exists('libsvm'):
+            raise SkipTest
+        from mvpa.kernels.base import CustomKernel
+        ds = datasets['uni3medium'].copy()
+        sa_keys = sorted(ds.sa.keys())
+        calls = []
+        def kernelfunc(a, b):
+            calls.append((len(a), len(b)))
+            return np.dot(a, b.T)
+        kernel = CustomKernel(kernelfunc=kernelfunc)
+        clf = libsvm.SVM(C=1.0, kernel=kernel)
+        cv = CrossValidation(clf, NFoldPartitioner())
+        err = cv(ds)
+        # computed once on the full dataset
+        self.failUnlessEqual(calls, [(len(ds), len(ds))])
+        # original kernel is back in place and input is not altered
+        self.failUnless(clf.params.kernel is kernel)
+        self.failUnlessEqual(sorted(ds.sa.keys()), sa_keys)
+        # the same as without caching
+        cv_nocache = CrossValidation(clf, NFoldPartitioner(),
+                                     cache_kernel=False)
+        assert_array_almost_equal(cv_nocache(ds).samples, err.samples)
+        self.failUnlessEqual(len(calls), 1 + 2 * len(ds.UC))
+
 def suite():
     return unittest.makeSuite(SVMTests)
 
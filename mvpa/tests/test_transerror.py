@@ -165,6 +165,79 @@ class ErrorsTests(unittest.TestCase):
         assert_equal(len(cm1.sets), 2)  # and now 2
         assert_array_equal(cm1(p + ['ho', 'aa'], t + ['ho', 'aa']), cm1.matrix)
 
+    def test_confusion_incremental(self):
+        # counts must be accumulated over the sets added in between the
+        # queries exactly as if all of them were processed at once
+        rng = np.random.RandomState(1)
+        cm = ConfusionMatrix()
+        sets = []
+        for i, nlabels in enumerate([2, 2, 3, 5, 5]):
+            t = rng.randint(nlabels, size=20)
+            p = rng.randint(nlabels, size=20)
+            if i % 2:
+                # lists with mixed types have to be handled as well
+                t, p = list(t), [int(x) for x in p]
+            cm.add(t, p)
+            sets.append((t, p))
+            cm_full = ConfusionMatrix(sets=list(sets))
+            assert_array_equal(cm.matrix, cm_full.matrix)
+            assert_equal(cm.labels, cm_full.labels)
+            assert_equal(cm.error, cm_full.error)
+            assert_equal(cm.stats['ACC'], cm_full.stats['ACC'])
+            # brute force counting
+            brute = np.zeros(cm.matrix.shape, dtype=int)
+            for t, p in sets:
+                for t_, p_ in zip(t, p):
+                    brute[cm.labels.index(p_), cm.labels.index(t_)] += 1
+            assert_array_equal(cm.matrix, brute)
+        assert_equal(len(cm.matrices), len(sets))
+        # per-set matrices must be padded for later appearing labels
+        assert_array_equal(np.sum([m.matrix for m in cm.matrices], axis=0),
+                           cm.matrix)
+        cm.reset()
+        cm.add(*sets[0])
+        assert_array_equal(cm.matrix[:2, :2],
+                           ConfusionMatrix(sets=sets[:1]).matrix)
+        assert_equal(cm.matrix.sum(), 20)
+
+
+    def test_confusion_lazy_auc(self):
+        import mvpa.clfs.transerror as te
+        computed = []
+        roccurve = te.ROCCurve
+        class CountingROCCurve(roccurve):
+            def _compute(self):
+                computed.append(len(self._sets))
+                roccurve._compute(self)
+        te.ROCCurve = CountingROCCurve
+        try:
+            cm = ConfusionMatrix()
+            estimates = [[0.8, 0.2], [0.4, 0.6], [0.3, 0.7], [0.6, 0.4]]
+            cm.add([0, 0, 1, 1], [0, 1, 1, 0], estimates)
+            # count based statistics do not need the ROC
+            stats = cm.stats
+            assert_equal(stats['ACC'], 0.5)
+            ok_('AUC' in stats)
+            assert_equal(computed, [])
+            # which is computed on the sets present whenever stats were
+            # requested
+            cm.add([0, 1], [0, 1], [[0.9, 0.1], [0.2, 0.8]])
+            assert_array_equal(stats['AUC'], [0.75, 0.75])
+            assert_equal(computed, [1])
+            ok_(cm.ROC is not None)
+            assert_equal(len(cm.stats['AUC']), 2)
+            assert_equal(computed, [1, 2])
+            assert_equal(cm.stats['mean(AUC)'], np.mean(cm.stats['AUC']))
+        finally:
+            te.ROCCurve = roccurve
+        # could still be pickled
+        from cPickle import dumps, loads
+        cm = ConfusionMatrix(sets=cm.sets)
+        stats = cm.stats
+        cm_ = loads(dumps(cm))
+        assert_array_equal(cm_.stats['AUC'], stats['AUC'])
+        assert_array_equal(cm_.ROC.aucs, stats['AUC'])
+
     @sweepargs(l_clf=clfswh['linear', 'svm'])
     def test_confusion_based_error(self, l_clf):
         train = datasets['uni2medium']